@@ -4,25 +4,45 @@ Backend Flask application for user profile management, photo analysis, diet plan
 
 import os
 import json
-import tempfile
+import contextlib
 import datetime
-from flask import Flask, request, jsonify, redirect, session, url_for
+from flask import Flask, Request, Response, request, jsonify, redirect, session, stream_with_context, url_for
 from flask_cors import CORS
 from werkzeug.utils import secure_filename
 from dotenv import load_dotenv
 from flask_session import Session
-import google.generativeai as genai
 
 load_dotenv()
 
 os.environ['OAUTHLIB_INSECURE_TRANSPORT'] = '1'
 
 from utils.calculations import calculate_all_metrics
+from utils.job_queue import JobQueue, QueueFullError
+from utils.progress_store import ProgressStore, record_from_entry, records_from_history, to_epoch
+from utils.profile_store import CachedProfileStore, ProfileVersionConflict, get_profile_store
+from utils.images import image_preprocessor, perceptual_hash
+from utils.photo_index import PhotoIndex, measurement_key
+from utils.uploads import SNIFF_BYTES, image_buffer, sniff_image_mime, upload_stream_factory
 from gemini.meal_planner import generate_diet_plan_with_gemini
-from gemini.fat_analyzer import analyze_fat_percentage_with_gemini
+from gemini.fat_analyzer import analyze_fat_percentage_stream, analyze_fat_percentage_with_gemini
+from gemini.cache import response_cache
+from gemini.backends import get_model, model_backend
+from gemini.governor import ModelOverloaded, call_governor, governed
+from gemini.resilience import CircuitOpen, resilience_policy, resilient
+from gemini.json_extract import stats as json_extract_stats
 from google_calendar_service import calendar_service
 
+class UploadRequest(Request):
+    """
+    Request that keeps uploaded files in memory up to UPLOAD_SPILL_THRESHOLD.
+    """
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return upload_stream_factory(total_content_length, content_type, filename, content_length)
+
+
 app = Flask(__name__)
+app.request_class = UploadRequest
 app.secret_key = os.getenv('FLASK_SECRET_KEY')
 if not app.secret_key:
     raise ValueError("No FLASK_SECRET_KEY set. Please set it in your .env file.")
@@ -53,18 +73,22 @@ USER_DATA_FOLDER = os.getenv('USER_DATA_FOLDER', 'user_data')
 app.config['USER_DATA_FOLDER'] = USER_DATA_FOLDER
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg'}
 
+JOB_DATA_FOLDER = os.getenv('JOB_DATA_FOLDER', 'job_data')
+PROGRESS_DATA_FOLDER = os.getenv('PROGRESS_DATA_FOLDER', 'progress_data')
+PROGRESS_HISTORY_INLINE = int(os.getenv('PROGRESS_HISTORY_INLINE', '10'))
+
 if not os.path.exists(USER_DATA_FOLDER):
     os.makedirs(USER_DATA_FOLDER)
 
+if os.getenv('GEMINI_WARMUP', 'true').lower() in ('1', 'true', 'yes'):
+    model_backend.warm_up()
 
-def get_user_profile_path(user_id):
-    """
-    Generate a safe filesystem path for a user's JSON profile based on their user_id.
-    """
-    safe_user_id = "".join(c if c.isalnum() else "_" for c in str(user_id))
-    if not safe_user_id:
-        raise ValueError("Invalid user_id for file path generation.")
-    return os.path.join(app.config['USER_DATA_FOLDER'], f"{safe_user_id}.json")
+
+PROFILE_WRITE_ATTEMPTS = int(os.getenv('PROFILE_WRITE_ATTEMPTS', '5'))
+
+profile_store = get_profile_store(USER_DATA_FOLDER)
+progress_store = ProgressStore(PROGRESS_DATA_FOLDER)
+calendar_service.start_token_refresher(USER_DATA_FOLDER)
 
 
 def load_user_profile(user_id):
@@ -72,11 +96,7 @@ def load_user_profile(user_id):
     Load and return the JSON profile for the given user_id, or an empty dict if none exists.
     """
     try:
-        profile_path = get_user_profile_path(user_id)
-        if os.path.exists(profile_path):
-            with open(profile_path, 'r') as f:
-                return json.load(f)
-        return {}
+        return profile_store.load(user_id)
     except ValueError as e:
         app.logger.error(f"Error getting profile path for {user_id}: {e}")
         raise
@@ -88,15 +108,16 @@ def load_user_profile(user_id):
         raise
 
 
-def save_user_profile(user_id, data):
+def save_user_profile(user_id, data, expected_version=None):
     """
-    Save the given data dict as the user's JSON profile. Returns True on success.
+    Save the given data dict as the user's JSON profile and record its new '_version'. Returns True on success.
+    Raises ProfileVersionConflict if expected_version is given and the stored profile has moved on.
     """
     try:
-        profile_path = get_user_profile_path(user_id)
-        with open(profile_path, 'w') as f:
-            json.dump(data, f, indent=4)
+        data['_version'] = profile_store.save(user_id, data, expected_version)
         return True
+    except ProfileVersionConflict:
+        raise
     except ValueError as e:
         app.logger.error(f"Error getting profile path for saving {user_id}: {e}")
         return False
@@ -108,6 +129,56 @@ def save_user_profile(user_id, data):
         return False
 
 
+def modify_user_profile(user_id, apply, expected_version=None):
+    """
+    Apply apply(profile) to the latest stored profile and save it with optimistic concurrency.
+
+    On a version conflict the profile is reloaded and apply re-run, up to PROFILE_WRITE_ATTEMPTS
+    times. A caller-supplied expected_version (e.g. from If-Match) is not retried; its conflict is raised.
+    Returns the saved profile, or None if it could not be saved.
+    """
+    for _ in range(PROFILE_WRITE_ATTEMPTS):
+        profile = load_user_profile(user_id)
+        apply(profile)
+        version = expected_version if expected_version is not None else profile.get('_version', 0)
+        try:
+            return profile if save_user_profile(user_id, profile, expected_version=version) else None
+        except ProfileVersionConflict:
+            if expected_version is not None:
+                raise
+            app.logger.info(f"Concurrent update of profile {user_id}, retrying")
+    app.logger.error(f"Gave up saving profile {user_id} after {PROFILE_WRITE_ATTEMPTS} conflicting attempts")
+    return None
+
+
+def append_user_progress(user_id, entry, fields, merge=None):
+    """
+    Append a progress entry and update the given profile fields in one store write.
+    ``merge`` sets keys inside dict fields without replacing their other keys (see ProfileStore.append_progress).
+    The profile keeps only the newest PROGRESS_HISTORY_INLINE entries; the full history lives in progress_store.
+    Returns the profile's new version, or None on failure.
+    """
+    try:
+        return profile_store.append_progress(user_id, entry, fields, keep_last=PROGRESS_HISTORY_INLINE, merge=merge)
+    except Exception as e:
+        app.logger.error(f"Could not save progress for user {user_id}: {e}")
+        return None
+
+
+def seed_progress_log(user_id, user_profile=None):
+    """
+    Fill an empty progress log from the profile's inline progress_history.
+    Users who have not posted progress since the log was introduced start with an empty log;
+    it is seeded on their first read or write, so no migration step is required.
+    Returns True if the log was seeded.
+    """
+    if progress_store.count(user_id):
+        return False
+    if user_profile is None:
+        user_profile = load_user_profile(user_id)
+    return progress_store.seed(user_id, records_from_history(user_profile.get('progress_history')))
+
+
 def allowed_file(filename):
     """
     Check if the uploaded filename has an allowed image extension.
@@ -250,35 +321,44 @@ def create_or_update_profile(user_id):
     if measurements and (not measurements.get('height_cm') or not measurements.get('weight_kg')):
         return jsonify({"error": "Height and Weight are mandatory in measurements."}), 400
 
+    expected_version = request.headers.get('If-Match', '').strip('"') or None
+    if expected_version is not None and not expected_version.isdigit():
+        return jsonify({"error": "If-Match must be a profile version"}), 400
+
+    def apply(current_profile):
+        current_profile['user_id'] = user_id
+        current_profile['age'] = data.get('age', current_profile.get('age'))
+        current_profile['gender'] = data.get('gender', current_profile.get('gender'))
+
+        if measurements:
+            current_profile['measurements'] = measurements
+            calculated_metrics = calculate_all_metrics(measurements, current_profile['gender'])
+            current_profile['calculated_metrics'] = calculated_metrics
+            if 'bfp_from_measurements_navy' in calculated_metrics:
+                current_profile.setdefault('body_fat_estimates', {})['from_measurements'] = {
+                    "value": calculated_metrics['bfp_from_measurements_navy'],
+                    "timestamp": datetime.datetime.utcnow().isoformat() + "Z",
+                    "formula_used": "Navy Method"
+                }
+
+        lifestyle = data.get('lifestyle')
+        if lifestyle:
+            current_profile['lifestyle'] = lifestyle
+        current_profile.setdefault('progress_history', [])
+        current_profile.setdefault('body_fat_estimates', {})
+
     try:
-        current_profile = load_user_profile(user_id)
+        current_profile = modify_user_profile(user_id, apply, expected_version)
+    except ProfileVersionConflict as e:
+        return jsonify({"error": str(e), "current_version": e.actual}), 412
     except Exception as e:
         app.logger.error(f"Failed to load profile for {user_id} during update: {e}")
         return jsonify({"error": f"Failed to load profile: {str(e)}"}), 500
 
-    current_profile['user_id'] = user_id
-    current_profile['age'] = data.get('age', current_profile.get('age'))
-    current_profile['gender'] = data.get('gender', current_profile.get('gender'))
-
-    if measurements:
-        current_profile['measurements'] = measurements
-        calculated_metrics = calculate_all_metrics(measurements, current_profile['gender'])
-        current_profile['calculated_metrics'] = calculated_metrics
-        if 'bfp_from_measurements_navy' in calculated_metrics:
-            current_profile.setdefault('body_fat_estimates', {})['from_measurements'] = {
-                "value": calculated_metrics['bfp_from_measurements_navy'],
-                "timestamp": datetime.datetime.utcnow().isoformat() + "Z",
-                "formula_used": "Navy Method"
-            }
-
-    lifestyle = data.get('lifestyle')
-    if lifestyle:
-        current_profile['lifestyle'] = lifestyle
-    current_profile.setdefault('progress_history', [])
-    current_profile.setdefault('body_fat_estimates', {})
-
-    if save_user_profile(user_id, current_profile):
-        return jsonify({"message": "Profile updated successfully", "profile": current_profile}), 200
+    if current_profile is not None:
+        response = jsonify({"message": "Profile updated successfully", "profile": current_profile})
+        response.set_etag(str(current_profile['_version']))
+        return response, 200
     else:
         return jsonify({"error": f"Failed to save profile for user {user_id}"}), 500
 
@@ -294,16 +374,175 @@ def get_profile(user_id):
         profile_data = load_user_profile(user_id)
         if not profile_data:
             return jsonify({"message": f"No profile found for user {user_id}. Please create one."}), 404
-        return jsonify(profile_data), 200
+        response = jsonify(profile_data)
+        response.set_etag(str(profile_data.get('_version', 0)))
+        return response.make_conditional(request)
     except Exception as e:
         app.logger.error(f"Failed to get profile for {user_id}: {e}")
         return jsonify({"error": f"Failed to retrieve profile: {str(e)}"}), 500
 
 
+def save_photo_estimate(user_id, analysis_result):
+    """
+    Store an analysis result as the profile's body_fat_estimates.from_photo.
+    Returns the new profile version, or None if it could not be saved.
+    """
+    from_photo = {
+        "value": analysis_result.get('yag_orani'),
+        "timestamp": datetime.datetime.utcnow().isoformat() + "Z",
+        "analysis": analysis_result.get('analiz'),
+        "bmi": analysis_result.get('bmi'),
+        "bmi_comment": analysis_result.get('bmi_yorum'),
+        "bko": analysis_result.get('bko'),
+        "bko_comment": analysis_result.get('bko_yorum'),
+        "exercise_program": analysis_result.get('egzersiz_programi'),
+        "diet_plan": analysis_result.get('diyet_listesi')
+    }
+
+    def apply(profile):
+        profile.setdefault('body_fat_estimates', {})['from_photo'] = from_photo
+
+    profile = modify_user_profile(user_id, apply)
+    return profile.get('_version') if profile is not None else None
+
+
+def find_duplicate_analysis(user_id, user_profile, photo_hash):
+    """
+    Return a stored analysis of a near-identical photo taken with the same measurements, or None.
+    A match becomes the profile's current from_photo estimate again.
+    """
+    if photo_index is None or photo_hash is None:
+        return None
+    match = photo_index.find(user_id, photo_hash, measurement_key(user_profile), PHOTO_DEDUP_DISTANCE)
+    if match is None:
+        return None
+    analysis_result, distance = match
+    app.logger.info(f"Reusing photo analysis for user {user_id} (hash distance {distance})")
+    if save_photo_estimate(user_id, analysis_result) is None:
+        app.logger.error(f"Failed to restore photo estimate for user {user_id}")
+    return analysis_result
+
+
+def store_photo_analysis(user_id, user_profile, image, mime_type=None, photo_hash=None):
+    """
+    Run the Gemini photo analysis for a loaded profile and save the estimate into it.
+    ``image`` is a file path or the photo bytes (e.g. a memoryview of the upload).
+    Complete analyses are added to the duplicate-photo index under ``photo_hash``,
+    which is computed here when not given.
+    Returns the analysis result, or None if the updated profile could not be saved.
+    """
+    with image_buffer(image) as image_bytes:
+        if photo_index is not None and photo_hash is None:
+            photo_hash = perceptual_hash(image_bytes)
+        analysis_result = analyze_fat_percentage_with_gemini(user_profile, image=image_bytes, mime_type=mime_type)
+    return record_photo_analysis(user_id, user_profile, analysis_result, photo_hash)
+
+
+def record_photo_analysis(user_id, user_profile, analysis_result, photo_hash=None):
+    """
+    Save a finished analysis into the profile and, when complete, the duplicate-photo index.
+    Returns the analysis result, or None if the updated profile could not be saved.
+    """
+    if save_photo_estimate(user_id, analysis_result) is None:
+        return None
+    if photo_index is not None and photo_hash is not None and not analysis_result.get('eksik_bolumler'):
+        photo_index.add(user_id, photo_hash, measurement_key(user_profile), analysis_result)
+    return analysis_result
+
+
+def overloaded_response(error):
+    """
+    Build the response for a model call shed by the call governor (429) or the open circuit breaker (503).
+    """
+    response = jsonify({"error": f"Gemini is busy, please retry later: {str(error)}", "retry_after": error.retry_after})
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response, 503 if isinstance(error, CircuitOpen) else 429
+
+
+def format_stream_event(event, data, stream_format):
+    """
+    Encode one analysis event as a Server-Sent Event or an NDJSON line.
+    """
+    payload = json.dumps(data, ensure_ascii=False)
+    if stream_format == 'ndjson':
+        return f'{{"event": "{event}", "data": {payload}}}\n'
+    return f"event: {event}\ndata: {payload}\n\n"
+
+
+def stream_photo_analysis(user_id, user_profile, stream, mime_type, photo_hash, stream_format):
+    """
+    Generate the streamed /analyze-photo response; the result is saved when the "sonuc" event arrives.
+    """
+    try:
+        with image_buffer(stream) as image:
+            with contextlib.closing(analyze_fat_percentage_stream(user_profile, image=image, mime_type=mime_type)) as events:
+                for event, data in events:
+                    if event == 'sonuc' and record_photo_analysis(user_id, user_profile, data, photo_hash) is None:
+                        yield format_stream_event('hata', {"error": "Failed to save analysis results"}, stream_format)
+                        return
+                    yield format_stream_event(event, data, stream_format)
+    except ModelOverloaded as e:
+        app.logger.warning(f"Photo analysis for user {user_id} shed: {str(e)}")
+        yield format_stream_event('hata', {"error": f"Gemini is busy, please retry later: {str(e)}",
+                                           "retry_after": e.retry_after}, stream_format)
+    except Exception as e:
+        app.logger.error(f"Error streaming photo analysis for user {user_id}: {str(e)}")
+        yield format_stream_event('hata', {"error": f"Failed to analyze photo: {str(e)}"}, stream_format)
+
+
+def run_photo_analysis_job(user_id, image_path):
+    """
+    Background job handler: reload the profile and analyze the spooled photo.
+    """
+    user_profile = load_user_profile(user_id)
+    if not user_profile:
+        raise ValueError("User profile not found. Please create a profile first.")
+    analysis_result = store_photo_analysis(user_id, user_profile, image_path)
+    if analysis_result is None:
+        raise IOError("Failed to save analysis results")
+    return analysis_result
+
+
+STREAM_MIMETYPES = {'ndjson': 'application/x-ndjson'}
+
+PHOTO_DEDUP_DISTANCE = int(os.getenv('PHOTO_DEDUP_DISTANCE', '6'))
+photo_index = (
+    PhotoIndex(os.getenv('PHOTO_INDEX_PATH') or os.path.join(JOB_DATA_FOLDER, 'photo_index.sqlite3'),
+               max_per_user=int(os.getenv('PHOTO_INDEX_PER_USER', '20')))
+    if os.getenv('PHOTO_DEDUP', 'true').lower() in ('1', 'true', 'yes') else None
+)
+
+photo_jobs = JobQueue(
+    db_path=os.path.join(JOB_DATA_FOLDER, 'jobs.sqlite3'),
+    spool_dir=os.path.join(JOB_DATA_FOLDER, 'uploads'),
+    handler=run_photo_analysis_job,
+    max_workers=int(os.getenv('PHOTO_JOB_WORKERS', '4')),
+    max_pending=int(os.getenv('PHOTO_JOB_MAX_PENDING', '100')),
+    stale_after_seconds=float(os.getenv('PHOTO_JOB_STALE_SECONDS', '120')),
+    retention_seconds=float(os.getenv('PHOTO_JOB_RETENTION_HOURS', '168')) * 3600
+)
+photo_jobs.start()
+
+
 @app.route('/analyze-photo/<user_id>', methods=['POST'])
 def analyze_body_photo(user_id):
     """
     Receive a user photo, analyze body fat via Gemini, update profile, and return analysis results.
+
+    With ``?mode=async`` the photo is queued and a job id is returned immediately (202);
+    poll ``/jobs/<job_id>`` and fetch ``/jobs/<job_id>/result`` once it is done.
+
+    With ``?mode=stream`` the response is a Server-Sent Events stream (``&format=ndjson``
+    for JSON lines): the local BMI/BKO first, then each model section as it completes,
+    model text chunks as they arrive, and finally the full result as ``sonuc``.
+
+    A near-duplicate of a photo already analyzed with the same measurements returns
+    the stored analysis (200, ``X-Photo-Dedup: hit``) without a model call, in either
+    mode; ``?refresh=1`` forces a new analysis.
+
+    When the Gemini call governor is saturated, or the user already has too many
+    calls in progress, the request is rejected with 429 and a Retry-After header;
+    while the circuit breaker is open after repeated Gemini failures, with 503.
     """
     if not user_id:
         return jsonify({"error": "user_id is required"}), 400
@@ -315,51 +554,107 @@ def analyze_body_photo(user_id):
         return jsonify({"error": "No selected file"}), 400
 
     if file and allowed_file(file.filename):
-        temp_file_handler = None
+        mime_type = sniff_image_mime(file.stream.read(SNIFF_BYTES))
+        file.stream.seek(0)
+        if mime_type is None:
+            return jsonify({"error": "Invalid file type"}), 400
+
         try:
             user_profile = load_user_profile(user_id)
             if not user_profile:
                 return jsonify({"error": "User profile not found. Please create a profile first."}), 404
 
             _, ext = os.path.splitext(secure_filename(file.filename))
-            temp_file_handler, temp_file_path = tempfile.mkstemp(suffix=ext)
-            file.save(temp_file_path)
-
-            analysis_result = analyze_fat_percentage_with_gemini(user_profile, temp_file_path)
-
-            user_profile.setdefault('body_fat_estimates', {})['from_photo'] = {
-                "value": analysis_result.get('yag_orani'),
-                "timestamp": datetime.datetime.utcnow().isoformat() + "Z",
-                "analysis": analysis_result.get('analiz'),
-                "bmi": analysis_result.get('bmi'),
-                "bmi_comment": analysis_result.get('bmi_yorum'),
-                "bko": analysis_result.get('bko'),
-                "bko_comment": analysis_result.get('bko_yorum'),
-                "exercise_program": analysis_result.get('egzersiz_programi'),
-                "diet_plan": analysis_result.get('diyet_listesi')
-            }
-
-            if not save_user_profile(user_id, user_profile):
+
+            stream_format = request.args.get('format')
+            photo_hash = None
+            if photo_index is not None:
+                with image_buffer(file.stream) as image:
+                    photo_hash = perceptual_hash(image)
+            if request.args.get('refresh', '').lower() not in ('1', 'true', 'yes'):
+                duplicate = find_duplicate_analysis(user_id, user_profile, photo_hash)
+                if duplicate is not None:
+                    if request.args.get('mode') == 'stream':
+                        response = Response(format_stream_event('sonuc', duplicate, stream_format),
+                                            mimetype=STREAM_MIMETYPES.get(stream_format, 'text/event-stream'))
+                    else:
+                        response = jsonify(duplicate)
+                    response.headers['X-Photo-Dedup'] = 'hit'
+                    return response, 200
+
+            if request.args.get('mode') == 'async':
+                try:
+                    job_id = photo_jobs.submit(user_id, file.stream, suffix=ext)
+                except QueueFullError as e:
+                    return jsonify({"error": str(e)}), 503
+                return jsonify({
+                    "job_id": job_id,
+                    "status": "queued",
+                    "status_url": url_for('get_job_status', job_id=job_id, _external=True),
+                    "result_url": url_for('get_job_result', job_id=job_id, _external=True)
+                }), 202
+
+            # Shed before starting a sync or streamed analysis rather than queueing behind a full governor.
+            if resilience_policy is not None:
+                resilience_policy.breaker.check()
+            if call_governor is not None:
+                call_governor.check(user_id)
+
+            if request.args.get('mode') == 'stream':
+                response = Response(
+                    stream_with_context(stream_photo_analysis(
+                        user_id, user_profile, file.stream, mime_type, photo_hash, stream_format)),
+                    mimetype=STREAM_MIMETYPES.get(stream_format, 'text/event-stream'))
+                response.headers['Cache-Control'] = 'no-cache'
+                response.headers['X-Accel-Buffering'] = 'no'
+                return response
+
+            # The upload is passed as a view of its request buffer; no temp file.
+            with image_buffer(file.stream) as image:
+                analysis_result = store_photo_analysis(user_id, user_profile, image, mime_type, photo_hash)
+            if analysis_result is None:
                 return jsonify({"error": "Failed to save analysis results"}), 500
 
             return jsonify(analysis_result), 200
 
+        except ModelOverloaded as e:
+            app.logger.warning(f"Photo analysis for user {user_id} shed: {str(e)}")
+            return overloaded_response(e)
         except Exception as e:
             app.logger.error(f"Error analyzing photo for user {user_id}: {str(e)}")
             app.logger.exception("Full traceback:")
             return jsonify({"error": f"Failed to analyze photo: {str(e)}"}), 500
 
-        finally:
-            if temp_file_handler:
-                os.close(temp_file_handler)
-                try:
-                    os.unlink(temp_file_path)
-                except Exception as e:
-                    app.logger.error(f"Error cleaning up temp file: {str(e)}")
-
     return jsonify({"error": "Invalid file type"}), 400
 
 
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job_status(job_id):
+    """
+    Return the status record of a background photo analysis job.
+    """
+    job = photo_jobs.get(job_id)
+    if not job:
+        return jsonify({"error": f"No job found with id {job_id}"}), 404
+    job.pop('result', None)
+    return jsonify(job), 200
+
+
+@app.route('/jobs/<job_id>/result', methods=['GET'])
+def get_job_result(job_id):
+    """
+    Return the analysis result of a finished job, or its status while it is still pending.
+    """
+    job = photo_jobs.get(job_id)
+    if not job:
+        return jsonify({"error": f"No job found with id {job_id}"}), 404
+    if job['status'] == 'done':
+        return jsonify(job['result']), 200
+    if job['status'] == 'failed':
+        return jsonify({"error": f"Failed to analyze photo: {job['error']}", "status": job['status']}), 500
+    return jsonify({"job_id": job_id, "status": job['status']}), 202
+
+
 @app.route('/generate-diet-plan/<user_id>', methods=['POST'])
 def generate_diet(user_id):
     """
@@ -406,13 +701,15 @@ def generate_diet(user_id):
         "progress_history": user_profile.get("progress_history", [])
     }
 
-    diet_plan = generate_diet_plan_with_gemini(data_for_gemini)
+    try:
+        diet_plan = generate_diet_plan_with_gemini(data_for_gemini)
+    except ModelOverloaded as e:
+        return overloaded_response(e)
 
     if diet_plan and "error" not in diet_plan:
-        user_profile['current_diet_plan'] = diet_plan
         diet_plan.setdefault("notes_from_gemini", "")
         diet_plan["notes_from_gemini"] = context_msg + "\n" + diet_plan["notes_from_gemini"]
-        if save_user_profile(user_id, user_profile):
+        if modify_user_profile(user_id, lambda profile: profile.update(current_diet_plan=diet_plan)) is not None:
             return jsonify({"message": "Diet plan generated", "diet_plan": diet_plan, "context_message": context_msg}), 200
         else:
             return jsonify({"error": "Plan generated, but failed to save profile"}), 500
@@ -439,7 +736,11 @@ def schedule_checkup_route(user_id):
     except Exception as e:
         return jsonify({"error": f"Failed to load profile for scheduling: {str(e)}"}), 500
 
-    calendar_service_instance = calendar_service.get_calendar_service(user_id, app.config['USER_DATA_FOLDER'])
+    try:
+        calendar_service_instance = calendar_service.get_calendar_service(user_id, app.config['USER_DATA_FOLDER'])
+    except ValueError as e:
+        app.logger.error(f"Google Calendar is not configured: {str(e)}")
+        return jsonify({"error": f"Google Calendar is not configured: {str(e)}"}), 500
     if not calendar_service_instance:
         auth_url = url_for('authorize_google_calendar_route', user_id=user_id, _external=True)
         return jsonify({
@@ -448,27 +749,38 @@ def schedule_checkup_route(user_id):
             "authorization_url": auth_url
         }), 401
 
-    old_event_id = user_profile.get("checkup_preference", {}).get("google_calendar_event_id")
-    if old_event_id:
-        calendar_service.delete_event(user_id, app.config['USER_DATA_FOLDER'], old_event_id)
-
-    event_id = calendar_service.create_weekly_checkup(
-        user_id,
-        app.config['USER_DATA_FOLDER'],
-        data['day_of_week'],
-        data['time_of_day']
-    )
+    preference = user_profile.get("checkup_preference") or {}
+    # Old events whose delete failed earlier are retried along with the current one.
+    old_event_ids = [preference.get("google_calendar_event_id"), *preference.get("stale_event_ids", [])]
+    try:
+        # Deleting the old event and creating the new one share one batch request.
+        result = calendar_service.create_weekly_checkup(
+            user_id,
+            app.config['USER_DATA_FOLDER'],
+            data['day_of_week'],
+            data['time_of_day'],
+            replace_event_id=old_event_ids
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
-    if event_id:
-        user_profile['checkup_preference'] = {
+    if result.event_id:
+        checkup_preference = {
             "day_of_week": data['day_of_week'],
             "time_of_day": data['time_of_day'],
-            "google_calendar_event_id": event_id
+            "google_calendar_event_id": result.event_id
         }
-        if save_user_profile(user_id, user_profile):
-            return jsonify({"message": "Weekly check-up scheduled in your Google Calendar.", "event_id": event_id}), 200
-        else:
-            return jsonify({"message": f"Check-up scheduled, but failed to update profile. Event ID: {event_id}"}), 500
+        if result.undeleted_event_ids:
+            checkup_preference["stale_event_ids"] = list(result.undeleted_event_ids)
+        if modify_user_profile(user_id, lambda profile: profile.update(checkup_preference=checkup_preference)) is None:
+            return jsonify({"message": f"Check-up scheduled, but failed to update profile. Event ID: {result.event_id}"}), 500
+        if result.undeleted_event_ids:
+            return jsonify({
+                "error": "Check-up scheduled, but the previous event could not be removed. Retry to remove it.",
+                "event_id": result.event_id,
+                "stale_event_ids": list(result.undeleted_event_ids)
+            }), 502
+        return jsonify({"message": "Weekly check-up scheduled in your Google Calendar.", "event_id": result.event_id}), 200
     else:
         auth_url = url_for('authorize_google_calendar_route', user_id=user_id, _external=True)
         return jsonify({
@@ -506,21 +818,33 @@ def track_user_progress(user_id):
         if 'notes' in data:
             progress_entry['notes'] = data['notes']
 
-        current_profile.setdefault('progress_history', []).append(progress_entry)
-        current_profile['measurements'] = data['measurements']
+        record = record_from_entry(progress_entry)
+        # The profile keeps only the newest entries inline, so a log that was
+        # never seeded gets the profile's history first or it would be lost.
+        seed_progress_log(user_id, current_profile)
 
         calculated_metrics = calculate_all_metrics(data['measurements'], current_profile.get('gender'))
-        current_profile['calculated_metrics'] = calculated_metrics
-
+        updated_fields = {
+            'measurements': data['measurements'],
+            'calculated_metrics': calculated_metrics
+        }
+        # Only from_measurements is written, so a concurrent /analyze-photo
+        # update of body_fat_estimates.from_photo is kept.
+        merge = {}
         if 'bfp_from_measurements_navy' in calculated_metrics:
-            current_profile.setdefault('body_fat_estimates', {})['from_measurements'] = {
+            merge['body_fat_estimates'] = {'from_measurements': {
                 "value": calculated_metrics['bfp_from_measurements_navy'],
                 "timestamp": progress_entry['timestamp'],
                 "formula_used": "Navy Method"
-            }
-
-        if save_user_profile(user_id, current_profile):
-            return jsonify({"message": "Progress tracked successfully", "profile": current_profile}), 200
+            }}
+        new_version = append_user_progress(user_id, progress_entry, updated_fields, merge)
+        if new_version is not None:
+            # Only after the profile write, so a retried failed request is not logged twice.
+            try:
+                progress_store.append(user_id, record)
+            except Exception as e:
+                app.logger.error(f"Could not append progress log for user {user_id}: {e}")
+            return jsonify({"message": "Progress tracked successfully", "profile": load_user_profile(user_id)}), 200
         else:
             return jsonify({"error": "Failed to save progress"}), 500
 
@@ -529,6 +853,46 @@ def track_user_progress(user_id):
         return jsonify({"error": f"Failed to track progress: {str(e)}"}), 500
 
 
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """
+    Return in-process performance counters as JSON.
+    """
+    return jsonify({
+        "gemini_response_cache": response_cache.stats() if response_cache else None,
+        "gemini_json_parse": json_extract_stats(),
+        "gemini_call_governor": call_governor.stats() if call_governor else None,
+        "gemini_resilience": resilience_policy.stats() if resilience_policy else None,
+        "calendar_service_cache": calendar_service.service_cache_stats(),
+        "calendar_token_refresh": calendar_service.token_refresh_stats(),
+        "image_preprocessing": image_preprocessor.stats() if image_preprocessor else None,
+        "profile_cache": profile_store.stats() if isinstance(profile_store, CachedProfileStore) else None
+    }), 200
+
+
+@app.route('/progress/<user_id>', methods=['GET'])
+def get_progress_history(user_id):
+    """
+    Return the user's progress history, optionally limited to a time range and downsampled.
+
+    Query parameters: from / to (ISO-8601 or Unix seconds) and max_points.
+    """
+    try:
+        start = to_epoch(request.args['from']) if request.args.get('from') else None
+        end = to_epoch(request.args['to']) if request.args.get('to') else None
+        max_points = int(request.args.get('max_points', 0))
+    except ValueError as e:
+        return jsonify({"error": f"Invalid query parameter: {str(e)}"}), 400
+
+    try:
+        seed_progress_log(user_id)
+        entries = progress_store.query(user_id, start, end, max_points=max_points or None)
+    except Exception as e:
+        app.logger.error(f"Failed to read progress for {user_id}: {e}")
+        return jsonify({"error": f"Failed to read progress: {str(e)}"}), 500
+    return jsonify({"user_id": user_id, "count": len(entries), "entries": entries}), 200
+
+
 @app.route('/test-gemini', methods=['GET'])
 def test_gemini():
     """
@@ -536,19 +900,21 @@ def test_gemini():
     """
     try:
         api_key = os.getenv('GEMINI_API_KEY')
-        if not api_key:
+        if not api_key and model_backend.name == 'gemini':
             return jsonify({"error": "GEMINI_API_KEY not found in environment variables"}), 500
 
-        genai.configure(api_key=api_key)
-        model = genai.GenerativeModel(model_name="gemini-1.5-flash")
+        model = resilient(governed(get_model()))
         response = model.generate_content("Say hello!")
 
         return jsonify({
             "status": "success",
             "message": "Gemini API is properly configured",
+            "backend": model_backend.name,
             "response": response.text
         }), 200
 
+    except ModelOverloaded as e:
+        return overloaded_response(e)
     except Exception as e:
         app.logger.error(f"Gemini API test failed: {str(e)}")
         return jsonify({
@@ -0,0 +1,277 @@
+"""
+Recompute calculated_metrics and body_fat_estimates.from_measurements for every stored profile.
+
+Usage:
+    python backfill_metrics.py [--folder user_data] [--backend json|sqlite] [--workers N]
+                               [--chunk-size 200] [--dry-run] [--checkpoint PATH] [--resume]
+
+Run after a change to the formulas in utils/calculations.py. Profiles are
+read in user id order and recomputed in chunks on a process pool: the
+profile's own measurements and the measurements of every progress_history
+entry (using the entry's weight and the profile's height) go through
+calculate_all_metrics_batch. Changed profiles are written back one chunk at
+a time with ProfileStore.save_many, guarded by the version each worker read,
+so a concurrent edit from the app is reloaded and recomputed instead of
+overwritten.
+
+After every written chunk the last user id is recorded in the checkpoint
+file; ``--resume`` continues after it. The checkpoint is removed when a run
+completes.
+"""
+
+import argparse
+import copy
+import datetime
+import json
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from dotenv import load_dotenv
+
+from utils.calculations import calculate_all_metrics_batch
+from utils.profile_store import PROGRESS_FIELD, VERSION_FIELD, ProfileVersionConflict, create_profile_store
+
+load_dotenv()
+
+CONFLICT_ATTEMPTS = 3
+
+_worker_store = None
+
+
+def recompute_profiles(profiles, timestamp):
+    """
+    Recompute the metrics of several profiles with one batch call.
+
+    Args:
+        profiles (list of dict): Profiles as returned by ProfileStore.load; not modified.
+        timestamp (str): ISO timestamp recorded on a from_measurements estimate whose value changed.
+
+    Returns:
+        list of tuple: ``(profile, changed, entries)`` per input, where ``profile`` is the
+            updated copy, ``changed`` tells whether anything differs from the input and
+            ``entries`` is the number of progress entries recomputed.
+    """
+    rows, genders, targets = [], [], []
+    updated = [copy.deepcopy(profile) for profile in profiles]
+    for index, profile in enumerate(updated):
+        gender = profile.get('gender')
+        measurements = profile.get('measurements')
+        if measurements:
+            rows.append(measurements)
+            genders.append(gender)
+            targets.append((index, None))
+        height = (measurements or {}).get('height_cm')
+        for entry in profile.get(PROGRESS_FIELD) or []:
+            if not isinstance(entry, dict) or not entry.get('measurements'):
+                continue
+            row = {'height_cm': height, **entry['measurements']}
+            if entry.get('weight_kg') is not None:
+                row['weight_kg'] = entry['weight_kg']
+            rows.append(row)
+            genders.append(gender)
+            targets.append((index, entry))
+
+    entry_counts = [0] * len(updated)
+    for (index, entry), metrics in zip(targets, calculate_all_metrics_batch(rows, genders)):
+        if entry is not None:
+            entry['calculated_metrics'] = metrics
+            entry_counts[index] += 1
+            continue
+        profile = updated[index]
+        profile['calculated_metrics'] = metrics
+        if 'bfp_from_measurements_navy' in metrics:
+            estimates = profile.setdefault('body_fat_estimates', {})
+            previous = estimates.get('from_measurements') or {}
+            if previous.get('value') != metrics['bfp_from_measurements_navy']:
+                estimates['from_measurements'] = {
+                    "value": metrics['bfp_from_measurements_navy'],
+                    "timestamp": timestamp,
+                    "formula_used": "Navy Method"
+                }
+
+    return [
+        (profile, profile != original, entries)
+        for profile, original, entries in zip(updated, profiles, entry_counts)
+    ]
+
+
+def _init_worker(folder, backend):
+    # Each worker opens its own store: sqlite connections must not cross a fork.
+    global _worker_store
+    _worker_store = create_profile_store(folder, backend)
+
+
+def _recompute_chunk(user_ids, timestamp, store=None):
+    """
+    Load and recompute a chunk of profiles.
+
+    Returns:
+        list of tuple: ``(user_id, profile, version, changed, entries)`` per loaded
+            profile, or ``(user_id, None, None, False, 0)`` for one that could not be read.
+    """
+    store = store or _worker_store
+    loaded, results = [], {}
+    for user_id in user_ids:
+        try:
+            profile = store.load(user_id)
+        except (ValueError, OSError) as e:
+            print(f"Skipping {user_id}: {e}", file=sys.stderr)
+            profile = None
+        if profile is None:
+            results[user_id] = (user_id, None, None, False, 0)
+        else:
+            loaded.append((user_id, profile))
+
+    recomputed = recompute_profiles([profile for _, profile in loaded], timestamp)
+    for (user_id, original), (profile, changed, entries) in zip(loaded, recomputed):
+        # Unversioned profiles are stored as version 0; None would skip the conflict check.
+        results[user_id] = (user_id, profile, original.get(VERSION_FIELD, 0), changed, entries)
+    return [results[user_id] for user_id in user_ids]
+
+
+def _retry_conflict(store, user_id, timestamp):
+    """
+    Reload, recompute and save one profile whose bulk write hit a version conflict.
+
+    Returns:
+        bool: True once saved, False if it still conflicted after CONFLICT_ATTEMPTS.
+    """
+    for _ in range(CONFLICT_ATTEMPTS):
+        _, profile, version, changed, _ = _recompute_chunk([user_id], timestamp, store)[0]
+        if profile is None or not changed:
+            return True
+        try:
+            store.save(user_id, profile, expected_version=version)
+            return True
+        except ProfileVersionConflict:
+            continue
+    return False
+
+
+def read_checkpoint(path):
+    """
+    Return the saved checkpoint dict, or None if there is none.
+    """
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def write_checkpoint(path, state):
+    """
+    Atomically replace the checkpoint file with ``state``.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix='.tmp-', suffix='.json', dir=directory)
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(state, f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def backfill(folder, backend=None, workers=None, chunk_size=200, dry_run=False,
+             checkpoint_path=None, resume=False):
+    """
+    Recompute metrics for every profile in the store for ``folder``.
+
+    Args:
+        folder (str): User data folder.
+        backend (str, optional): 'json' or 'sqlite'; defaults to PROFILE_STORE_BACKEND.
+        workers (int, optional): Worker processes; 0 runs in this process. Defaults to the CPU count.
+        chunk_size (int): Profiles recomputed and written per batch.
+        dry_run (bool): Compute and count changes without writing anything.
+        checkpoint_path (str, optional): Where progress is recorded after each written chunk.
+        resume (bool): Skip user ids up to the one stored in the checkpoint.
+
+    Returns:
+        dict: Counts for this run of 'processed', 'changed', 'unchanged', 'skipped', 'conflicts',
+            'entries', plus 'elapsed_seconds'.
+    """
+    store = create_profile_store(folder, backend)
+    user_ids = sorted(store.list_user_ids())
+    counts = {"processed": 0, "changed": 0, "unchanged": 0, "skipped": 0, "conflicts": 0, "entries": 0}
+
+    state = read_checkpoint(checkpoint_path) if (checkpoint_path and resume) else None
+    if state:
+        user_ids = [user_id for user_id in user_ids if user_id > state['last_user_id']]
+
+    timestamp = datetime.datetime.utcnow().isoformat() + "Z"
+    chunks = [user_ids[i:i + chunk_size] for i in range(0, len(user_ids), chunk_size)]
+    workers = os.cpu_count() if workers is None else workers
+    started = time.perf_counter()
+    executor = None
+    if workers > 0 and len(chunks) > 1:
+        executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                       initargs=(folder, backend))
+        results = executor.map(_recompute_chunk, chunks, [timestamp] * len(chunks))
+    else:
+        results = (_recompute_chunk(chunk, timestamp, store) for chunk in chunks)
+
+    try:
+        for chunk in results:
+            writes = []
+            for user_id, profile, version, changed, entries in chunk:
+                if profile is None:
+                    counts["skipped"] += 1
+                    continue
+                counts["processed"] += 1
+                counts["entries"] += entries
+                if changed:
+                    counts["changed"] += 1
+                    writes.append((user_id, profile, version))
+                else:
+                    counts["unchanged"] += 1
+
+            if dry_run:
+                continue
+            for (user_id, _, _), outcome in zip(writes, store.save_many(writes) if writes else []):
+                if isinstance(outcome, ProfileVersionConflict) and not _retry_conflict(store, user_id, timestamp):
+                    print(f"Gave up on {user_id}: {outcome}", file=sys.stderr)
+                    counts["conflicts"] += 1
+            if checkpoint_path and chunk:
+                write_checkpoint(checkpoint_path, {"last_user_id": chunk[-1][0]})
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+    if checkpoint_path and not dry_run and os.path.exists(checkpoint_path):
+        os.unlink(checkpoint_path)
+    counts["elapsed_seconds"] = time.perf_counter() - started
+    return counts
+
+
+def main():
+    user_data_folder = os.getenv('USER_DATA_FOLDER', 'user_data')
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--folder', default=user_data_folder, help="user data folder")
+    parser.add_argument('--backend', choices=('json', 'sqlite'), help="profile store (default: PROFILE_STORE_BACKEND)")
+    parser.add_argument('--workers', type=int, help="worker processes, 0 to run inline (default: CPU count)")
+    parser.add_argument('--chunk-size', type=int, default=200, help="profiles per batch")
+    parser.add_argument('--dry-run', action='store_true', help="report what would change without writing")
+    parser.add_argument('--checkpoint', help="checkpoint file (default: <folder>/.backfill_checkpoint.json)")
+    parser.add_argument('--resume', action='store_true', help="continue after the last checkpointed user")
+    args = parser.parse_args()
+
+    checkpoint = None if args.dry_run else (args.checkpoint or os.path.join(args.folder, '.backfill_checkpoint.json'))
+    counts = backfill(args.folder, backend=args.backend, workers=args.workers, chunk_size=max(args.chunk_size, 1),
+                      dry_run=args.dry_run, checkpoint_path=checkpoint, resume=args.resume)
+
+    elapsed = counts.pop("elapsed_seconds") or 1e-9
+    prefix = "Would change" if args.dry_run else "Changed"
+    print(f"{prefix} {counts['changed']} of {counts['processed']} profiles "
+          f"({counts['unchanged']} unchanged, {counts['skipped']} skipped, {counts['conflicts']} conflicts), "
+          f"{counts['entries']} progress entries")
+    print(f"{elapsed:.2f}s: {counts['processed'] / elapsed:.1f} profiles/s, {counts['entries'] / elapsed:.1f} entries/s")
+    return 1 if counts['conflicts'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,303 @@
+"""
+Load and latency benchmark for the Flask API, driven at a fixed request rate.
+
+Usage:
+    python bench_api.py [--rps 20] [--duration 30] [--users 20] [--concurrency 64]
+                        [--mix profile=1,track=4,analyze=2,diet=1] [--url http://localhost:5000]
+                        [--save-baseline bench_baseline.json] [--compare bench_baseline.json]
+                        [--tolerance 0.2]
+
+Without ``--url`` the app is started in-process on a free port with the local
+fake model backend (GEMINI_BACKEND=fake unless set otherwise) and temporary
+data folders, so runs measure the app's own overhead: profile I/O, photo
+handling, the analysis pipeline and the call governor. The Google Calendar
+environment variables the app needs at import time must still be set.
+
+Requests are scheduled open-loop at ``--rps`` and each latency is measured
+from its scheduled start, so time spent waiting for a free client worker
+counts against the server instead of being hidden. 429/503 responses are
+reported as shed, other non-2xx responses and connection errors as errors.
+
+``--save-baseline`` stores the summary; ``--compare`` checks the run against a
+stored one and exits with status 1 if any endpoint's p95 or p99 latency got
+more than ``--tolerance`` slower or its error rate rose by over a point.
+"""
+
+import argparse
+import collections
+import contextlib
+import datetime
+import io
+import json
+import math
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from PIL import Image
+
+DEFAULT_MIX = "profile=1,track=4,analyze=2,diet=1"
+
+
+def percentile(values, p):
+    """
+    Nearest-rank percentile of a non-empty list.
+    """
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+
+def parse_mix(spec):
+    """
+    Parse ``name=weight,...`` into a dict, rejecting unknown endpoint names.
+    """
+    mix = {}
+    for item in spec.split(','):
+        name, _, weight = item.partition('=')
+        name = name.strip()
+        if name not in ENDPOINTS:
+            raise ValueError(f"Unknown endpoint in --mix: {name} (choose from {', '.join(ENDPOINTS)})")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def start_local_server(data_dir):
+    """
+    Import the app with the fake backend and temporary data folders and serve it on a free port.
+
+    Returns:
+        tuple: (base URL, werkzeug server)
+    """
+    os.environ.setdefault('GEMINI_BACKEND', 'fake')
+    os.environ.setdefault('GEMINI_WARMUP', 'false')
+    os.environ.setdefault('FLASK_SECRET_KEY', 'bench')
+    for name in ('USER_DATA_FOLDER', 'JOB_DATA_FOLDER', 'PROGRESS_DATA_FOLDER'):
+        os.environ[name] = os.path.join(data_dir, name.lower())
+
+    import logging
+    from werkzeug.serving import make_server
+    # The app prints its start-up diagnostics; keep stdout for the JSON report.
+    with contextlib.redirect_stdout(sys.stderr):
+        import app as flask_app
+
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    server = make_server('127.0.0.1', 0, flask_app.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}", server
+
+
+def make_photos(count, seed=0):
+    """
+    Generate distinct JPEG photos up front so encoding stays out of the timed section.
+    """
+    rng = random.Random(seed)
+    photos = []
+    for _ in range(count):
+        image = Image.effect_noise((480, 640), rng.uniform(20, 90)).convert('RGB')
+        buffer = io.BytesIO()
+        image.save(buffer, 'JPEG', quality=85)
+        photos.append(buffer.getvalue())
+    return photos
+
+
+def profile_payload(rng):
+    height = rng.randint(155, 195)
+    return {
+        "age": rng.randint(18, 70),
+        "gender": rng.choice(["male", "female"]),
+        "lifestyle": {"activity_level": rng.choice(["low", "moderate", "high"])},
+        "measurements": {
+            "height_cm": height,
+            "weight_kg": round(rng.uniform(50, 110), 1),
+            "waist_cm": rng.randint(65, 110),
+            "hip_cm": rng.randint(85, 120),
+            "neck_cm": rng.randint(30, 45),
+        },
+    }
+
+
+def post_profile(session, base, user_id, rng, photos):
+    return session.post(f"{base}/profile/{user_id}", json=profile_payload(rng), timeout=120)
+
+
+def post_track(session, base, user_id, rng, photos):
+    measurements = profile_payload(rng)["measurements"]
+    return session.post(f"{base}/track-progress/{user_id}",
+                        json={"weight_kg": measurements["weight_kg"], "measurements": measurements}, timeout=120)
+
+
+def post_analyze(session, base, user_id, rng, photos):
+    photo = rng.choice(photos)
+    return session.post(f"{base}/analyze-photo/{user_id}?refresh=1",
+                        files={"photo": ("photo.jpg", photo, "image/jpeg")}, timeout=120)
+
+
+def post_diet(session, base, user_id, rng, photos):
+    return session.post(f"{base}/generate-diet-plan/{user_id}", timeout=120)
+
+
+ENDPOINTS = collections.OrderedDict([
+    ("profile", post_profile),
+    ("track", post_track),
+    ("analyze", post_analyze),
+    ("diet", post_diet),
+])
+
+
+def run_load(base, rps, duration, users, mix, concurrency, photos, seed=0):
+    """
+    Send ``rps * duration`` requests on a fixed schedule and record each outcome.
+
+    Returns:
+        tuple: (list of (endpoint, latency seconds, outcome), wall-clock seconds)
+    """
+    rng = random.Random(seed)
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    local = threading.local()
+    results = []
+    lock = threading.Lock()
+
+    def send(name, user_id, due, request_seed):
+        session = getattr(local, 'session', None)
+        if session is None:
+            session = local.session = requests.Session()
+        try:
+            response = ENDPOINTS[name](session, base, user_id, random.Random(request_seed), photos)
+            status = response.status_code
+            outcome = "ok" if status < 300 else "shed" if status in (429, 503) else "error"
+        except requests.RequestException:
+            outcome = "error"
+        with lock:
+            results.append((name, time.perf_counter() - due, outcome))
+
+    total = int(rps * duration)
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for i in range(total):
+            due = started + i / rps
+            delay = due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            name = rng.choices(names, weights)[0]
+            executor.submit(send, name, f"bench_{rng.randrange(users)}", due, rng.random())
+    return results, time.perf_counter() - started
+
+
+def summarize(results, elapsed):
+    """
+    Per-endpoint and overall counts, error/shed rates, latency percentiles and throughput.
+    """
+    groups = collections.defaultdict(list)
+    for name, latency, outcome in results:
+        groups[name].append((latency, outcome))
+        groups["all"].append((latency, outcome))
+
+    summary = {}
+    for name, rows in sorted(groups.items()):
+        latencies = [latency for latency, outcome in rows if outcome == "ok"] or [0.0]
+        count = len(rows)
+        errors = sum(1 for _, outcome in rows if outcome == "error")
+        shed = sum(1 for _, outcome in rows if outcome == "shed")
+        summary[name] = {
+            "count": count,
+            "error_rate": round(errors / count, 4),
+            "shed_rate": round(shed / count, 4),
+            "throughput_rps": round((count - errors - shed) / elapsed, 2),
+            "p50_s": round(percentile(latencies, 50), 4),
+            "p95_s": round(percentile(latencies, 95), 4),
+            "p99_s": round(percentile(latencies, 99), 4),
+            "mean_s": round(statistics.mean(latencies), 4),
+        }
+    return summary
+
+
+def compare(summary, baseline, tolerance):
+    """
+    Return human-readable regressions of ``summary`` against a stored baseline summary.
+    """
+    regressions = []
+    for name, stats in summary.items():
+        before = baseline.get(name)
+        if not before:
+            continue
+        for key in ("p95_s", "p99_s"):
+            if before[key] > 0 and stats[key] > before[key] * (1 + tolerance):
+                regressions.append(f"{name} {key}: {before[key]} -> {stats[key]}")
+        if stats["error_rate"] > before["error_rate"] + 0.01:
+            regressions.append(f"{name} error_rate: {before['error_rate']} -> {stats['error_rate']}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rps', type=float, default=20)
+    parser.add_argument('--duration', type=float, default=30, help="seconds of load")
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--concurrency', type=int, default=64, help="client worker threads")
+    parser.add_argument('--mix', default=DEFAULT_MIX, help=f"endpoint weights (default: {DEFAULT_MIX})")
+    parser.add_argument('--url', help="benchmark a running server instead of an in-process app")
+    parser.add_argument('--photos', type=int, default=16, help="distinct photos to rotate through")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--save-baseline', help="write the summary to this file")
+    parser.add_argument('--compare', help="baseline file to check for regressions")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="allowed relative p95/p99 slowdown")
+    args = parser.parse_args()
+
+    mix = parse_mix(args.mix)
+    photos = make_photos(args.photos, args.seed)
+
+    with tempfile.TemporaryDirectory(prefix='bench_api_') as data_dir:
+        server = None
+        base = args.url.rstrip('/') if args.url else None
+        if base is None:
+            base, server = start_local_server(data_dir)
+        try:
+            setup_rng = random.Random(args.seed)
+            with requests.Session() as session:
+                for i in range(args.users):
+                    post_profile(session, base, f"bench_{i}", setup_rng, photos).raise_for_status()
+            results, elapsed = run_load(base, args.rps, args.duration, args.users, mix,
+                                        args.concurrency, photos, args.seed)
+        finally:
+            if server is not None:
+                server.shutdown()
+
+    summary = summarize(results, elapsed)
+    report = {
+        "run": {
+            "timestamp": datetime.datetime.utcnow().isoformat() + "Z",
+            "rps": args.rps,
+            "duration_s": args.duration,
+            "elapsed_s": round(elapsed, 2),
+            "users": args.users,
+            "mix": mix,
+            "target": args.url or f"in-process ({os.getenv('GEMINI_BACKEND')} backend)",
+            "fake_model_latency": os.getenv('FAKE_MODEL_LATENCY'),
+        },
+        "endpoints": summary,
+    }
+    print(json.dumps(report, indent=2))
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(summary, baseline["endpoints"], args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
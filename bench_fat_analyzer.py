@@ -0,0 +1,146 @@
+"""
+Compare latency and token cost of the three-call and single-call photo analysis modes.
+
+Usage:
+    python bench_fat_analyzer.py [--runs 5] [--modes multi,single] [--image photo.jpg]
+                                 [--profile user_data/john_doe.json] [--with-cache]
+
+Calls the real Gemini API (GEMINI_API_KEY must be set), or the local fake
+model with GEMINI_BACKEND=fake. Each mode runs analyze_fat_percentage_with_gemini
+``--runs`` times; the response cache is off unless ``--with-cache`` is given,
+so the three-call mode pays for every plan request. Token counts come from the reply's usage metadata when the SDK
+provides it, otherwise from count_tokens on the recorded requests and
+replies after the timed part of the run.
+"""
+
+import argparse
+import json
+import math
+import os
+import statistics
+import sys
+import threading
+import time
+
+from dotenv import load_dotenv
+
+import gemini.fat_analyzer as fat_analyzer
+from gemini.backends import get_model
+
+load_dotenv()
+
+SAMPLE_PROFILE = {
+    "age": 30,
+    "gender": "male",
+    "measurements": {"height_cm": 180, "weight_kg": 82, "waist_cm": 88, "hip_cm": 100, "neck_cm": 39},
+}
+
+
+class RecordingModel:
+    """
+    Wraps a GenerativeModel and records every generate_content request and reply.
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def generate_content(self, contents, **kwargs):
+        response = self.model.generate_content(contents=contents, **kwargs)
+        with self._lock:
+            self.calls.append((contents, response))
+        return response
+
+    def __getattr__(self, name):
+        return getattr(self.model, name)
+
+
+def percentile(values, p):
+    """
+    Nearest-rank percentile of a non-empty list.
+    """
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+
+def count_call_tokens(model, contents, response):
+    """
+    Return (input tokens, output tokens) for one recorded call.
+    """
+    usage = getattr(response, 'usage_metadata', None)
+    if usage is not None and getattr(usage, 'prompt_token_count', None):
+        return usage.prompt_token_count, usage.candidates_token_count
+    input_tokens = model.count_tokens(contents).total_tokens
+    output_tokens = model.count_tokens(response.text).total_tokens if response.text else 0
+    return input_tokens, output_tokens
+
+
+def run_mode(mode, runs, profile, image):
+    """
+    Run the analyzer ``runs`` times in ``mode`` and summarize latency, calls and tokens.
+    """
+    fat_analyzer.GEMINI_ANALYSIS_MODE = mode
+    model = get_model(fat_analyzer.MODEL_NAME)
+    latencies, call_counts, input_tokens, output_tokens, missing = [], [], [], [], 0
+
+    for _ in range(runs):
+        recorder = RecordingModel(model)
+        fat_analyzer.get_model = lambda *args, **kwargs: recorder
+        started = time.perf_counter()
+        try:
+            result = fat_analyzer.analyze_fat_percentage_with_gemini(profile, image=image)
+            missing += len(result.get('eksik_bolumler') or [])
+        except RuntimeError as e:
+            print(f"[{mode}] run failed: {e}", file=sys.stderr)
+            missing += 3
+        latencies.append(time.perf_counter() - started)
+        call_counts.append(len(recorder.calls))
+        tokens = [count_call_tokens(model, contents, response) for contents, response in recorder.calls]
+        input_tokens.append(sum(t[0] for t in tokens))
+        output_tokens.append(sum(t[1] for t in tokens))
+
+    return {
+        "mode": mode,
+        "runs": runs,
+        "p50_s": round(percentile(latencies, 50), 3),
+        "p95_s": round(percentile(latencies, 95), 3),
+        "mean_s": round(statistics.mean(latencies), 3),
+        "calls_per_run": statistics.mean(call_counts),
+        "input_tokens_per_run": round(statistics.mean(input_tokens)),
+        "output_tokens_per_run": round(statistics.mean(output_tokens)),
+        "missing_sections": missing,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--modes', default='multi,single', help="comma-separated: multi, single")
+    parser.add_argument('--image', help="photo to analyze (default: none, text only)")
+    parser.add_argument('--profile', help="profile JSON file (default: a built-in sample)")
+    parser.add_argument('--with-cache', action='store_true', help="keep the Gemini response cache enabled")
+    args = parser.parse_args()
+
+    profile = SAMPLE_PROFILE
+    if args.profile:
+        with open(args.profile, 'r', encoding='utf-8') as f:
+            profile = json.load(f)
+    image = None
+    if args.image:
+        with open(args.image, 'rb') as f:
+            image = f.read()
+    if not args.with_cache:
+        fat_analyzer.response_cache = None
+
+    original_get_model = fat_analyzer.get_model
+    try:
+        for mode in args.modes.split(','):
+            print(json.dumps(run_mode(mode.strip(), args.runs, profile, image)))
+    finally:
+        fat_analyzer.get_model = original_get_model
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -13,6 +13,8 @@ import json
 import re
 from dotenv import load_dotenv
 
+from gemini.json_extract import extract_json
+
 load_dotenv()
 
 def hesapla_bmi(boy_cm, kilo_kg):
@@ -98,19 +100,6 @@ def normalize_yag_orani(yag_str):
     else:
         return None
 
-def extract_json(text):
-    """
-    Extract the first JSON object found in a text string.
-
-    Args:
-        text (str): Text containing JSON.
-
-    Returns:
-        str or None: JSON substring, or None if not found.
-    """
-    match = re.search(r'\{[\s\S]*\}', text)
-    return match.group() if match else None
-
 def analyze_fat_percentage_with_gemini(user_data, image_path=None):
     """
     Analyze body fat percentage and generate recommendations using Gemini AI.
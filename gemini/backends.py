@@ -0,0 +1,318 @@
+"""
+gemini/backends.py
+
+Model backends behind every analysis and meal-plan call.
+
+``get_model`` returns a model from the backend selected by GEMINI_BACKEND:
+
+- ``gemini`` (default): the shared Gemini clients from gemini/client.py.
+- ``fake``: ``FakeModel``, a local stand-in that needs no API key and
+  returns well-formed replies for the analysis, exercise, diet, combined and
+  meal-plan prompts. Reply content is derived from the seed and the prompt,
+  so the same prompt always gets the same reply; latency (FAKE_MODEL_LATENCY),
+  injected errors (FAKE_MODEL_ERROR_RATE) and reply size (FAKE_MODEL_DAYS,
+  FAKE_MODEL_PADDING) are drawn from a seeded generator, so load tests can
+  measure the app's own overhead without spending quota.
+"""
+
+import json
+import math
+import os
+import random
+import threading
+import time
+import zlib
+
+from dotenv import load_dotenv
+from google.api_core import exceptions as api_exceptions
+
+from gemini import client
+
+load_dotenv()
+
+GUNLER = ["Pazartesi", "Salı", "Çarşamba", "Perşembe", "Cuma", "Cumartesi", "Pazar"]
+WEEKDAYS = ["monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday"]
+_WORDS = ["yulaf", "tavuk", "salata", "yoğurt", "mercimek", "yürüyüş", "esneme", "squat", "plank", "bisiklet",
+          "oats", "rice", "salmon", "eggs", "beans", "fruit", "nuts", "soup", "vegetables", "tea"]
+
+
+class ModelBackend:
+    """
+    Source of model objects exposing ``generate_content`` (and ``count_tokens``) like ``genai.GenerativeModel``.
+    """
+
+    name = None
+
+    @property
+    def cache_namespace(self):
+        """
+        Part of response cache keys that keeps this backend's replies apart from other backends'.
+        """
+        return self.name
+
+    def get_model(self, model_name=client.DEFAULT_MODEL_NAME, generation_config=None):
+        raise NotImplementedError
+
+    def warm_up(self):
+        """
+        Prepare the backend ahead of the first request; returns True on success.
+        """
+        return True
+
+
+class GeminiBackend(ModelBackend):
+    """
+    The real Gemini API through the shared client registry.
+    """
+
+    name = 'gemini'
+
+    def get_model(self, model_name=client.DEFAULT_MODEL_NAME, generation_config=None):
+        return client.get_model(model_name, generation_config)
+
+    def warm_up(self):
+        return client.warm_up()
+
+
+def parse_latency(spec):
+    """
+    Parse a FAKE_MODEL_LATENCY spec into a sampler taking a ``random.Random``.
+
+    Accepted forms (seconds): ``0``, ``fixed:S``, ``uniform:LOW:HIGH``,
+    ``normal:MEAN:STDDEV`` and ``lognormal:MEDIAN:SIGMA``.
+
+    Raises:
+        ValueError: If the spec is malformed.
+    """
+    kind, _, params = spec.strip().partition(':')
+    try:
+        values = [float(v) for v in params.split(':')] if params else []
+        if not params and kind:
+            return lambda rng, s=float(kind): s
+        if kind == 'fixed' and len(values) == 1:
+            return lambda rng: values[0]
+        if kind == 'uniform' and len(values) == 2:
+            return lambda rng: rng.uniform(values[0], values[1])
+        if kind == 'normal' and len(values) == 2:
+            return lambda rng: max(0.0, rng.gauss(values[0], values[1]))
+        if kind == 'lognormal' and len(values) == 2:
+            return lambda rng: rng.lognormvariate(math.log(values[0]), values[1])
+    except ValueError:
+        pass
+    raise ValueError(f"Invalid FAKE_MODEL_LATENCY: {spec!r}")
+
+
+class FakeResponse:
+    """
+    Reply with the ``text`` and ``usage_metadata`` attributes the analyzer and benchmark read.
+    """
+
+    class Usage:
+        def __init__(self, prompt_token_count, candidates_token_count):
+            self.prompt_token_count = prompt_token_count
+            self.candidates_token_count = candidates_token_count
+
+    def __init__(self, text, prompt_tokens=0):
+        self.text = text
+        self.usage_metadata = FakeResponse.Usage(prompt_tokens, _token_count(text))
+
+
+class _TokenCount:
+    def __init__(self, total_tokens):
+        self.total_tokens = total_tokens
+
+
+def _token_count(text):
+    return max(1, len(text) // 4) if text else 0
+
+
+def _prompt_text(contents):
+    """
+    Concatenate the text parts of a generate_content request.
+    """
+    if isinstance(contents, str):
+        return contents
+    parts = []
+    for part in contents or []:
+        if isinstance(part, str):
+            parts.append(part)
+        elif isinstance(part, dict) and 'text' in part:
+            parts.append(part['text'])
+    return "\n".join(parts)
+
+
+class FakeModel:
+    """
+    Deterministic local stand-in for ``genai.GenerativeModel``.
+    """
+
+    def __init__(self, seed=0, latency=None, error_rate=0.0, days=7, padding=0, chunk_size=64):
+        """
+        Args:
+            seed (int): Seed for reply content, latency and error draws.
+            latency (callable, optional): ``parse_latency`` sampler; no delay when omitted.
+            error_rate (float): Probability that a call raises ServiceUnavailable.
+            days (int): Entries in each generated plan.
+            padding (int): Extra words added to every free-text field.
+            chunk_size (int): Characters per chunk of a streamed reply.
+        """
+        self.seed = seed
+        self.latency = latency or (lambda rng: 0.0)
+        self.error_rate = error_rate
+        self.days = days
+        self.padding = padding
+        self.chunk_size = chunk_size
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls = 0
+
+    def _draw(self):
+        """
+        Return (latency, fail) for the next call from the shared seeded sequence.
+        """
+        with self._lock:
+            self.calls += 1
+            return max(0.0, self.latency(self._rng)), self._rng.random() < self.error_rate
+
+    def _words(self, rng, count):
+        return " ".join(rng.choice(_WORDS) for _ in range(count + self.padding))
+
+    def _reply(self, prompt):
+        """
+        Build the JSON reply for the prompt kind, seeded by the prompt itself.
+        """
+        rng = random.Random(self.seed ^ zlib.crc32(prompt.encode('utf-8')))
+        analiz = {
+            "bmi": round(rng.uniform(18, 32), 1),
+            "bmi_yorum": "Normal",
+            "bko": round(rng.uniform(0.75, 1.0), 2),
+            "bko_yorum": "Düşük risk",
+            "yag_orani": f"%{rng.uniform(10, 32):.1f}",
+            "analiz": self._words(rng, 24),
+        }
+        egzersiz = {"gunler": [{"gun": GUNLER[i % 7], "egzersiz": self._words(rng, 8)} for i in range(self.days)]}
+        diyet = {"gunler": [{
+            "gun": GUNLER[i % 7],
+            "kahvalti": self._words(rng, 4),
+            "ogle": self._words(rng, 4),
+            "aksam": self._words(rng, 4),
+            "ara_ogun": self._words(rng, 2),
+            "toplam_kalori": rng.randrange(1500, 2201, 50),
+        } for i in range(self.days)]}
+
+        if '"breakfast"' in prompt:
+            reply = {"summary": self._words(rng, 12)}
+            for day in WEEKDAYS[:self.days]:
+                reply[day] = {meal: self._words(rng, 4) for meal in ("breakfast", "lunch", "dinner", "snack")}
+            reply["notes_from_gemini"] = self._words(rng, 10)
+        elif '"egzersiz": {' in prompt:
+            reply = dict(analiz, egzersiz=egzersiz, diyet=diyet)
+        elif '"kahvalti"' in prompt:
+            reply = diyet
+        elif '"gunler"' in prompt:
+            reply = egzersiz
+        else:
+            reply = analiz
+        return json.dumps(reply, ensure_ascii=False)
+
+    def generate_content(self, contents=None, generation_config=None, stream=False, request_options=None, **kwargs):
+        """
+        Sleep for a sampled latency, maybe raise an injected error, and return the reply.
+
+        With ``stream=True`` an iterator of chunk responses is returned; the
+        latency is split between the first chunk and the rest. A
+        ``request_options`` timeout shorter than the latency raises
+        DeadlineExceeded once it has passed, as the SDK does.
+        """
+        prompt = _prompt_text(contents)
+        delay, fail = self._draw()
+        timeout = (request_options or {}).get('timeout')
+        if timeout is not None and delay > timeout:
+            time.sleep(max(0.0, timeout))
+            raise api_exceptions.DeadlineExceeded(f"Fake model backend: no reply within {timeout:.1f}s")
+        if not stream:
+            time.sleep(delay)
+            if fail:
+                raise api_exceptions.ServiceUnavailable("Fake model backend: injected error")
+            return FakeResponse(self._reply(prompt), _token_count(prompt))
+        return self._stream(prompt, delay, fail)
+
+    def _stream(self, prompt, delay, fail):
+        time.sleep(delay * 0.3)
+        if fail:
+            raise api_exceptions.ServiceUnavailable("Fake model backend: injected error")
+        text = self._reply(prompt)
+        chunks = [text[i:i + self.chunk_size] for i in range(0, len(text), self.chunk_size)]
+        for chunk in chunks:
+            time.sleep(delay * 0.7 / len(chunks))
+            yield FakeResponse(chunk)
+
+    def count_tokens(self, contents):
+        return _TokenCount(_token_count(_prompt_text(contents)))
+
+
+class FakeBackend(ModelBackend):
+    """
+    Backend handing out one ``FakeModel`` per (model name, generation config).
+    """
+
+    name = 'fake'
+
+    def __init__(self, **model_options):
+        self.model_options = model_options
+        self._models = {}
+        self._lock = threading.Lock()
+
+    @property
+    def cache_namespace(self):
+        # Reply content depends on the seed and plan shape, not only on the prompt.
+        options = {k: v for k, v in self.model_options.items() if k in ('seed', 'days', 'padding')}
+        return f"{self.name}:{json.dumps(options, sort_keys=True)}"
+
+    def get_model(self, model_name=client.DEFAULT_MODEL_NAME, generation_config=None):
+        key = client._registry_key(model_name, None, generation_config)
+        with self._lock:
+            if key not in self._models:
+                self._models[key] = FakeModel(**self.model_options)
+            return self._models[key]
+
+
+def create_backend():
+    """
+    Build the backend selected by GEMINI_BACKEND and the FAKE_MODEL_* environment variables.
+
+    Raises:
+        ValueError: If GEMINI_BACKEND or FAKE_MODEL_LATENCY is invalid.
+    """
+    name = os.getenv('GEMINI_BACKEND', 'gemini').lower()
+    if name == 'gemini':
+        return GeminiBackend()
+    if name == 'fake':
+        return FakeBackend(
+            seed=int(os.getenv('FAKE_MODEL_SEED', '0')),
+            latency=parse_latency(os.getenv('FAKE_MODEL_LATENCY', 'lognormal:0.8:0.5')),
+            error_rate=float(os.getenv('FAKE_MODEL_ERROR_RATE', '0')),
+            days=int(os.getenv('FAKE_MODEL_DAYS', '7')),
+            padding=int(os.getenv('FAKE_MODEL_PADDING', '0')),
+        )
+    raise ValueError(f"Unknown GEMINI_BACKEND: {name}")
+
+
+model_backend = create_backend()
+
+
+def cache_namespace():
+    """
+    Return the active backend's response cache namespace.
+    """
+    return model_backend.cache_namespace
+
+
+def get_model(model_name=client.DEFAULT_MODEL_NAME, generation_config=None):
+    """
+    Return a model from the active backend.
+
+    Raises:
+        ValueError: If the Gemini backend is active and GEMINI_API_KEY is not set.
+    """
+    return model_backend.get_model(model_name, generation_config)
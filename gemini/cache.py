@@ -0,0 +1,247 @@
+"""
+gemini/cache.py
+
+Content-addressed cache for Gemini text responses.
+
+Keys are a SHA-256 hash of the normalized prompt, the model backend, the
+model name and the generation config, so identical requests share one stored
+reply no matter which user triggered them, while replies of a stand-in
+backend are never served for the real one (or the other way round). Entries expire after a TTL and the least recently
+used entries are evicted once the cache is full. Two backends are provided:
+an in-process dict and an on-disk sqlite file that survives restarts and can
+be shared by several workers.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+def normalize_prompt(prompt):
+    """
+    Normalize a prompt so that formatting-only differences map to the same key.
+
+    Args:
+        prompt (str): Raw prompt text.
+
+    Returns:
+        str: NFC-normalized prompt with trailing spaces and blank edges removed.
+    """
+    text = unicodedata.normalize("NFC", prompt)
+    return "\n".join(line.rstrip() for line in text.strip().splitlines())
+
+
+def make_cache_key(prompt, model_name, generation_config=None, backend=None):
+    """
+    Build the cache key for a model request.
+
+    Args:
+        prompt (str): Prompt text.
+        model_name (str): Name of the Gemini model.
+        generation_config (dict, optional): Generation parameters.
+        backend (str, optional): Cache namespace of the model backend serving the request.
+
+    Returns:
+        str: Hex SHA-256 digest.
+    """
+    payload = json.dumps(
+        {
+            "backend": backend,
+            "model": model_name,
+            "config": generation_config or {},
+            "prompt": normalize_prompt(prompt),
+        },
+        sort_keys=True,
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class MemoryCacheBackend:
+    """
+    In-process LRU store backed by an OrderedDict.
+    """
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, now):
+        """
+        Return the live value for ``key`` and mark it most recently used.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at <= now:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, expires_at):
+        """
+        Store ``value`` and evict the least recently used entries beyond capacity.
+        """
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SqliteCacheBackend:
+    """
+    On-disk LRU store in a single sqlite table.
+    """
+
+    def __init__(self, path, max_entries=10000):
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY,"
+            " value TEXT NOT NULL,"
+            " expires_at REAL NOT NULL,"
+            " last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)")
+
+    def get(self, key, now):
+        """
+        Return the live value for ``key`` and refresh its access time.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if row[1] <= now:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                return None
+            self._conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+            return row[0]
+
+    def set(self, key, value, expires_at):
+        """
+        Upsert ``value`` and trim the table to ``max_entries`` by access time.
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, value, expires_at, last_access) VALUES (?, ?, ?, ?)",
+                (key, value, expires_at, now),
+            )
+            self._conn.execute(
+                "DELETE FROM responses WHERE key IN ("
+                " SELECT key FROM responses ORDER BY last_access DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+
+class ResponseCache:
+    """
+    TTL cache for model responses with hit/miss counters.
+    """
+
+    def __init__(self, backend, ttl_seconds=86400):
+        self.backend = backend
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Return the cached value for ``key``, or None on a miss or expiry.
+        """
+        value = self.backend.get(key, time.time())
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def set(self, key, value):
+        """
+        Store ``value`` under ``key`` for ``ttl_seconds``.
+        """
+        self.backend.set(key, value, time.time() + self.ttl_seconds)
+
+    def clear(self):
+        self.backend.clear()
+
+    def stats(self):
+        """
+        Return hit/miss counters and the current number of entries.
+        """
+        with self._lock:
+            hits, misses = self.hits, self.misses
+        total = hits + misses
+        return {
+            "backend": type(self.backend).__name__,
+            "entries": len(self.backend),
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": round(hits / total, 4) if total else 0.0,
+        }
+
+
+def create_response_cache():
+    """
+    Build the response cache described by the GEMINI_CACHE_* environment variables.
+
+    Returns:
+        ResponseCache or None: None when GEMINI_CACHE_BACKEND is 'off'.
+
+    Raises:
+        ValueError: If the backend name is unknown.
+    """
+    backend_name = os.getenv('GEMINI_CACHE_BACKEND', 'memory').lower()
+    ttl = float(os.getenv('GEMINI_CACHE_TTL', '86400'))
+    max_entries = int(os.getenv('GEMINI_CACHE_MAX_ENTRIES', '1024'))
+
+    if backend_name in ('off', 'none', ''):
+        return None
+    if backend_name == 'memory':
+        backend = MemoryCacheBackend(max_entries=max_entries)
+    elif backend_name == 'sqlite':
+        backend = SqliteCacheBackend(os.getenv('GEMINI_CACHE_PATH', 'gemini_cache.sqlite3'), max_entries=max_entries)
+    else:
+        raise ValueError(f"Unknown GEMINI_CACHE_BACKEND: {backend_name}")
+    return ResponseCache(backend, ttl_seconds=ttl)
+
+
+response_cache = create_response_cache()
@@ -0,0 +1,148 @@
+"""
+gemini/client.py
+
+Process-wide registry of configured Gemini model clients.
+
+``genai.configure`` and ``genai.GenerativeModel`` are built once per
+(model name, API key, generation config) and then shared by every request
+thread, so connection setup is paid at boot instead of on every upload.
+Models accept ``request_options={"timeout": seconds}`` on generate_content
+on every supported SDK version (see ``TimedGenerativeModel``).
+"""
+
+import inspect
+import json
+import logging
+import os
+import threading
+
+import google.generativeai as genai
+from dotenv import load_dotenv
+from google.generativeai import client as genai_client
+from google.generativeai.types import generation_types
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODEL_NAME = "gemini-1.5-flash"
+
+_lock = threading.Lock()
+_models = {}
+_configured_api_key = None
+
+
+class TimedGenerativeModel(genai.GenerativeModel):
+    """
+    GenerativeModel whose generate_content honours ``request_options={"timeout": seconds}``.
+
+    google-generativeai 0.3.2 has no request_options and forwards unknown
+    keyword arguments into the GenerateContentRequest proto, which rejects
+    them. The timeout is passed to the underlying API client call instead,
+    so it bounds the HTTP/gRPC request itself, streams included.
+    """
+
+    def generate_content(self, contents, *, generation_config=None, safety_settings=None, stream=False,
+                         request_options=None, **kwargs):
+        timeout = (request_options or {}).get('timeout')
+        if timeout is None:
+            return super().generate_content(contents, generation_config=generation_config,
+                                            safety_settings=safety_settings, stream=stream, **kwargs)
+        request = self._prepare_request(contents=contents, generation_config=generation_config,
+                                        safety_settings=safety_settings, **kwargs)
+        if self._client is None:
+            self._client = genai_client.get_default_generative_client()
+        if stream:
+            with generation_types.rewrite_stream_error():
+                iterator = self._client.stream_generate_content(request, timeout=timeout)
+            return generation_types.GenerateContentResponse.from_iterator(iterator)
+        response = self._client.generate_content(request, timeout=timeout)
+        return generation_types.GenerateContentResponse.from_response(response)
+
+
+# SDKs that take request_options themselves need no wrapper.
+_MODEL_CLASS = (genai.GenerativeModel
+                if 'request_options' in inspect.signature(genai.GenerativeModel.generate_content).parameters
+                else TimedGenerativeModel)
+
+
+def _registry_key(model_name, api_key, generation_config):
+    """
+    Build a hashable registry key; generation config dicts are serialized canonically.
+    """
+    config = json.dumps(generation_config, sort_keys=True) if generation_config else None
+    return model_name, api_key, config
+
+
+def get_model(model_name=DEFAULT_MODEL_NAME, generation_config=None):
+    """
+    Return a shared GenerativeModel, configuring the SDK on first use.
+
+    Args:
+        model_name (str): Gemini model name.
+        generation_config (dict, optional): Default generation parameters for the model.
+
+    Returns:
+        genai.GenerativeModel: Cached model instance, safe to share across threads, that accepts
+            ``request_options`` on generate_content.
+
+    Raises:
+        ValueError: If GEMINI_API_KEY is not set.
+    """
+    global _configured_api_key
+
+    api_key = os.getenv('GEMINI_API_KEY')
+    if not api_key:
+        raise ValueError("GEMINI_API_KEY not found in environment variables")
+
+    key = _registry_key(model_name, api_key, generation_config)
+    model = _models.get(key)
+    if model is not None:
+        return model
+
+    with _lock:
+        model = _models.get(key)
+        if model is None:
+            if _configured_api_key != api_key:
+                genai.configure(api_key=api_key)
+                _configured_api_key = api_key
+            model = _MODEL_CLASS(model_name=model_name, generation_config=generation_config)
+            _models[key] = model
+    return model
+
+
+def supports_response_schema():
+    """
+    Tell whether the installed SDK accepts ``response_mime_type``/``response_schema`` in generation configs.
+    """
+    return 'response_schema' in getattr(genai.GenerationConfig, '__dataclass_fields__', {})
+
+
+def warm_up(model_names=(DEFAULT_MODEL_NAME,)):
+    """
+    Build the given models and open the underlying API client ahead of the first request.
+
+    Args:
+        model_names (iterable): Model names to pre-build.
+
+    Returns:
+        bool: True if every model was built, False otherwise (errors are logged, not raised).
+    """
+    try:
+        for model_name in model_names:
+            get_model(model_name)
+        genai_client.get_default_generative_client()
+        return True
+    except Exception as e:
+        logger.warning("Gemini client warm-up skipped: %s", e)
+        return False
+
+
+def reset():
+    """
+    Drop every cached model so the next call reconfigures the SDK (e.g. after key rotation).
+    """
+    global _configured_api_key
+    with _lock:
+        _models.clear()
+        _configured_api_key = None
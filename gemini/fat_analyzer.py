@@ -7,14 +7,89 @@ personalized exercise and diet recommendations.
 """
 
 import os
-import google.generativeai as genai
-import base64
 import json
+import logging
+import queue
 import re
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
 from dotenv import load_dotenv
 
+from gemini.cache import make_cache_key, response_cache
+from gemini.backends import cache_namespace, get_model
+from gemini.client import DEFAULT_MODEL_NAME, supports_response_schema
+from gemini.governor import ModelOverloaded, governed
+from gemini.resilience import resilient
+from gemini.json_extract import JsonExtractor
+from utils.images import image_preprocessor
+from utils.uploads import image_buffer, sniff_image_mime
+
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+MODEL_NAME = DEFAULT_MODEL_NAME
+GENERATION_CONFIG = {"temperature": 0.3}
+
+# Analiz, egzersiz ve diyet çağrıları birbirinden bağımsızdır; eşzamanlı modda
+# üçü aynı anda gönderilir ve istek süresi en yavaş çağrı kadar olur.
+GEMINI_CONCURRENT_CALLS = os.getenv('GEMINI_CONCURRENT_CALLS', 'true').lower() in ('1', 'true', 'yes')
+GEMINI_CALL_TIMEOUT = float(os.getenv('GEMINI_CALL_TIMEOUT', '45'))
+GEMINI_MAX_WORKERS = int(os.getenv('GEMINI_MAX_WORKERS', '12'))
+
+# "multi": analiz, egzersiz ve diyet için üç ayrı çağrı (plan yanıtları önbelleğe alınır).
+# "single": tek çağrıda hepsini isteyen birleşik yanıt; bir gidiş-dönüş, önbellek yok.
+GEMINI_ANALYSIS_MODE = os.getenv('GEMINI_ANALYSIS_MODE', 'multi').lower()
+
+# Akışlı analizde model yanıtları parça parça istemciye iletilir.
+GEMINI_STREAM_TOKENS = os.getenv('GEMINI_STREAM_TOKENS', 'true').lower() in ('1', 'true', 'yes')
+
+ANALIZ_SEMASI = {
+    "type": "object",
+    "properties": {
+        "bmi": {"type": "number"},
+        "bmi_yorum": {"type": "string"},
+        "bko": {"type": "number"},
+        "bko_yorum": {"type": "string"},
+        "yag_orani": {"type": "string"},
+        "analiz": {"type": "string"},
+        "egzersiz": {
+            "type": "object",
+            "properties": {"gunler": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {"gun": {"type": "string"}, "egzersiz": {"type": "string"}},
+                    "required": ["gun", "egzersiz"],
+                },
+            }},
+            "required": ["gunler"],
+        },
+        "diyet": {
+            "type": "object",
+            "properties": {"gunler": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "gun": {"type": "string"},
+                        "kahvalti": {"type": "string"},
+                        "ogle": {"type": "string"},
+                        "aksam": {"type": "string"},
+                        "ara_ogun": {"type": "string"},
+                        "toplam_kalori": {"type": "number"},
+                    },
+                    "required": ["gun", "kahvalti", "ogle", "aksam", "ara_ogun", "toplam_kalori"],
+                },
+            }},
+            "required": ["gunler"],
+        },
+    },
+    "required": ["bmi", "bmi_yorum", "bko", "bko_yorum", "yag_orani", "analiz", "egzersiz", "diyet"],
+}
+
+_executor = ThreadPoolExecutor(max_workers=GEMINI_MAX_WORKERS, thread_name_prefix='gemini')
+
 def hesapla_bmi(boy_cm, kilo_kg):
     """
     Calculate Body Mass Index (BMI).
@@ -98,44 +173,236 @@ def normalize_yag_orani(yag_str):
     else:
         return None
 
-def extract_json(text):
+def _istek_secenekleri(bitis):
+    """
+    SDK request options that make a call give up at ``bitis`` (a ``time.monotonic()`` value).
+    """
+    if bitis is None:
+        return {}
+    return {"request_options": {"timeout": max(0.0, bitis - time.monotonic())}}
+
+def _yanit_metni(model, contents, generation_config, on_delta=None, bitis=None):
     """
-    Extract the first JSON object found in a text string.
+    Send one generate_content request and return the reply text.
+
+    With ``on_delta`` the reply is requested as a stream and every text chunk
+    is passed to it as it arrives. With ``bitis`` the request carries the
+    time left as its SDK timeout, so it stops at the deadline instead of
+    running on after the caller has stopped waiting.
+    """
+    secenekler = _istek_secenekleri(bitis)
+    if on_delta is None:
+        return model.generate_content(contents=contents, generation_config=generation_config, **secenekler).text
+    parcalar = []
+    for parca in model.generate_content(contents=contents, generation_config=generation_config, stream=True,
+                                        **secenekler):
+        metin = parca.text
+        if metin:
+            parcalar.append(metin)
+            on_delta(metin)
+    return "".join(parcalar)
+
+def _json_ayristir(model, contents, generation_config=None, on_delta=None, bitis=None):
+    """
+    Send one generate_content request and extract the JSON object in its reply.
+
+    Streamed chunks are fed to the extractor as they arrive, so the reply is
+    scanned once while it is still being received.
+
+    Returns:
+        tuple: (dict or None, outcome) with outcome as in ``JsonExtractor.outcome``.
+    """
+    extractor = JsonExtractor()
+    if on_delta is None:
+        extractor.feed(_yanit_metni(model, contents, generation_config or GENERATION_CONFIG, bitis=bitis))
+    else:
+        def besle(metin):
+            extractor.feed(metin)
+            on_delta(metin)
+        _yanit_metni(model, contents, generation_config or GENERATION_CONFIG, besle, bitis)
+    sonuc = extractor.result()
+    if extractor.outcome != "parsed":
+        logger.info("Gemini JSON reply %s", extractor.outcome)
+    return sonuc, extractor.outcome
+
+def _json_iste(model, contents, varsayilan, generation_config=None, on_delta=None, bitis=None):
+    """
+    Send one generate_content request and parse the JSON object in its reply.
 
     Args:
-        text (str): Text containing JSON.
+        model: Gemini model instance.
+        contents (list): Request contents.
+        varsayilan (dict): Value returned when the reply holds no valid JSON.
+        generation_config (dict, optional): Overrides GENERATION_CONFIG.
+        on_delta (callable, optional): Receives reply text chunks as they stream in.
+        bitis (float, optional): ``time.monotonic()`` deadline of the request.
 
     Returns:
-        str or None: JSON substring, or None if not found.
+        dict: Parsed JSON object, or ``varsayilan``.
     """
-    match = re.search(r'\{[\s\S]*\}', text)
-    return match.group() if match else None
+    sonuc, _ = _json_ayristir(model, contents, generation_config, on_delta, bitis)
+    return sonuc if sonuc is not None else varsayilan
 
-def analyze_fat_percentage_with_gemini(user_data, image_path=None):
+def _gunler_iste(model, prompt, on_delta=None, bitis=None):
     """
-    Analyze body fat percentage and generate recommendations using Gemini AI.
+    Request a 7-day plan and return its "gunler" list, using the response cache.
+
+    Only replies that parse into a non-empty plan are cached, so a malformed
+    or truncated answer is retried on the next request instead of being
+    served again.
 
     Args:
-        user_data (dict): User measurements and info.
-        image_path (str, optional): Path to a user photo.
+        model: Gemini model instance.
+        prompt (str): Text-only plan prompt.
+        on_delta (callable, optional): Receives reply text chunks on a cache miss.
+        bitis (float, optional): ``time.monotonic()`` deadline of the request.
 
     Returns:
-        dict: Contains fields:
-            - adSoyad, imageUrl, boy, kilo, yas, cinsiyet, bel, kalca
-            - bmi, bmi_yorum, bko, bko_yorum, yag_orani, analiz
-            - egzersiz_programi (list of daily exercises)
-            - diyet_listesi (list of daily meal plans)
+        list: Daily entries, or an empty list if the reply could not be parsed.
+    """
+    key = make_cache_key(prompt, MODEL_NAME, GENERATION_CONFIG, cache_namespace()) if response_cache else None
+    cached = response_cache.get(key) if key else None
+    if cached is not None:
+        return json.loads(cached)
+
+    sonuc, durum = _json_ayristir(model, [{"text": prompt}], on_delta=on_delta, bitis=bitis)
+    gunler = (sonuc or {}).get("gunler", [])
+    if key and durum != "truncated" and isinstance(gunler, list) and gunler:
+        response_cache.set(key, json.dumps(gunler, ensure_ascii=False))
+    return gunler
+
+def gorsel_parcasi(image, mime_type=None):
+    """
+    Build the inline image part of a request from raw image bytes.
+
+    The protobuf field carries binary data, so no base64 text copy is made.
+    It only accepts ``bytes``: a view of the upload (or of a photo the
+    preprocessor kept as-is) is copied once here, at the SDK boundary, and
+    preprocessed output is passed through unchanged.
+
+    Args:
+        image (bytes-like): Image data, e.g. a memoryview of the upload buffer.
+        mime_type (str, optional): Image MIME type; sniffed from the data when omitted.
+
+    Returns:
+        dict: An ``inline_data`` content part.
+
+    Raises:
+        ValueError: If the data is not a supported image format.
+    """
+    mime_type = mime_type or sniff_image_mime(image)
+    if mime_type is None:
+        raise ValueError("Unsupported image format")
+    data = image if isinstance(image, bytes) else bytes(image)
+    return {"inline_data": {"mime_type": mime_type, "data": data}}
+
+def _tek_cagri_config():
     """
-    api_key = os.getenv('GEMINI_API_KEY')
-    if not api_key:
-        raise ValueError("GEMINI_API_KEY not found in environment variables")
+    Generation config for the single-call mode; adds a native response schema when the SDK supports it.
 
-    genai.configure(api_key=api_key)
+    The pinned google-generativeai 0.3.2 has no ``response_schema``, so on it
+    single mode sends a prompt-only JSON request: the combined reply format is
+    described in ``tek_prompt`` and enforced only by the JSON extractor and
+    ``_tek_cagri_sonuclari``, which reports missing sections.
+    """
+    if supports_response_schema():
+        return {**GENERATION_CONFIG, "response_mime_type": "application/json", "response_schema": ANALIZ_SEMASI}
+    return GENERATION_CONFIG
+
+def _tek_cagri_sonuclari(yanit):
+    """
+    Split a combined single-call reply into the per-call results of the three-call path.
+
+    Args:
+        yanit (dict): Parsed combined reply.
+
+    Returns:
+        tuple: (results dict keyed by call name, list of missing call names)
+    """
+    sonuclar = {}
+    analiz = {k: yanit[k] for k in ("bmi", "bmi_yorum", "bko", "bko_yorum", "yag_orani", "analiz") if k in yanit}
+    if analiz:
+        sonuclar["analiz"] = analiz
+    for ad in ("egzersiz", "diyet"):
+        bolum = yanit.get(ad)
+        gunler = bolum.get("gunler") if isinstance(bolum, dict) else None
+        if isinstance(gunler, list) and gunler:
+            sonuclar[ad] = gunler
+    eksik = [ad for ad in ("analiz", "egzersiz", "diyet") if ad not in sonuclar]
+    return sonuclar, eksik
+
+def _cagrilari_eszamanli_calistir(cagrilar, zaman_asimi):
+    """
+    Run independent model calls concurrently with a shared per-call timeout.
+
+    A call that raises or does not finish within ``zaman_asimi`` seconds is
+    left out of the results and reported as missing instead of failing the
+    whole analysis. Each call is passed the deadline and sends it as its SDK
+    request timeout, so a call still running when the wait is abandoned
+    stops then too and gives back its call governor slot.
+
+    Args:
+        cagrilar (dict): Call name -> callable taking the ``time.monotonic()`` deadline.
+        zaman_asimi (float): Seconds to wait for each call.
+
+    Returns:
+        tuple: (results dict keyed by call name, list of missing call names)
+
+    Raises:
+        ModelOverloaded: If no call succeeds and at least one was shed by the call governor.
+        RuntimeError: If no call succeeds.
+    """
+    bitis = time.monotonic() + zaman_asimi
+    futures = {ad: _executor.submit(cagri, bitis) for ad, cagri in cagrilar.items()}
+    wait(futures.values(), timeout=zaman_asimi)
+
+    sonuclar = {}
+    eksik = []
+    reddedilen = None
+    for ad, future in futures.items():
+        if not future.done():
+            # Not yet started calls are dropped; running ones end at the deadline.
+            future.cancel()
+            logger.warning("Gemini call '%s' timed out after %.1fs", ad, zaman_asimi)
+            eksik.append(ad)
+        elif future.exception() is not None:
+            logger.warning("Gemini call '%s' failed: %s", ad, future.exception())
+            if isinstance(future.exception(), ModelOverloaded):
+                reddedilen = future.exception()
+            eksik.append(ad)
+        else:
+            sonuclar[ad] = future.result()
+
+    if not sonuclar and reddedilen is not None:
+        raise reddedilen
+    if not sonuclar:
+        raise RuntimeError(f"All Gemini calls failed: {', '.join(eksik)}")
+    return sonuclar, eksik
+
+def _model_al(user_id=None):
+    """
+    Return the shared analysis model behind the retry policy and call governor, reporting setup failures as ValueError.
+    """
     try:
-        model = genai.GenerativeModel(model_name="gemini-1.5-flash")
+        return resilient(governed(get_model(MODEL_NAME), user_id))
+    except ValueError:
+        raise
     except Exception as e:
         raise ValueError(f"Failed to initialize Gemini model: {str(e)}")
 
+def _analiz_hazirla(user_data):
+    """
+    Validate the measurements, compute BMI/BKO locally and build the prompts.
+
+    Args:
+        user_data (dict): User measurements and info.
+
+    Returns:
+        dict: "olcumler" (measurements with local BMI/BKO) and the prompt texts.
+
+    Raises:
+        ValueError: If required measurements are missing.
+    """
     boy = user_data.get('measurements', {}).get('height_cm')
     kilo = user_data.get('measurements', {}).get('weight_kg')
     yas = user_data.get('age')
@@ -158,9 +425,7 @@ def analyze_fat_percentage_with_gemini(user_data, image_path=None):
     bko = bel_kalca_orani(bel, kalca)
     bko_yorum = yorumla_bko(bko, cinsiyet)
 
-    prompt_text = (
-        f"Aşağıdaki kişi bilgilerini ve görselini değerlendir. "
-        f"Sadece aşağıdaki JSON formatında cevap ver:\n\n"
+    kisi_bilgileri = (
         f"- Boy: {boy} cm\n"
         f"- Kilo: {kilo} kg\n"
         f"- Yaş: {yas}\n"
@@ -169,6 +434,12 @@ def analyze_fat_percentage_with_gemini(user_data, image_path=None):
         f"- Kalça çevresi: {kalca} cm\n"
         f"- Vücut Kitle Endeksi (BMI): {bmi} → {bmi_yorum}\n"
         f"- Bel/Kalça Oranı (BKO): {bko} → {bko_yorum}\n\n"
+    )
+
+    prompt_text = (
+        f"Aşağıdaki kişi bilgilerini ve görselini değerlendir. "
+        f"Sadece aşağıdaki JSON formatında cevap ver:\n\n"
+        + kisi_bilgileri +
         "JSON formatı:\n"
         "{\n"
         '  "bmi": <float>,\n'
@@ -217,57 +488,264 @@ def analyze_fat_percentage_with_gemini(user_data, image_path=None):
         "}"
     )
 
-    image_data = None
-    if image_path and os.path.exists(image_path):
-        with open(image_path, "rb") as image_file:
-            image_bytes = image_file.read()
-            image_data = {
-                "inline_data": {
-                    "mime_type": "image/webp",
-                    "data": base64.b64encode(image_bytes).decode("utf-8")
-                }
-            }
-
-    contents = [{"text": prompt_text}]
-    if image_data:
-        contents.append(image_data)
-
-    response = model.generate_content(contents=contents, generation_config={"temperature": 0.3})
-    raw_json = extract_json(response.text.strip())
-    try:
-        gemini_json = json.loads(raw_json)
-    except Exception:
-        gemini_json = {}
+    tek_prompt = (
+        "Aşağıdaki kişi bilgilerini ve görselini değerlendir; ardından kişiye özel "
+        "7 günlük egzersiz programı ve 7 günlük diyet listesi oluştur.\n\n"
+        + kisi_bilgileri +
+        "Egzersiz programı kardiyo, esneme ve ağırlık çalışmaları içersin. "
+        "Diyetin amacı kilo vermek ve sağlıklı yaşam tarzı geliştirmektir; her gün için kahvaltı, "
+        "öğle yemeği, akşam yemeği, ara öğün ve günlük toplam kalori (1500–2200 kcal) ver.\n\n"
+        "JSON formatı:\n"
+        "{\n"
+        '  "bmi": <float>,\n'
+        '  "bmi_yorum": "<string>",\n'
+        '  "bko": <float>,\n'
+        '  "bko_yorum": "<string>",\n'
+        '  "yag_orani": "<string, % cinsinden>",\n'
+        '  "analiz": "<string, 3 cümlelik kısa değerlendirme>",\n'
+        '  "egzersiz": {"gunler": [{"gun": "Pazartesi", "egzersiz": "<string>"}, ...]},\n'
+        '  "diyet": {"gunler": [{"gun": "Pazartesi", "kahvalti": "<string>", "ogle": "<string>", '
+        '"aksam": "<string>", "ara_ogun": "<string>", "toplam_kalori": <float>}, ...]}\n'
+        "}\n\n"
+        "Yalnızca bu JSON'u döndür. Başka açıklama, format veya markdown kullanma. "
+        "Yağ oranını yalnızca % cinsinden tek bir sayı olarak döndür."
+    )
 
-    exercise_response = model.generate_content(contents=[{"text": egzersiz_prompt}], generation_config={"temperature": 0.3})
-    try:
-        egzersiz_programi = json.loads(extract_json(exercise_response.text.strip())).get("gunler", [])
-    except Exception:
-        egzersiz_programi = []
+    return {
+        "olcumler": {
+            "boy": boy,
+            "kilo": kilo,
+            "yas": yas,
+            "cinsiyet": cinsiyet,
+            "bel": bel,
+            "kalca": kalca,
+            "bmi": bmi,
+            "bmi_yorum": bmi_yorum,
+            "bko": bko,
+            "bko_yorum": bko_yorum,
+        },
+        "prompt_text": prompt_text,
+        "egzersiz_prompt": egzersiz_prompt,
+        "diyet_prompt": diyet_prompt,
+        "tek_prompt": tek_prompt,
+    }
 
-    diyet_response = model.generate_content(contents=[{"text": diyet_prompt}], generation_config={"temperature": 0.3})
-    try:
-        diyet_listesi = json.loads(extract_json(diyet_response.text.strip())).get("gunler", [])
-    except Exception:
-        diyet_listesi = []
+def _gorsel_hazirla(image_path, image, mime_type):
+    """
+    Load and validate the photo and start preprocessing it in the background.
 
-    sonuc_json = {
-        "adSoyad": user_data.get('fullName', ''),
-        "imageUrl": user_data.get('avatarUrl', ''),
-        "boy": boy,
-        "kilo": kilo,
-        "yas": yas,
-        "cinsiyet": cinsiyet,
-        "bel": bel,
-        "kalca": kalca,
-        "bmi": gemini_json.get("bmi", bmi),
-        "bmi_yorum": gemini_json.get("bmi_yorum", bmi_yorum),
-        "bko": gemini_json.get("bko", bko),
-        "bko_yorum": gemini_json.get("bko_yorum", bko_yorum),
+    Returns:
+        tuple: (image bytes or None, MIME type, preprocessing Future or None)
+
+    Raises:
+        ValueError: If the photo is not a supported image.
+    """
+    if image is None and image_path and os.path.exists(image_path):
+        image = image_buffer(image_path)
+
+    gorsel_future = None
+    if image is not None:
+        mime_type = mime_type or sniff_image_mime(image)
+        if mime_type is None:
+            raise ValueError("Unsupported image format")
+        if image_preprocessor:
+            # Görsel küçültülürken metin tabanlı egzersiz ve diyet çağrıları başlar.
+            gorsel_future = image_preprocessor.submit(image, mime_type)
+    return image, mime_type, gorsel_future
+
+def _cagrilari_olustur(model, hazirlik, image, mime_type, gorsel_future, on_delta=None):
+    """
+    Build the model calls for the configured GEMINI_ANALYSIS_MODE.
+
+    Args:
+        on_delta (callable, optional): ``on_delta(call name, text chunk)`` for streamed replies.
+
+    Returns:
+        dict: Call name -> callable taking an optional ``time.monotonic()`` deadline;
+            a single "tek" call in single mode.
+    """
+    def akis(ad):
+        return (lambda metin: on_delta(ad, metin)) if on_delta else None
+
+    def gorselli_iste(ad, metin, generation_config=None, bitis=None):
+        contents = [{"text": metin}]
+        if gorsel_future is not None:
+            kalan = max(0.0, bitis - time.monotonic()) if bitis is not None else None
+            contents.append(gorsel_parcasi(*gorsel_future.result(timeout=kalan)))
+        elif image is not None:
+            contents.append(gorsel_parcasi(image, mime_type))
+        return _json_iste(model, contents, {}, generation_config, akis(ad), bitis)
+
+    if GEMINI_ANALYSIS_MODE == 'single':
+        return {"tek": lambda bitis=None: gorselli_iste("tek", hazirlik["tek_prompt"], _tek_cagri_config(), bitis)}
+    return {
+        "analiz": lambda bitis=None: gorselli_iste("analiz", hazirlik["prompt_text"], bitis=bitis),
+        "egzersiz": lambda bitis=None: _gunler_iste(model, hazirlik["egzersiz_prompt"], akis("egzersiz"), bitis),
+        "diyet": lambda bitis=None: _gunler_iste(model, hazirlik["diyet_prompt"], akis("diyet"), bitis),
+    }
+
+def _analiz_alanlari(olcumler, gemini_json):
+    """
+    Merge the model's analysis fields over the locally computed ones.
+    """
+    return {
+        "bmi": gemini_json.get("bmi", olcumler["bmi"]),
+        "bmi_yorum": gemini_json.get("bmi_yorum", olcumler["bmi_yorum"]),
+        "bko": gemini_json.get("bko", olcumler["bko"]),
+        "bko_yorum": gemini_json.get("bko_yorum", olcumler["bko_yorum"]),
         "yag_orani": normalize_yag_orani(gemini_json.get("yag_orani")),
         "analiz": gemini_json.get("analiz"),
-        "egzersiz_programi": egzersiz_programi,
-        "diyet_listesi": diyet_listesi
     }
 
+def _sonuc_olustur(user_data, olcumler, sonuclar, eksik_bolumler):
+    """
+    Assemble the combined analysis result from the per-call results.
+    """
+    sonuc_json = {
+        "adSoyad": user_data.get('fullName', ''),
+        "imageUrl": user_data.get('avatarUrl', ''),
+        "boy": olcumler["boy"],
+        "kilo": olcumler["kilo"],
+        "yas": olcumler["yas"],
+        "cinsiyet": olcumler["cinsiyet"],
+        "bel": olcumler["bel"],
+        "kalca": olcumler["kalca"],
+    }
+    sonuc_json.update(_analiz_alanlari(olcumler, sonuclar.get("analiz", {})))
+    sonuc_json.update({
+        "egzersiz_programi": sonuclar.get("egzersiz", []),
+        "diyet_listesi": sonuclar.get("diyet", []),
+        "eksik_bolumler": eksik_bolumler
+    })
     return sonuc_json
+
+def analyze_fat_percentage_with_gemini(user_data, image_path=None, image=None, mime_type=None):
+    """
+    Analyze body fat percentage and generate recommendations using Gemini AI.
+
+    By default the analysis, exercise plan and diet plan are three model calls;
+    with GEMINI_ANALYSIS_MODE=single they are requested as one combined reply.
+    Calls are admitted by the call governor under ``user_data['user_id']``.
+
+    Args:
+        user_data (dict): User measurements and info.
+        image_path (str, optional): Path to a user photo.
+        image (bytes-like, optional): Photo bytes, used instead of ``image_path``.
+        mime_type (str, optional): MIME type of the photo; sniffed from its bytes when omitted.
+
+    Returns:
+        dict: Contains fields:
+            - adSoyad, imageUrl, boy, kilo, yas, cinsiyet, bel, kalca
+            - bmi, bmi_yorum, bko, bko_yorum, yag_orani, analiz
+            - egzersiz_programi (list of daily exercises)
+            - diyet_listesi (list of daily meal plans)
+            - eksik_bolumler (names of calls that failed or timed out)
+
+    Raises:
+        ValueError: If the API key or required measurements are missing, or the photo is not a supported image.
+        ModelOverloaded: If the call governor shed every call (or the only call).
+        RuntimeError: If every model call fails in concurrent mode, or the single call fails.
+    """
+    model = _model_al(user_data.get('user_id'))
+    hazirlik = _analiz_hazirla(user_data)
+    image, mime_type, gorsel_future = _gorsel_hazirla(image_path, image, mime_type)
+    cagrilar = _cagrilari_olustur(model, hazirlik, image, mime_type, gorsel_future)
+
+    try:
+        if GEMINI_ANALYSIS_MODE == 'single':
+            sonuclar, _ = _cagrilari_eszamanli_calistir(cagrilar, GEMINI_CALL_TIMEOUT)
+            sonuclar, eksik_bolumler = _tek_cagri_sonuclari(sonuclar["tek"])
+        elif GEMINI_CONCURRENT_CALLS:
+            sonuclar, eksik_bolumler = _cagrilari_eszamanli_calistir(cagrilar, GEMINI_CALL_TIMEOUT)
+        else:
+            sonuclar = {ad: cagri(time.monotonic() + GEMINI_CALL_TIMEOUT) for ad, cagri in cagrilar.items()}
+            eksik_bolumler = []
+    finally:
+        if gorsel_future is not None:
+            # Çağıranın görsel tamponu bu fonksiyondan dönünce serbest bırakılabilir.
+            wait([gorsel_future])
+
+    return _sonuc_olustur(user_data, hazirlik["olcumler"], sonuclar, eksik_bolumler)
+
+def analyze_fat_percentage_stream(user_data, image=None, mime_type=None):
+    """
+    Run the same analysis as ``analyze_fat_percentage_with_gemini`` and yield progress as it happens.
+
+    The model calls always run concurrently; each section is yielded as soon
+    as its call finishes.
+
+    Args:
+        user_data (dict): User measurements and info.
+        image (bytes-like, optional): Photo bytes; must stay valid until the generator is exhausted or closed.
+        mime_type (str, optional): MIME type of the photo; sniffed from its bytes when omitted.
+
+    Yields:
+        tuple: (event name, data):
+            - "olcumler": measurements with the locally computed BMI/BKO, before any model call returns
+            - "parca": {"bolum", "metin"} reply text chunks as the model streams them (GEMINI_STREAM_TOKENS)
+            - "analiz": the body fat analysis fields
+            - "egzersiz_programi" / "diyet_listesi": the daily plans
+            - "sonuc": the complete result, as returned by ``analyze_fat_percentage_with_gemini``
+
+    Raises:
+        ValueError: Before the first event, for the same reasons as ``analyze_fat_percentage_with_gemini``.
+        ModelOverloaded: If the call governor shed every call.
+        RuntimeError: If every model call fails or times out.
+    """
+    model = _model_al(user_data.get('user_id'))
+    hazirlik = _analiz_hazirla(user_data)
+    image, mime_type, gorsel_future = _gorsel_hazirla(None, image, mime_type)
+    olcumler = hazirlik["olcumler"]
+    yield "olcumler", dict(olcumler)
+
+    olaylar = queue.Queue()
+    on_delta = (lambda ad, metin: olaylar.put(("parca", ad, metin))) if GEMINI_STREAM_TOKENS else None
+    cagrilar = _cagrilari_olustur(model, hazirlik, image, mime_type, gorsel_future, on_delta)
+
+    def calistir(ad, cagri):
+        try:
+            olaylar.put(("bitti", ad, cagri(bitis)))
+        except Exception as e:
+            olaylar.put(("hata", ad, e))
+
+    bitis = time.monotonic() + GEMINI_CALL_TIMEOUT
+    futures = [_executor.submit(calistir, ad, cagri) for ad, cagri in cagrilar.items()]
+    bekleyen = set(cagrilar)
+    sonuclar = {}
+    reddedilen = None
+    try:
+        while bekleyen:
+            try:
+                tur, ad, veri = olaylar.get(timeout=max(0.0, bitis - time.monotonic()))
+            except queue.Empty:
+                break
+            if tur == "parca":
+                yield "parca", {"bolum": ad, "metin": veri}
+                continue
+            bekleyen.discard(ad)
+            if tur == "hata":
+                logger.warning("Gemini call '%s' failed: %s", ad, veri)
+                if isinstance(veri, ModelOverloaded):
+                    reddedilen = veri
+                continue
+            bolumler = _tek_cagri_sonuclari(veri)[0] if ad == "tek" else {ad: veri}
+            for bolum, deger in bolumler.items():
+                sonuclar[bolum] = deger
+                if bolum == "analiz":
+                    yield "analiz", _analiz_alanlari(olcumler, deger)
+                else:
+                    yield ("egzersiz_programi" if bolum == "egzersiz" else "diyet_listesi"), deger
+    finally:
+        for future in futures:
+            future.cancel()
+        if gorsel_future is not None:
+            wait([gorsel_future])
+
+    for ad in bekleyen:
+        logger.warning("Gemini call '%s' timed out after %.1fs", ad, GEMINI_CALL_TIMEOUT)
+    if not sonuclar and reddedilen is not None:
+        raise reddedilen
+    if not sonuclar:
+        raise RuntimeError(f"All Gemini calls failed: {', '.join(cagrilar)}")
+    eksik_bolumler = [ad for ad in ("analiz", "egzersiz", "diyet") if ad not in sonuclar]
+    yield "sonuc", _sonuc_olustur(user_data, olcumler, sonuclar, eksik_bolumler)
@@ -0,0 +1,334 @@
+"""
+gemini/governor.py
+
+Admission control for outbound Gemini calls.
+
+Every ``generate_content`` call takes a slot from ``CallGovernor`` first: at
+most GEMINI_MAX_CONCURRENT calls are in flight, calls start no faster than
+the GEMINI_RATE_LIMIT token bucket allows, and waiting calls are served
+round-robin by user so one user's burst cannot starve everyone else. When
+the wait queue is full, a user already has GEMINI_MAX_PER_USER calls queued
+or running, or a slot does not free up within GEMINI_QUEUE_TIMEOUT, the call
+is rejected with ``ModelOverloaded`` (HTTP 429 with Retry-After) instead of
+piling up threads until the provider starts failing every request.
+
+A call carrying an SDK ``request_options`` timeout waits for its slot no
+longer than that timeout, and the time spent waiting is taken off the
+timeout passed on, so the slot is given back by the caller's deadline.
+"""
+
+import contextlib
+import math
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+
+from dotenv import load_dotenv
+from google.api_core import exceptions as api_exceptions
+
+load_dotenv()
+
+
+class ModelOverloaded(Exception):
+    """
+    Raised when a model call is shed; ``retry_after`` is a suggested wait in whole seconds.
+    """
+
+    def __init__(self, message, retry_after=1):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def request_timeout(kwargs):
+    """
+    Return the ``request_options`` timeout of generate_content keyword arguments, or None.
+    """
+    options = kwargs.get('request_options')
+    if isinstance(options, dict):
+        return options.get('timeout')
+    return getattr(options, 'timeout', None)
+
+
+def with_request_timeout(kwargs, timeout):
+    """
+    Return a copy of generate_content keyword arguments with the ``request_options`` timeout replaced.
+    """
+    options = kwargs.get('request_options')
+    options = dict(options) if isinstance(options, dict) else {}
+    options['timeout'] = timeout
+    return dict(kwargs, request_options=options)
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket refilled at ``rate`` tokens per second up to ``burst``.
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.capacity = max(1.0, burst)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, max_wait):
+        """
+        Take one token.
+
+        Returns:
+            float or None: Seconds to wait before the token may be used, or
+            None (nothing taken) if that would be longer than ``max_wait``.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            wait = 0.0 if self._tokens >= 1 else (1 - self._tokens) / self.rate
+            if wait > max_wait:
+                return None
+            self._tokens -= 1
+            return wait
+
+
+class CallGovernor:
+    """
+    Concurrency limit, rate limit and per-user fair queue for model calls.
+    """
+
+    def __init__(self, max_concurrent=8, rate=0.0, burst=None, max_queue=32, max_per_user=6, queue_timeout=10.0):
+        """
+        Args:
+            max_concurrent (int): Calls allowed in flight at once.
+            rate (float): Calls started per second; 0 disables the rate limit.
+            burst (float, optional): Token bucket size; defaults to ``rate``.
+            max_queue (int): Calls allowed to wait for a slot before new ones are shed.
+            max_per_user (int): Calls one user may have queued or in flight.
+            queue_timeout (float): Seconds a call may wait for a slot and a token.
+        """
+        self.max_concurrent = max_concurrent
+        self.rate = rate
+        self.max_queue = max_queue
+        self.max_per_user = max_per_user
+        self.queue_timeout = queue_timeout
+        self._bucket = TokenBucket(rate, burst or rate) if rate > 0 else None
+        self._cond = threading.Condition()
+        # user -> tickets of that user's waiting calls; users are served in this order, round-robin.
+        self._waiting = OrderedDict()
+        self._per_user = {}
+        self._in_flight = 0
+        self._queued = 0
+        self._call_seconds = 1.0
+        self.admitted = 0
+        self.max_queue_depth = 0
+        self.wait_seconds = 0.0
+        self.shed = {"queue_full": 0, "user_limit": 0, "timeout": 0, "rate_limit": 0}
+
+    def _retry_after(self):
+        """
+        Estimate how long until a new call could start. Caller holds the lock.
+        """
+        estimate = (self._queued + 1) * self._call_seconds / self.max_concurrent
+        if self.rate > 0:
+            estimate = max(estimate, (self._queued + 1) / self.rate)
+        return max(1, math.ceil(estimate))
+
+    def _reject(self, reason, message):
+        self.shed[reason] += 1
+        return ModelOverloaded(message, self._retry_after())
+
+    def _check(self, key):
+        """
+        Raise if a new call for ``key`` would be shed. Caller holds the lock.
+        """
+        if self._queued >= self.max_queue:
+            raise self._reject("queue_full", f"Too many model calls waiting ({self._queued})")
+        if self._per_user.get(key, 0) >= self.max_per_user:
+            raise self._reject("user_limit", f"Too many model calls in progress for this user ({self.max_per_user})")
+
+    def check(self, user_id=None):
+        """
+        Raise ``ModelOverloaded`` if a call for ``user_id`` would be shed right now, without taking a slot.
+        """
+        with self._cond:
+            self._check(user_id or '')
+
+    def _dequeue(self, key, ticket, served):
+        """
+        Remove a waiting ticket; a served user moves to the back of the rotation. Caller holds the lock.
+        """
+        tickets = self._waiting[key]
+        tickets.remove(ticket)
+        if not tickets:
+            del self._waiting[key]
+        elif served:
+            self._waiting.move_to_end(key)
+        self._queued -= 1
+
+    def _is_next(self, ticket):
+        if self._in_flight >= self.max_concurrent:
+            return False
+        return next(iter(self._waiting.values()))[0] is ticket
+
+    def _release(self, key, duration=None):
+        with self._cond:
+            self._in_flight -= 1
+            self._per_user[key] -= 1
+            if not self._per_user[key]:
+                del self._per_user[key]
+            if duration is not None:
+                self._call_seconds = 0.8 * self._call_seconds + 0.2 * duration
+            self._cond.notify_all()
+
+    def acquire(self, user_id=None, max_wait=None):
+        """
+        Wait for a call slot and a rate-limit token.
+
+        Args:
+            user_id (str, optional): User the call is made for.
+            max_wait (float, optional): Wait no longer than this, even if ``queue_timeout`` is longer.
+
+        Raises:
+            ModelOverloaded: If the call is shed.
+        """
+        key = user_id or ''
+        started = time.monotonic()
+        timeout = self.queue_timeout if max_wait is None else max(0.0, min(self.queue_timeout, max_wait))
+        deadline = started + timeout
+        with self._cond:
+            self._check(key)
+            ticket = object()
+            self._waiting.setdefault(key, deque()).append(ticket)
+            self._per_user[key] = self._per_user.get(key, 0) + 1
+            self._queued += 1
+            self.max_queue_depth = max(self.max_queue_depth, self._queued)
+            try:
+                while not self._is_next(ticket):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise self._reject("timeout", f"No model call slot within {timeout:g}s")
+                    self._cond.wait(remaining)
+            except BaseException:
+                self._dequeue(key, ticket, served=False)
+                self._per_user[key] -= 1
+                if not self._per_user[key]:
+                    del self._per_user[key]
+                self._cond.notify_all()
+                raise
+            self._dequeue(key, ticket, served=True)
+            self._in_flight += 1
+            self.admitted += 1
+            self.wait_seconds += time.monotonic() - started
+            # The next waiter may be able to start too.
+            self._cond.notify_all()
+
+        if self._bucket is not None:
+            wait = self._bucket.reserve(max(0.0, deadline - time.monotonic()))
+            if wait is None:
+                self._release(key)
+                with self._cond:
+                    raise self._reject("rate_limit", "Model call rate limit reached")
+            if wait:
+                time.sleep(wait)
+
+    @contextlib.contextmanager
+    def slot(self, user_id=None, max_wait=None):
+        """
+        Hold a call slot for the duration of the ``with`` block.
+        """
+        self.acquire(user_id, max_wait)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self._release(user_id or '', time.monotonic() - started)
+
+    def stats(self):
+        """
+        Return in-flight and queued call counts, queue high-water mark, shed counts and average wait.
+        """
+        with self._cond:
+            return {
+                "in_flight": self._in_flight,
+                "queued": self._queued,
+                "users_waiting": len(self._waiting),
+                "max_queue_depth": self.max_queue_depth,
+                "admitted": self.admitted,
+                "shed": dict(self.shed),
+                "avg_wait_s": round(self.wait_seconds / self.admitted, 4) if self.admitted else 0.0,
+                "avg_call_s": round(self._call_seconds, 3),
+                "max_concurrent": self.max_concurrent,
+                "rate_limit": self.rate,
+            }
+
+
+class GovernedModel:
+    """
+    Model wrapper whose ``generate_content`` runs inside a governor slot for one user.
+
+    Streamed replies hold the slot until the stream is consumed or closed.
+    """
+
+    def __init__(self, model, governor, user_id=None):
+        self.model = model
+        self.governor = governor
+        self.user_id = user_id
+
+    def generate_content(self, *args, **kwargs):
+        if kwargs.get('stream'):
+            return self._stream(args, kwargs)
+        timeout = request_timeout(kwargs)
+        started = time.monotonic()
+        with self.governor.slot(self.user_id, timeout):
+            return self.model.generate_content(*args, **self._remaining(kwargs, timeout, started))
+
+    def _stream(self, args, kwargs):
+        timeout = request_timeout(kwargs)
+        started = time.monotonic()
+        with self.governor.slot(self.user_id, timeout):
+            yield from self.model.generate_content(*args, **self._remaining(kwargs, timeout, started))
+
+    @staticmethod
+    def _remaining(kwargs, timeout, started):
+        """
+        Take the time spent waiting for the slot off the request timeout.
+        """
+        if timeout is None:
+            return kwargs
+        remaining = timeout - (time.monotonic() - started)
+        if remaining <= 0:
+            raise api_exceptions.DeadlineExceeded(f"Model call deadline of {timeout:g}s passed while waiting for a slot")
+        return with_request_timeout(kwargs, remaining)
+
+    def __getattr__(self, name):
+        return getattr(self.model, name)
+
+
+def create_call_governor():
+    """
+    Build the governor described by the GEMINI_* limit environment variables.
+
+    Returns:
+        CallGovernor or None: None when GEMINI_GOVERNOR is disabled.
+    """
+    if os.getenv('GEMINI_GOVERNOR', 'true').lower() not in ('1', 'true', 'yes'):
+        return None
+    rate = float(os.getenv('GEMINI_RATE_LIMIT', '5'))
+    return CallGovernor(
+        max_concurrent=int(os.getenv('GEMINI_MAX_CONCURRENT', '8')),
+        rate=rate,
+        burst=float(os.getenv('GEMINI_RATE_BURST') or rate * 2),
+        max_queue=int(os.getenv('GEMINI_MAX_QUEUE', '32')),
+        max_per_user=int(os.getenv('GEMINI_MAX_PER_USER', '6')),
+        queue_timeout=float(os.getenv('GEMINI_QUEUE_TIMEOUT', '10')),
+    )
+
+
+call_governor = create_call_governor()
+
+
+def governed(model, user_id=None):
+    """
+    Wrap ``model`` so its calls go through ``call_governor``; returns it unchanged when the governor is disabled.
+    """
+    return GovernedModel(model, call_governor, user_id) if call_governor is not None else model
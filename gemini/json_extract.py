@@ -0,0 +1,217 @@
+"""
+gemini/json_extract.py
+
+Incremental extraction of JSON objects from model replies.
+
+Model replies wrap the JSON we ask for in code fences, prose or trailing
+braces, and long plans sometimes end mid-object when the reply is cut off.
+``JsonExtractor`` scans the text once, character by character, tracking
+string and nesting state, so it runs in linear time and can be fed streamed
+chunks as they arrive. Each complete top-level object is tried in order;
+one that does not parse is retried with trailing commas removed, and a
+reply that ends inside an object is closed at the last complete element.
+
+Parse outcomes are counted for the /metrics endpoint.
+"""
+
+import json
+import threading
+
+_OPENERS = {'{': '}', '[': ']'}
+
+_lock = threading.Lock()
+_counts = {"parsed": 0, "repaired": 0, "truncated": 0, "failed": 0}
+
+
+def _record(outcome):
+    with _lock:
+        _counts[outcome] += 1
+
+
+def stats():
+    """
+    Return counts of replies parsed as-is, parsed after repair, salvaged from a truncated reply, and failed.
+    """
+    with _lock:
+        counts = dict(_counts)
+    total = sum(counts.values())
+    counts["failure_rate"] = round(counts["failed"] / total, 4) if total else 0.0
+    return counts
+
+
+def strip_trailing_commas(text):
+    """
+    Remove commas that directly precede a closing brace or bracket, ignoring string contents.
+    """
+    out = []
+    in_string = escaped = False
+    pending_comma = None
+    for ch in text:
+        if in_string:
+            out.append(ch)
+            if escaped:
+                escaped = False
+            elif ch == '\\':
+                escaped = True
+            elif ch == '"':
+                in_string = False
+            continue
+        if ch == ',':
+            if pending_comma is not None:
+                out.append(pending_comma)
+            pending_comma = ch
+            continue
+        if ch.isspace():
+            if pending_comma is not None:
+                pending_comma += ch
+            else:
+                out.append(ch)
+            continue
+        if pending_comma is not None:
+            if ch in '}]':
+                out.append(pending_comma[1:])
+            else:
+                out.append(pending_comma)
+            pending_comma = None
+        if ch == '"':
+            in_string = True
+        out.append(ch)
+    if pending_comma is not None:
+        out.append(pending_comma)
+    return ''.join(out)
+
+
+class JsonExtractor:
+    """
+    Streaming scanner that yields the first JSON object in a model reply.
+
+    Usage::
+
+        extractor = JsonExtractor()
+        for chunk in chunks:
+            extractor.feed(chunk)
+        obj = extractor.result()
+    """
+
+    def __init__(self):
+        self._buffer = []
+        self._stack = []
+        self._in_string = False
+        self._escaped = False
+        self._last_comma = None
+        self._length = 0
+        self._found = None
+        self._recorded = False
+        self.outcome = None
+
+    def feed(self, chunk):
+        """
+        Scan the next piece of the reply. Text before the first '{' is not kept.
+        """
+        if self._found is not None:
+            return
+        for ch in chunk:
+            if not self._stack:
+                if ch != '{':
+                    continue
+                self._buffer = []
+                self._length = 0
+                self._last_comma = None
+            self._buffer.append(ch)
+            self._length += 1
+
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif ch == '\\':
+                    self._escaped = True
+                elif ch == '"':
+                    self._in_string = False
+                continue
+
+            if ch == '"':
+                self._in_string = True
+            elif ch in _OPENERS:
+                self._stack.append(_OPENERS[ch])
+            elif ch in '}]':
+                if not self._stack or ch != self._stack[-1]:
+                    # Mismatched closer: treat the span so far as unusable.
+                    self._stack = []
+                    continue
+                self._stack.pop()
+                if not self._stack:
+                    if self._try_candidate(''.join(self._buffer)):
+                        return
+            elif ch == ',':
+                self._last_comma = (self._length - 1, tuple(self._stack))
+
+    def _try_candidate(self, text):
+        """
+        Parse one complete top-level object, repairing trailing commas if needed.
+        """
+        for outcome, candidate in (("parsed", text), ("repaired", None)):
+            if candidate is None:
+                candidate = strip_trailing_commas(text)
+                if candidate == text:
+                    break
+            try:
+                obj = json.loads(candidate)
+            except ValueError:
+                continue
+            if isinstance(obj, dict):
+                self._found, self.outcome = obj, outcome
+                return True
+        return False
+
+    def _salvage_truncated(self):
+        """
+        Close a reply that ended inside an object at its last complete element.
+        """
+        if not self._stack or self._last_comma is None:
+            return None
+        cut, stack = self._last_comma
+        text = ''.join(self._buffer[:cut]) + ''.join(reversed(stack))
+        for candidate in (text, strip_trailing_commas(text)):
+            try:
+                obj = json.loads(candidate)
+            except ValueError:
+                continue
+            if isinstance(obj, dict):
+                return obj
+        return None
+
+    def result(self):
+        """
+        Finish the reply and return the first parseable object, or None. Records the outcome in ``stats``.
+        """
+        if self._recorded:
+            return self._found
+        if self._found is None:
+            salvaged = self._salvage_truncated()
+            if salvaged is not None:
+                self._found, self.outcome = salvaged, "truncated"
+            else:
+                self.outcome = "failed"
+        self._recorded = True
+        _record(self.outcome)
+        return self._found
+
+
+def parse_json_object(text):
+    """
+    Extract and parse the first JSON object in ``text``.
+
+    Returns:
+        tuple: (dict or None, outcome) where outcome is 'parsed', 'repaired', 'truncated' or 'failed'.
+    """
+    extractor = JsonExtractor()
+    extractor.feed(text or '')
+    return extractor.result(), extractor.outcome
+
+
+def extract_json(text):
+    """
+    Return the first JSON object in ``text`` as a JSON string, or None if not found.
+    """
+    obj, _ = parse_json_object(text)
+    return json.dumps(obj, ensure_ascii=False) if obj is not None else None
@@ -1,11 +1,72 @@
+"""
+gemini/meal_planner.py
+
+Weekly meal plan generation through the configured model backend.
+"""
+
+import json
+import logging
+
+from gemini.backends import get_model
+from gemini.client import DEFAULT_MODEL_NAME
+from gemini.governor import ModelOverloaded, governed
+from gemini.json_extract import parse_json_object
+from gemini.resilience import resilient
+
+logger = logging.getLogger(__name__)
+
+MODEL_NAME = DEFAULT_MODEL_NAME
+GENERATION_CONFIG = {"temperature": 0.4}
+WEEKDAYS = ["monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday"]
+
+
+def build_meal_plan_prompt(user_profile_data):
+    """
+    Build the meal plan prompt from the profile fields prepared by /generate-diet-plan.
+    """
+    profile = {k: user_profile_data.get(k) for k in
+               ("age", "gender", "measurements", "calculated_metrics", "lifestyle", "body_fat_estimates")}
+    return (
+        "Create a personalized 7-day meal plan for the person below.\n"
+        f"{user_profile_data.get('body_composition_assessment_info', '')}\n\n"
+        f"Profile:\n{json.dumps(profile, ensure_ascii=False, default=str)}\n\n"
+        "Respond only with JSON in this format:\n"
+        "{\n"
+        '  "summary": "<string>",\n'
+        '  "monday": {"breakfast": "<string>", "lunch": "<string>", "dinner": "<string>", "snack": "<string>"},\n'
+        "  ... one entry for each day through sunday ...,\n"
+        '  "notes_from_gemini": "<string>"\n'
+        "}"
+    )
+
+
 def generate_diet_plan_with_gemini(user_profile_data):
+    """
+    Generate a 7-day meal plan for a user.
+
+    Args:
+        user_profile_data (dict): Profile fields and ``body_composition_assessment_info`` as built by /generate-diet-plan.
+
+    Returns:
+        dict: ``summary``, one entry per weekday present in the reply and ``notes_from_gemini``,
+        or ``{"error": ...}`` if the model call or its reply failed.
 
-    print(f"--- MOCK/Actual: Calling Gemini Meal Planner ---")
-    print(f"User Profile for Meal Plan: {user_profile_data}")
+    Raises:
+        ModelOverloaded: If the call was shed by the call governor or the circuit breaker.
+    """
+    try:
+        model = resilient(governed(get_model(MODEL_NAME), user_profile_data.get("user_id")))
+        response = model.generate_content(contents=[{"text": build_meal_plan_prompt(user_profile_data)}],
+                                          generation_config=GENERATION_CONFIG)
+        plan, _ = parse_json_object(response.text)
+    except ModelOverloaded:
+        raise
+    except Exception as e:
+        logger.error("Meal plan generation failed: %s", e)
+        return {"error": str(e)}
 
-    mock_diet_plan = {
-        "summary": "Mock plan considering body comp. info: " + user_profile_data['body_composition_assessment_info'],
-        "monday": {"breakfast": "...", "lunch": "...", "dinner": "..."},
-        "notes_from_gemini": user_profile_data.get('body_composition_assessment_info', '')
-    }
-    return mock_diet_plan
+    if not plan or not any(day in plan for day in WEEKDAYS):
+        return {"error": "Model reply did not contain a meal plan"}
+    plan.setdefault("summary", "")
+    plan.setdefault("notes_from_gemini", "")
+    return plan
@@ -0,0 +1,407 @@
+"""
+gemini/resilience.py
+
+Retries, hedged requests and a circuit breaker for Gemini calls.
+
+``ResiliencePolicy`` runs each ``generate_content`` call:
+
+- Transient provider errors (5xx, 429, timeouts, dropped connections) are
+  retried up to GEMINI_RETRY_ATTEMPTS times with full-jitter exponential
+  backoff. Other errors, including calls shed by the call governor, are
+  raised at once.
+- With GEMINI_HEDGE enabled, a duplicate request is sent when the first one
+  has not answered after the GEMINI_HEDGE_PERCENTILE latency of recent
+  calls; whichever succeeds first is returned.
+- After GEMINI_BREAKER_FAILURES consecutive transient failures the breaker
+  opens and calls fail fast with ``CircuitOpen`` for GEMINI_BREAKER_COOLDOWN
+  seconds; then a single probe call decides whether it closes again.
+
+Streamed replies are retried only if they fail before the first chunk and
+are never hedged.
+
+A ``request_options`` timeout on the call is treated as a deadline for all
+of its attempts: each attempt is sent with the time that is left, and no
+retry is started that could not begin before the deadline.
+"""
+
+import collections
+import concurrent.futures
+import math
+import os
+import random
+import threading
+import time
+
+from dotenv import load_dotenv
+from google.api_core import exceptions as api_exceptions
+
+from gemini.governor import ModelOverloaded, request_timeout, with_request_timeout
+
+load_dotenv()
+
+TRANSIENT_ERRORS = (
+    api_exceptions.ServerError,
+    api_exceptions.TooManyRequests,
+    api_exceptions.ResourceExhausted,
+    api_exceptions.DeadlineExceeded,
+    ConnectionError,
+    TimeoutError,
+)
+
+
+def is_transient(error):
+    """
+    Tell whether a failed call is worth retrying and counts against the provider's health.
+    """
+    return isinstance(error, TRANSIENT_ERRORS)
+
+
+class CircuitOpen(ModelOverloaded):
+    """
+    Raised instead of calling the model while the circuit breaker is open.
+    """
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker with a single half-open probe.
+    """
+
+    def __init__(self, failure_threshold=5, cooldown=30.0):
+        """
+        Args:
+            failure_threshold (int): Consecutive transient failures that open the circuit.
+            cooldown (float): Seconds the circuit stays open before a probe is allowed.
+        """
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+        self.times_opened = 0
+        self.short_circuited = 0
+
+    def _remaining(self):
+        return self._opened_at + self.cooldown - time.monotonic()
+
+    def _reject(self):
+        self.short_circuited += 1
+        return CircuitOpen("Gemini circuit breaker is open", max(1, math.ceil(self._remaining())))
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            return "open" if self._remaining() > 0 or self._probing else "half_open"
+
+    def check(self):
+        """
+        Raise ``CircuitOpen`` if calls are currently being rejected, without claiming the probe.
+        """
+        with self._lock:
+            if self._opened_at is not None and (self._remaining() > 0 or self._probing):
+                raise self._reject()
+
+    def allow(self):
+        """
+        Admit one call; after the cooldown the first caller becomes the probe.
+
+        Returns:
+            bool: True if this call is the half-open probe; pass it back to ``record``.
+
+        Raises:
+            CircuitOpen: While the circuit is open or another probe is running.
+        """
+        with self._lock:
+            if self._opened_at is None:
+                return False
+            if self._remaining() > 0 or self._probing:
+                raise self._reject()
+            self._probing = True
+            return True
+
+    def record(self, success, probing=False):
+        """
+        Report a call outcome: True, False (transient failure), or None (no verdict, e.g. shed locally).
+        """
+        with self._lock:
+            if probing:
+                self._probing = False
+            if success is None:
+                return
+            if success:
+                self._failures = 0
+                self._opened_at = None
+                return
+            self._failures += 1
+            if probing or self._failures >= self.failure_threshold:
+                if self._opened_at is None or probing:
+                    self.times_opened += 1
+                self._opened_at = time.monotonic()
+
+    def stats(self):
+        state = self.state
+        with self._lock:
+            return {
+                "state": state,
+                "consecutive_failures": self._failures,
+                "times_opened": self.times_opened,
+                "short_circuited": self.short_circuited,
+            }
+
+
+class LatencyTracker:
+    """
+    Rolling window of successful call latencies.
+    """
+
+    def __init__(self, window=200, min_samples=20):
+        self.min_samples = min_samples
+        self._samples = collections.deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def add(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, p):
+        """
+        Nearest-rank percentile of the window, or None until ``min_samples`` calls were seen.
+        """
+        with self._lock:
+            if len(self._samples) < self.min_samples:
+                return None
+            ordered = sorted(self._samples)
+        return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+
+class ResiliencePolicy:
+    """
+    Retry, hedging and circuit-breaker settings shared by every wrapped model.
+    """
+
+    def __init__(self, attempts=3, base_delay=0.5, max_delay=8.0, hedge=False, hedge_percentile=95,
+                 hedge_min_delay=1.0, breaker=None, latency=None, hedge_workers=8):
+        """
+        Args:
+            attempts (int): Tries per call, including the first.
+            base_delay (float): Backoff cap before the first retry; doubles for each later one.
+            max_delay (float): Largest backoff cap.
+            hedge (bool): Send a duplicate request when the first one is slow.
+            hedge_percentile (float): Latency percentile of recent calls after which to hedge.
+            hedge_min_delay (float): Never hedge sooner than this many seconds.
+            breaker (CircuitBreaker, optional): Defaults to a 5-failure / 30 s breaker.
+            latency (LatencyTracker, optional): Defaults to a 200-call window.
+            hedge_workers (int): Threads running hedged attempts.
+        """
+        self.attempts = max(1, attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.hedge = hedge
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_delay = hedge_min_delay
+        self.breaker = breaker or CircuitBreaker()
+        self.latency = latency or LatencyTracker()
+        self._executor = (concurrent.futures.ThreadPoolExecutor(max_workers=hedge_workers, thread_name_prefix='hedge')
+                          if hedge else None)
+        self._lock = threading.Lock()
+        self.counts = {"calls": 0, "retries": 0, "hedges": 0, "hedge_wins": 0, "failures": 0}
+
+    def _count(self, name):
+        with self._lock:
+            self.counts[name] += 1
+
+    def backoff(self, retry):
+        """
+        Full-jitter delay before retry number ``retry`` (0-based).
+        """
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** retry)))
+
+    def hedge_delay(self):
+        """
+        Seconds to wait for the first request before hedging, or None when hedging is off or not yet calibrated.
+        """
+        if not self.hedge:
+            return None
+        threshold = self.latency.percentile(self.hedge_percentile)
+        return None if threshold is None else max(self.hedge_min_delay, threshold)
+
+    def _attempt(self, call):
+        """
+        One breaker-guarded call; successful latencies feed the hedge threshold.
+        """
+        probing = self.breaker.allow()
+        started = time.monotonic()
+        try:
+            result = call()
+        except Exception as e:
+            self.breaker.record(False if is_transient(e) else None, probing)
+            raise
+        self.breaker.record(True, probing)
+        self.latency.add(time.monotonic() - started)
+        return result
+
+    def _hedged(self, call):
+        """
+        Run ``call`` and, if it is still pending after the hedge delay, race a duplicate against it.
+        """
+        delay = self.hedge_delay()
+        if delay is None:
+            return self._attempt(call)
+        primary = self._executor.submit(self._attempt, call)
+        done, _ = concurrent.futures.wait([primary], timeout=delay)
+        if done:
+            return primary.result()
+        try:
+            self.breaker.check()
+        except CircuitOpen:
+            return primary.result()
+        self._count("hedges")
+        hedge = self._executor.submit(self._attempt, call)
+        pending = {primary, hedge}
+        error = None
+        while pending:
+            done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is hedge:
+                        self._count("hedge_wins")
+                    return future.result()
+                error = error or future.exception()
+        raise error
+
+    def call(self, call, deadline=None):
+        """
+        Run ``call`` (no arguments) with retries, hedging and the circuit breaker.
+
+        Args:
+            call (callable): The request.
+            deadline (float, optional): ``time.monotonic()`` value after which no retry is started.
+
+        Raises:
+            CircuitOpen: If the breaker is open.
+            Exception: The last error once retries are exhausted or the deadline is near, or any non-transient error.
+        """
+        self._count("calls")
+        for retry in range(self.attempts):
+            try:
+                return self._hedged(call)
+            except Exception as e:
+                delay = self.backoff(retry)
+                if not is_transient(e) or retry == self.attempts - 1 or _too_late(deadline, delay):
+                    if is_transient(e):
+                        self._count("failures")
+                    raise
+            self._count("retries")
+            time.sleep(delay)
+
+    def stream(self, start, deadline=None):
+        """
+        Iterate the stream returned by ``start()``, retrying transient failures before the first chunk.
+        """
+        self._count("calls")
+        for retry in range(self.attempts):
+            probing = self.breaker.allow()
+            yielded = False
+            outcome = None
+            try:
+                for chunk in start():
+                    yielded = True
+                    yield chunk
+                outcome = True
+                return
+            except GeneratorExit:
+                # The consumer stopped reading; the backend was answering.
+                outcome = True
+                raise
+            except Exception as e:
+                transient = is_transient(e)
+                outcome = False if transient else None
+                delay = self.backoff(retry)
+                if not transient or yielded or retry == self.attempts - 1 or _too_late(deadline, delay):
+                    if transient:
+                        self._count("failures")
+                    raise
+            finally:
+                # Always recorded, so a probe cannot be left claimed.
+                self.breaker.record(outcome, probing)
+            self._count("retries")
+            time.sleep(delay)
+
+    def stats(self):
+        """
+        Return call, retry, hedge and failure counts, the breaker state and the current hedge delay.
+        """
+        with self._lock:
+            counts = dict(self.counts)
+        counts["breaker"] = self.breaker.stats()
+        counts["hedge_delay_s"] = self.hedge_delay()
+        return counts
+
+
+def _too_late(deadline, delay):
+    return deadline is not None and time.monotonic() + delay >= deadline
+
+
+class ResilientModel:
+    """
+    Model wrapper whose ``generate_content`` runs under a ``ResiliencePolicy``.
+    """
+
+    def __init__(self, model, policy):
+        self.model = model
+        self.policy = policy
+
+    def generate_content(self, *args, **kwargs):
+        timeout = request_timeout(kwargs)
+        deadline = time.monotonic() + timeout if timeout is not None else None
+
+        def attempt():
+            if deadline is None:
+                return self.model.generate_content(*args, **kwargs)
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise api_exceptions.DeadlineExceeded(f"Model call deadline of {timeout:g}s passed")
+            return self.model.generate_content(*args, **with_request_timeout(kwargs, remaining))
+
+        if kwargs.get('stream'):
+            return self.policy.stream(attempt, deadline)
+        return self.policy.call(attempt, deadline)
+
+    def __getattr__(self, name):
+        return getattr(self.model, name)
+
+
+def create_resilience_policy():
+    """
+    Build the policy described by the GEMINI_RETRY_*, GEMINI_HEDGE* and GEMINI_BREAKER_* environment variables.
+
+    Returns:
+        ResiliencePolicy or None: None when GEMINI_RESILIENCE is disabled.
+    """
+    if os.getenv('GEMINI_RESILIENCE', 'true').lower() not in ('1', 'true', 'yes'):
+        return None
+    return ResiliencePolicy(
+        attempts=int(os.getenv('GEMINI_RETRY_ATTEMPTS', '3')),
+        base_delay=float(os.getenv('GEMINI_RETRY_BASE_DELAY', '0.5')),
+        max_delay=float(os.getenv('GEMINI_RETRY_MAX_DELAY', '8')),
+        hedge=os.getenv('GEMINI_HEDGE', 'false').lower() in ('1', 'true', 'yes'),
+        hedge_percentile=float(os.getenv('GEMINI_HEDGE_PERCENTILE', '95')),
+        hedge_min_delay=float(os.getenv('GEMINI_HEDGE_MIN_DELAY', '1')),
+        breaker=CircuitBreaker(
+            failure_threshold=int(os.getenv('GEMINI_BREAKER_FAILURES', '5')),
+            cooldown=float(os.getenv('GEMINI_BREAKER_COOLDOWN', '30')),
+        ),
+    )
+
+
+resilience_policy = create_resilience_policy()
+
+
+def resilient(model):
+    """
+    Wrap ``model`` in ``resilience_policy``; returns it unchanged when resilience is disabled.
+    """
+    return ResilientModel(model, resilience_policy) if resilience_policy is not None else model
@@ -1,19 +1,371 @@
+"""
+google_calendar_service.py
+
+Google OAuth2 flow and Calendar API access for the weekly check-ups.
+
+The googleapiclient, google-auth and google_auth_oauthlib stacks take a few
+hundred milliseconds to import, so they are imported where they are used,
+and ``calendar_service`` builds the GoogleCalendarService (parsing and
+validating the client config) on first use rather than at import. Workers
+that never serve a calendar route never pay for either. The background
+token refresher needs only the credential store, so it starts at boot
+without building the service.
+"""
+
 import os
 import json
 import datetime
-from typing import Optional, Dict, Any
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Optional, Dict, Any, Iterable, List, NamedTuple, Sequence, Tuple, Union
 from urllib.parse import urlparse, parse_qs
+from zoneinfo import ZoneInfo
 
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import Flow
-from google.auth.transport.requests import Request
-from googleapiclient.discovery import build
-from googleapiclient.errors import HttpError
 from dotenv import load_dotenv
 
+from utils.credential_store import get_credential_store
+from utils.profile_store import get_profile_store
+from utils.token_refresh import TokenRefreshScheduler, expiry_timestamp
+
+if TYPE_CHECKING:
+    from google.oauth2.credentials import Credentials
+
 load_dotenv()
 os.environ['OAUTHLIB_INSECURE_TRANSPORT'] = '1'
 
+CALENDAR_SERVICE_CACHE_TTL = float(os.getenv('CALENDAR_SERVICE_CACHE_TTL', '3600'))
+CALENDAR_SERVICE_CACHE_MAX = int(os.getenv('CALENDAR_SERVICE_CACHE_MAX', '1024'))
+CALENDAR_TOKEN_EXPIRY_SKEW = float(os.getenv('CALENDAR_TOKEN_EXPIRY_SKEW', '60'))
+CALENDAR_SCOPES = [os.getenv('GOOGLE_CALENDAR_SCOPES', 'https://www.googleapis.com/auth/calendar')]
+CALENDAR_TOKEN_REFRESH = os.getenv('CALENDAR_TOKEN_REFRESH', 'true').lower() in ('1', 'true', 'yes')
+# Must exceed CALENDAR_TOKEN_EXPIRY_SKEW so tokens are renewed before cached services are dropped.
+CALENDAR_REFRESH_LEAD_TIME = float(os.getenv('CALENDAR_REFRESH_LEAD_TIME', '300'))
+CALENDAR_REFRESH_WORKERS = int(os.getenv('CALENDAR_REFRESH_WORKERS', '4'))
+CALENDAR_REFRESH_FLUSH_INTERVAL = float(os.getenv('CALENDAR_REFRESH_FLUSH_INTERVAL', '5'))
+CALENDAR_REFRESH_BATCH_SIZE = int(os.getenv('CALENDAR_REFRESH_BATCH_SIZE', '100'))
+CALENDAR_TIMEZONE = os.getenv('CALENDAR_TIMEZONE', 'Europe/Istanbul')
+CALENDAR_CHECKUP_DURATION = int(os.getenv('CALENDAR_CHECKUP_DURATION', '30'))
+# Calendar API calls per batch HTTP request; Google caps batches at 1000 and recommends at most 50.
+CALENDAR_BATCH_SIZE = max(2, min(int(os.getenv('CALENDAR_BATCH_SIZE', '50')), 1000))
+CALENDAR_BATCH_WORKERS = int(os.getenv('CALENDAR_BATCH_WORKERS', '4'))
+
+WEEKDAYS = ['MONDAY', 'TUESDAY', 'WEDNESDAY', 'THURSDAY', 'FRIDAY', 'SATURDAY', 'SUNDAY']
+
+
+def load_discovery_document() -> Optional[Dict[str, Any]]:
+    """
+    Parse the Calendar v3 discovery document bundled with googleapiclient.
+
+    Returns:
+        dict or None: The document, or None if this googleapiclient has no static copy.
+    """
+    from googleapiclient import discovery_cache
+
+    doc = discovery_cache.get_static_doc('calendar', 'v3')
+    return json.loads(doc) if doc else None
+
+
+_thread_http = threading.local()
+
+
+def _thread_local_http():
+    """
+    Return this thread's ``httplib2.Http``, creating it on first use.
+    """
+    from googleapiclient.http import build_http
+
+    http = getattr(_thread_http, 'http', None)
+    if http is None:
+        http = _thread_http.http = build_http()
+    return http
+
+
+def _per_request_http(credentials):
+    """
+    Build a request builder that authorizes every request over its thread's own http.
+
+    httplib2 connections are not thread-safe, so a cached service resource
+    shared between request threads must not reuse one; keeping one Http per
+    thread still lets consecutive calls on a thread reuse its open
+    connections. A request must be executed on the thread that built it.
+    """
+    import google_auth_httplib2
+    from googleapiclient.http import HttpRequest
+
+    def build_request(http, *args, **kwargs):
+        authorized = google_auth_httplib2.AuthorizedHttp(credentials, http=_thread_local_http())
+        return HttpRequest(authorized, *args, **kwargs)
+    return build_request
+
+
+def build_weekly_checkup_event(day_of_week: str, time_of_day: str,
+                                now: Optional[datetime.datetime] = None) -> Dict[str, Any]:
+    """
+    Build the recurring weekly check-up event body for the Calendar API.
+
+    Args:
+        day_of_week: Weekday name, e.g. "MONDAY" (case-insensitive).
+        time_of_day: Start time as "HH:MM" in CALENDAR_TIMEZONE.
+        now: Current time, for tests; defaults to now in CALENDAR_TIMEZONE.
+
+    Returns:
+        dict: Event starting at the next such weekday and time, repeating weekly.
+
+    Raises:
+        ValueError: If the day or time is invalid.
+    """
+    day_name = str(day_of_week).strip().upper()
+    if day_name not in WEEKDAYS:
+        raise ValueError(f"Invalid day_of_week: {day_of_week}")
+    try:
+        hour, minute = (int(part) for part in str(time_of_day).strip().split(':'))
+        start_time = datetime.time(hour, minute)
+    except ValueError:
+        raise ValueError(f"Invalid time_of_day (expected HH:MM): {time_of_day}")
+
+    tz = ZoneInfo(CALENDAR_TIMEZONE)
+    now = now or datetime.datetime.now(tz)
+    day = WEEKDAYS.index(day_name)
+    start = datetime.datetime.combine(now.date(), start_time, tzinfo=tz)
+    start += datetime.timedelta(days=(day - now.weekday()) % 7)
+    if start <= now:
+        start += datetime.timedelta(days=7)
+    end = start + datetime.timedelta(minutes=CALENDAR_CHECKUP_DURATION)
+    return {
+        'summary': 'Weekly check-up',
+        'description': 'Update your measurements and upload a new progress photo.',
+        'start': {'dateTime': start.isoformat(timespec='seconds'), 'timeZone': CALENDAR_TIMEZONE},
+        'end': {'dateTime': end.isoformat(timespec='seconds'), 'timeZone': CALENDAR_TIMEZONE},
+        'recurrence': [f"RRULE:FREQ=WEEKLY;BYDAY={day_name[:2]}"],
+        'reminders': {'useDefault': True},
+    }
+
+
+class CheckupResult(NamedTuple):
+    """
+    Outcome of scheduling one user's check-up.
+
+    ``undeleted_event_ids`` are replaced events whose delete failed; they are
+    still in the user's calendar and should be passed as ``replace_event_id``
+    again, so the next attempt removes them.
+    """
+    event_id: Optional[str]
+    undeleted_event_ids: Tuple[str, ...] = ()
+
+    @property
+    def ok(self) -> bool:
+        return bool(self.event_id) and not self.undeleted_event_ids
+
+
+def _event_ids(value: Union[str, Sequence[str], None]) -> Tuple[str, ...]:
+    if not value:
+        return ()
+    if isinstance(value, str):
+        return (value,)
+    return tuple(dict.fromkeys(event_id for event_id in value if event_id))
+
+
+def _event_gone(exception: Exception) -> bool:
+    """
+    Whether a failed delete means the event was already deleted.
+    """
+    from googleapiclient.errors import HttpError
+
+    return isinstance(exception, HttpError) and exception.resp.status in (404, 410)
+
+
+def load_user_credentials(user_id: str, user_profile_dir: str) -> Optional[Dict[str, Any]]:
+    """
+    Load stored Google OAuth credentials for a given user.
+
+    Credentials still kept in a profile by older versions are moved to
+    the credential store on first load.
+
+    Args:
+        user_id: Identifier of the user.
+        user_profile_dir: Directory where user profiles are stored.
+
+    Returns:
+        dict or None: Credential info if found, otherwise None.
+    """
+    try:
+        creds_dict = get_credential_store(user_profile_dir).get(user_id)
+        if creds_dict is None:
+            creds_dict = _migrate_profile_credentials(user_id, user_profile_dir)
+        return creds_dict
+    except Exception as e:
+        print(f"Error loading credentials: {e}")
+        return None
+
+
+def _migrate_profile_credentials(user_id: str, user_profile_dir: str) -> Optional[Dict[str, Any]]:
+    """
+    Move ``google_auth_creds`` from the user's profile into the credential store.
+
+    Returns:
+        dict or None: The moved credentials, or None if the profile had none.
+    """
+    store = get_profile_store(user_profile_dir)
+    creds_dict = store.load(user_id).get('google_auth_creds')
+    if creds_dict:
+        get_credential_store(user_profile_dir).put(user_id, creds_dict)
+        store.update_fields(user_id, {'google_auth_creds': None})
+    return creds_dict
+
+
+class CalendarTokenRefresher:
+    """
+    Background refresher of the stored users' calendar access tokens.
+
+    It needs only the credential store, not the OAuth client config or a
+    built Calendar client, so it is started at boot even in workers that
+    have not served a calendar route yet. A GoogleCalendarService attaches
+    itself to have the tokens it loads tracked and refreshed tokens replace
+    its cached clients.
+    """
+
+    def __init__(self, user_profile_dir: str, scopes: Sequence[str]):
+        self.scopes = list(scopes)
+        self.service = None
+        self.scheduler = TokenRefreshScheduler(
+            refresh=self._refresh,
+            persist=self._persist,
+            seed=lambda: self._stored_credentials(user_profile_dir),
+            lead_time=CALENDAR_REFRESH_LEAD_TIME,
+            max_workers=CALENDAR_REFRESH_WORKERS,
+            flush_interval=CALENDAR_REFRESH_FLUSH_INTERVAL,
+            batch_size=CALENDAR_REFRESH_BATCH_SIZE,
+            # One refresher per credential store, however many worker processes share it.
+            lock_path=get_credential_store(user_profile_dir).path + '.refresher.lock',
+        )
+
+    def start(self) -> 'CalendarTokenRefresher':
+        self.scheduler.start()
+        return self
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        self.scheduler.stop(timeout)
+
+    def attach(self, service: 'GoogleCalendarService') -> None:
+        """
+        Keep ``service``'s client cache in step with the refreshed tokens.
+        """
+        self.service = service
+
+    def track(self, key, creds_dict: Dict[str, Any], creds: 'Credentials', replace: bool = True) -> None:
+        """
+        Schedule refreshable credentials, ``key`` being (profile dir, user id).
+        """
+        if creds.refresh_token:
+            self.scheduler.track(key, creds_dict, expiry_timestamp(creds.expiry), replace=replace)
+
+    def stats(self) -> Dict[str, Any]:
+        return self.scheduler.stats()
+
+    def _refresh(self, key, creds_dict: Dict[str, Any]):
+        """
+        Refresh one user's access token for the scheduler.
+
+        The credential store is read first: if another process (a previous
+        refresher, or an inline refresh in a request) already stored a token
+        that is not yet due, it is adopted instead of refreshing again. The
+        refreshed credentials and a client built from them replace the
+        attached service's cached entry straight away; writing them to the
+        store is left to the scheduler's batched flush.
+
+        Returns:
+            tuple or None: (new credential dict, expiry timestamp[, False when adopted
+            from the store]), or None if the grant was revoked, the user's credentials
+            were removed or there is no refresh token.
+
+        Raises:
+            RefreshError: If the token endpoint failed in a way worth retrying.
+        """
+        from google.auth.exceptions import RefreshError
+        from google.auth.transport.requests import Request
+        from google.oauth2.credentials import Credentials
+
+        user_profile_dir, user_id = key
+        stored = load_user_credentials(user_id, user_profile_dir)
+        if not stored:
+            return None
+        creds = Credentials.from_authorized_user_info(creds_dict, self.scopes)
+        stored_creds = Credentials.from_authorized_user_info(stored, self.scopes)
+        stored_expiry = expiry_timestamp(stored_creds.expiry)
+        tracked_expiry = expiry_timestamp(creds.expiry)
+        if stored_expiry is not None and stored_expiry - CALENDAR_REFRESH_LEAD_TIME > time.time() and (
+                tracked_expiry is None or stored_expiry > tracked_expiry):
+            return stored, stored_expiry, False
+        creds = stored_creds
+        if not creds.refresh_token:
+            return None
+        service = self.service
+        try:
+            creds.refresh(Request())
+        except RefreshError as e:
+            if getattr(e, 'retryable', False):
+                raise
+            print(f"Dropping calendar token refresh for {user_id}: {e}")
+            if service is not None:
+                service.invalidate_user(user_id, user_profile_dir)
+            return None
+
+        if service is not None:
+            service._cache_service(key, creds, service._build_service(creds))
+        return json.loads(creds.to_json()), expiry_timestamp(creds.expiry)
+
+    def _persist(self, batch) -> None:
+        """
+        Write a batch of refreshed credentials, ``[((profile dir, user id), creds dict), ...]``, to the credential store.
+        """
+        by_dir = {}
+        for (user_profile_dir, user_id), creds_dict in batch:
+            by_dir.setdefault(user_profile_dir, []).append((user_id, creds_dict))
+        for user_profile_dir, items in by_dir.items():
+            get_credential_store(user_profile_dir).put_many(items)
+
+    def _stored_credentials(self, user_profile_dir: str):
+        """
+        Yield ``(key, creds dict, expiry timestamp)`` for every stored user with a refresh token.
+        """
+        from google.oauth2.credentials import Credentials
+
+        store = get_credential_store(user_profile_dir)
+        for user_id in store.user_ids():
+            creds_dict = load_user_credentials(user_id, user_profile_dir)
+            if not creds_dict or not creds_dict.get('refresh_token'):
+                continue
+            creds = Credentials.from_authorized_user_info(creds_dict, self.scopes)
+            yield (user_profile_dir, user_id), creds_dict, expiry_timestamp(creds.expiry)
+
+
+_token_refresher = None
+_token_refresher_lock = threading.Lock()
+
+
+def start_calendar_token_refresher(user_profile_dir: str) -> Optional[CalendarTokenRefresher]:
+    """
+    Start the process-wide token refresher for the users stored under ``user_profile_dir``, once.
+
+    Users are loaded on the refresher's own thread; users authorized or
+    loaded later are added as they appear. Of the processes sharing a
+    credential store only the one holding its refresher lock refreshes;
+    the others stand by to take over.
+
+    Returns:
+        CalendarTokenRefresher or None: The running refresher, or None if CALENDAR_TOKEN_REFRESH is off.
+    """
+    global _token_refresher
+    if not CALENDAR_TOKEN_REFRESH:
+        return None
+    with _token_refresher_lock:
+        if _token_refresher is None:
+            _token_refresher = CalendarTokenRefresher(user_profile_dir, CALENDAR_SCOPES).start()
+        return _token_refresher
+
+
 class GoogleCalendarService:
     """
     Handles OAuth2 flow and API interactions for Google Calendar.
@@ -24,7 +376,7 @@ class GoogleCalendarService:
         Initialize service by loading environment variables and validating client config.
         """
         self.CLIENT_CONFIG_JSON_STR = os.getenv('GOOGLE_CLIENT_CONFIG_JSON')
-        self.SCOPES = [os.getenv('GOOGLE_CALENDAR_SCOPES', 'https://www.googleapis.com/auth/calendar')]
+        self.SCOPES = CALENDAR_SCOPES
         self.REDIRECT_URI = os.getenv('GOOGLE_REDIRECT_URI')
 
         print("\n=== Google Calendar Service Initialization ===")
@@ -48,6 +400,14 @@ class GoogleCalendarService:
             print(f"\n❌ Client config validation failed: {e}")
             raise
 
+        self._discovery_doc = load_discovery_document()
+        # (profile dir, user id) -> (credentials, service resource, monotonic expiry), least recently used first
+        self._services = OrderedDict()
+        self._services_lock = threading.Lock()
+        self.service_cache_hits = 0
+        self.service_cache_misses = 0
+        self._refresher = None
+
     def _parse_client_config(self) -> Dict[str, Any]:
         """
         Parse and validate the OAuth client configuration, accepting either a JSON string or a file path.
@@ -84,28 +444,6 @@ class GoogleCalendarService:
 
         return config
 
-    def _load_user_credentials(self, user_id: str, user_profile_dir: str) -> Optional[Dict[str, Any]]:
-        """
-        Load stored Google OAuth credentials for a given user.
-
-        Args:
-            user_id: Identifier of the user.
-            user_profile_dir: Directory where user profiles are stored.
-
-        Returns:
-            dict or None: Credential info if found, otherwise None.
-        """
-        try:
-            path = os.path.join(user_profile_dir, f"{user_id}.json")
-            if not os.path.exists(path):
-                return None
-            with open(path) as f:
-                profile = json.load(f)
-            return profile.get('google_auth_creds')
-        except Exception as e:
-            print(f"Error loading credentials: {e}")
-            return None
-
     def _save_user_credentials(
         self,
         user_id: str,
@@ -123,24 +461,76 @@ class GoogleCalendarService:
         Returns:
             bool: True if saved successfully, False otherwise.
         """
+        self.invalidate_user(user_id, user_profile_dir)
         try:
-            path = os.path.join(user_profile_dir, f"{user_id}.json")
-            profile = {}
-            if os.path.exists(path):
-                with open(path) as f:
-                    profile = json.load(f)
-            profile['google_auth_creds'] = creds_dict
-            with open(path, 'w') as f:
-                json.dump(profile, f, indent=4)
+            get_credential_store(user_profile_dir).put(user_id, creds_dict)
             return True
         except Exception as e:
             print(f"Error saving credentials: {e}")
             return False
 
+    def _build_service(self, creds: 'Credentials'):
+        """
+        Build a Calendar resource from the preloaded discovery document.
+        """
+        from googleapiclient.discovery import build, build_from_document
+
+        if self._discovery_doc is None:
+            return build('calendar', 'v3', credentials=creds)
+        return build_from_document(self._discovery_doc, credentials=creds,
+                                   requestBuilder=_per_request_http(creds))
+
+    def _cache_ttl(self, creds: 'Credentials') -> float:
+        """
+        Seconds a built service stays cached: until shortly before the token expires, at most CALENDAR_SERVICE_CACHE_TTL.
+        """
+        if creds.expiry is None:
+            return CALENDAR_SERVICE_CACHE_TTL
+        remaining = (creds.expiry - datetime.datetime.utcnow()).total_seconds() - CALENDAR_TOKEN_EXPIRY_SKEW
+        return max(0.0, min(CALENDAR_SERVICE_CACHE_TTL, remaining))
+
+    def _cache_service(self, key, creds: 'Credentials', service) -> None:
+        """
+        Store a built service under ``key`` for its TTL, evicting the least recently used entries.
+        """
+        ttl = self._cache_ttl(creds)
+        if ttl <= 0:
+            return
+        with self._services_lock:
+            self._services[key] = (creds, service, time.monotonic() + ttl)
+            self._services.move_to_end(key)
+            while len(self._services) > CALENDAR_SERVICE_CACHE_MAX:
+                self._services.popitem(last=False)
+
+    def invalidate_user(self, user_id: str, user_profile_dir: str) -> None:
+        """
+        Drop the cached credentials and service of a user, e.g. after their tokens changed.
+        """
+        with self._services_lock:
+            self._services.pop((user_profile_dir, user_id), None)
+
+    def service_cache_stats(self) -> Dict[str, Any]:
+        """
+        Return the size and hit/miss counts of the per-user service cache.
+        """
+        with self._services_lock:
+            total = self.service_cache_hits + self.service_cache_misses
+            return {
+                "entries": len(self._services),
+                "hits": self.service_cache_hits,
+                "misses": self.service_cache_misses,
+                "hit_rate": round(self.service_cache_hits / total, 4) if total else 0.0,
+                "static_discovery": self._discovery_doc is not None,
+            }
+
     def get_calendar_service(self, user_id: str, user_profile_dir: str):
         """
         Retrieve an authorized Google Calendar API client for the user.
 
+        The credentials and built resource are cached per user until shortly
+        before the access token expires, so repeat calls neither reload the
+        profile nor rebuild the client.
+
         Args:
             user_id: Identifier of the user.
             user_profile_dir: Directory where user profiles are stored.
@@ -148,18 +538,215 @@ class GoogleCalendarService:
         Returns:
             Resource or None: Google Calendar service resource, or None if authorization is missing/invalid.
         """
-        creds_dict = self._load_user_credentials(user_id, user_profile_dir)
+        key = (user_profile_dir, user_id)
+        with self._services_lock:
+            entry = self._services.get(key)
+            if entry is not None and entry[2] > time.monotonic():
+                self._services.move_to_end(key)
+                self.service_cache_hits += 1
+                return entry[1]
+            self._services.pop(key, None)
+            self.service_cache_misses += 1
+
+        creds_dict = load_user_credentials(user_id, user_profile_dir)
         if not creds_dict:
             return None
 
+        from google.auth.transport.requests import Request
+        from google.oauth2.credentials import Credentials
+
         creds = Credentials.from_authorized_user_info(creds_dict, self.SCOPES)
         if creds.expired and creds.refresh_token:
+            # Only reached when the background refresher is off or fell behind.
             creds.refresh(Request())
-            self._save_user_credentials(user_id, user_profile_dir, json.loads(creds.to_json()))
+            creds_dict = json.loads(creds.to_json())
+            self._save_user_credentials(user_id, user_profile_dir, creds_dict)
         if not creds.valid:
             return None
 
-        return build('calendar', 'v3', credentials=creds)
+        service = self._build_service(creds)
+        self._cache_service(key, creds, service)
+        self._track(key, creds_dict, creds, replace=False)
+        return service
+
+    def _track(self, key, creds_dict: Dict[str, Any], creds: 'Credentials', replace: bool = True) -> None:
+        """
+        Hand refreshable credentials to the background refresher, if it is running.
+        """
+        if self._refresher is not None:
+            self._refresher.track(key, creds_dict, creds, replace=replace)
+
+    def start_token_refresher(self, user_profile_dir: str) -> Optional[CalendarTokenRefresher]:
+        """
+        Start the background token refresher (see ``start_calendar_token_refresher``) and attach this service to it.
+
+        Returns:
+            CalendarTokenRefresher or None: The running refresher, or None if CALENDAR_TOKEN_REFRESH is off.
+        """
+        refresher = start_calendar_token_refresher(user_profile_dir)
+        if refresher is not None:
+            refresher.attach(self)
+            self._refresher = refresher
+        return refresher
+
+    def token_refresh_stats(self) -> Optional[Dict[str, Any]]:
+        """
+        Return the background refresher's counters, or None if it is not running.
+        """
+        return self._refresher.stats() if self._refresher is not None else None
+
+    def delete_event(self, user_id: str, user_profile_dir: str, event_id: str) -> bool:
+        """
+        Delete an event from the user's primary calendar.
+
+        Returns:
+            bool: True if the event is gone (including when it was already deleted), False otherwise.
+        """
+        service = self.get_calendar_service(user_id, user_profile_dir)
+        if service is None:
+            return False
+        try:
+            service.events().delete(calendarId='primary', eventId=event_id).execute()
+            return True
+        except Exception as e:
+            if _event_gone(e):
+                return True
+            print(f"Error deleting event {event_id} for {user_id}: {e}")
+            return False
+
+    def create_weekly_checkup(
+        self,
+        user_id: str,
+        user_profile_dir: str,
+        day_of_week: str,
+        time_of_day: str,
+        replace_event_id: Union[str, Sequence[str], None] = None
+    ) -> CheckupResult:
+        """
+        Create the user's recurring weekly check-up event.
+
+        With ``replace_event_id`` the old event (or events) is deleted in the
+        same batch HTTP request, so rescheduling takes one round trip.
+
+        Args:
+            user_id: Identifier of the user.
+            user_profile_dir: Directory where user profiles are stored.
+            day_of_week: Weekday name, e.g. "MONDAY".
+            time_of_day: Start time as "HH:MM" in CALENDAR_TIMEZONE.
+            replace_event_id: Existing check-up event ID, or IDs, to delete.
+
+        Returns:
+            CheckupResult: ID of the created event (None if authorization is missing or the
+            insert failed) and the old events that could not be deleted.
+
+        Raises:
+            ValueError: If the day or time is invalid.
+        """
+        event = build_weekly_checkup_event(day_of_week, time_of_day)
+        service = self.get_calendar_service(user_id, user_profile_dir)
+        if service is None:
+            return CheckupResult(None, _event_ids(replace_event_id))
+        return self._run_checkup_batch([(user_id, service, event, _event_ids(replace_event_id))])[user_id]
+
+    def reschedule_checkups(
+        self,
+        user_profile_dir: str,
+        checkups: Iterable[Tuple[str, str, str, Union[str, Sequence[str], None]]],
+        max_workers: int = CALENDAR_BATCH_WORKERS,
+        batch_size: int = CALENDAR_BATCH_SIZE
+    ) -> Dict[str, CheckupResult]:
+        """
+        Replace the weekly check-up events of many users.
+
+        The delete and insert calls of all users are packed into batch HTTP
+        requests of up to ``batch_size`` calls (a user's pair always shares a
+        batch), and up to ``max_workers`` batches are sent at once.
+
+        Args:
+            user_profile_dir: Directory where user profiles are stored.
+            checkups: ``(user_id, day_of_week, time_of_day, old event ID(s) or None)`` per user.
+            max_workers: Batch requests in flight at once.
+            batch_size: Calendar API calls per batch request.
+
+        Returns:
+            dict: ``CheckupResult`` per user; its event_id is None for users whose check-up
+            could not be scheduled (missing authorization, invalid day/time or a failed call).
+        """
+        results = {}
+        batches, current, calls = [], [], 0
+        for user_id, day_of_week, time_of_day, old_event_ids in checkups:
+            old_event_ids = _event_ids(old_event_ids)
+            try:
+                event = build_weekly_checkup_event(day_of_week, time_of_day)
+                service = self.get_calendar_service(user_id, user_profile_dir)
+            except Exception as e:
+                print(f"Cannot reschedule check-up for {user_id}: {e}")
+                service = None
+            if service is None:
+                results[user_id] = CheckupResult(None, old_event_ids)
+                continue
+            needed = 1 + len(old_event_ids)
+            if current and calls + needed > batch_size:
+                batches.append(current)
+                current, calls = [], 0
+            current.append((user_id, service, event, old_event_ids))
+            calls += needed
+        if current:
+            batches.append(current)
+
+        if len(batches) == 1 or max_workers <= 1:
+            for batch in batches:
+                results.update(self._run_checkup_batch(batch))
+        else:
+            with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='calendar-batch') as executor:
+                for batch_results in executor.map(self._run_checkup_batch, batches):
+                    results.update(batch_results)
+        return results
+
+    def _run_checkup_batch(
+        self, checkups: List[Tuple[str, Any, Dict[str, Any], Tuple[str, ...]]]
+    ) -> Dict[str, CheckupResult]:
+        """
+        Send the delete/insert calls for ``(user_id, service, event, old event ids)`` entries as one batch request.
+
+        Each call carries its own user's authorization. An old event that is
+        already gone (404/410) counts as deleted; any other failed delete is
+        reported in the user's ``undeleted_event_ids`` so it can be retried.
+        """
+        responses = {}
+
+        def collect(request_id, response, exception):
+            responses[request_id] = (response, exception)
+
+        batch = checkups[0][1].new_batch_http_request(callback=collect)
+        for index, (user_id, service, event, old_event_ids) in enumerate(checkups):
+            events = service.events()
+            for number, old_event_id in enumerate(old_event_ids):
+                batch.add(events.delete(calendarId='primary', eventId=old_event_id),
+                          request_id=f"{index}-delete-{number}")
+            batch.add(events.insert(calendarId='primary', body=event), request_id=f"{index}-insert")
+        try:
+            batch.execute()
+        except Exception as e:
+            print(f"Calendar batch request for {len(checkups)} users failed: {e}")
+            return {user_id: CheckupResult(None, old_event_ids) for user_id, _, _, old_event_ids in checkups}
+
+        results = {}
+        for index, (user_id, _, _, old_event_ids) in enumerate(checkups):
+            undeleted = []
+            for number, old_event_id in enumerate(old_event_ids):
+                # A missing response means the call never ran, so the event may still exist.
+                _, exception = responses.get(f"{index}-delete-{number}", (None, RuntimeError("no response")))
+                if exception is not None and not _event_gone(exception):
+                    print(f"Error deleting event {old_event_id} for {user_id}: {exception}")
+                    undeleted.append(old_event_id)
+            response, exception = responses.get(f"{index}-insert", (None, None))
+            if exception is not None or not response:
+                print(f"Error creating check-up event for {user_id}: {exception}")
+                results[user_id] = CheckupResult(None, tuple(undeleted))
+            else:
+                results[user_id] = CheckupResult(response.get('id'), tuple(undeleted))
+        return results
 
     def start_auth_flow(self, session: Dict[str, Any]) -> Optional[str]:
         """
@@ -171,6 +758,8 @@ class GoogleCalendarService:
         Returns:
             str or None: URL to redirect the user to for Google consent.
         """
+        from google_auth_oauthlib.flow import Flow
+
         client_config = self._parse_client_config()
         flow = Flow.from_client_config(
             client_config,
@@ -209,6 +798,8 @@ class GoogleCalendarService:
             print(f"State mismatch: expected {session_state}, got {qs.get('state')}")
             return False
 
+        from google_auth_oauthlib.flow import Flow
+
         client_config = self._parse_client_config()
         flow = Flow.from_client_config(
             client_config,
@@ -218,6 +809,67 @@ class GoogleCalendarService:
         )
         flow.fetch_token(authorization_response=request_url)
         creds = flow.credentials
-        return self._save_user_credentials(user_id, user_profile_dir, json.loads(creds.to_json()))
+        creds_dict = json.loads(creds.to_json())
+        saved = self._save_user_credentials(user_id, user_profile_dir, creds_dict)
+        if saved:
+            self._track((user_profile_dir, user_id), creds_dict, creds)
+        return saved
+
+class LazyCalendarService:
+    """
+    Stand-in for a GoogleCalendarService that is only built when first used.
+
+    Attribute access is delegated to the service, building it on the first
+    call; a configuration error is raised then instead of at import.
+    """
+
+    def __init__(self, factory=GoogleCalendarService, refresher_factory=start_calendar_token_refresher):
+        self._factory = factory
+        self._refresher_factory = refresher_factory
+        self._instance = None
+        self._lock = threading.Lock()
+        self._refresher_dirs = []
+        self._refresher = None
+
+    @property
+    def initialized(self) -> bool:
+        return self._instance is not None
+
+    def _get(self) -> GoogleCalendarService:
+        if self._instance is None:
+            with self._lock:
+                if self._instance is None:
+                    instance = self._factory()
+                    for user_profile_dir in self._refresher_dirs:
+                        instance.start_token_refresher(user_profile_dir)
+                    self._instance = instance
+        return self._instance
+
+    def start_token_refresher(self, user_profile_dir: str) -> Optional[CalendarTokenRefresher]:
+        """
+        Start the background token refresher now, without building the service.
+
+        The refresher only needs the credential store, so tokens are kept
+        fresh from boot and no request waits on a refresh; the service
+        attaches to it when it is built.
+        """
+        with self._lock:
+            if self._instance is None:
+                self._refresher_dirs.append(user_profile_dir)
+                self._refresher = self._refresher_factory(user_profile_dir)
+                return self._refresher
+        return self._instance.start_token_refresher(user_profile_dir)
+
+    def service_cache_stats(self) -> Optional[Dict[str, Any]]:
+        return self._instance.service_cache_stats() if self._instance is not None else None
+
+    def token_refresh_stats(self) -> Optional[Dict[str, Any]]:
+        if self._instance is not None:
+            return self._instance.token_refresh_stats()
+        return self._refresher.stats() if self._refresher is not None else None
+
+    def __getattr__(self, name):
+        return getattr(self._get(), name)
+
 
-calendar_service = GoogleCalendarService()
+calendar_service = LazyCalendarService()
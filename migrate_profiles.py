@@ -0,0 +1,160 @@
+"""
+Import the per-user JSON profiles under USER_DATA_FOLDER into the sqlite profile store.
+
+Usage:
+    python migrate_profiles.py [--source user_data] [--db user_data/profiles.sqlite3] [--overwrite]
+                               [--progress [--progress-folder progress_data]] [--credentials] [--no-profiles]
+
+Afterwards set PROFILE_STORE_BACKEND=sqlite (and PROFILE_DB_PATH if a custom
+--db was used) so the app reads from the database. ``--progress`` also seeds
+the append-only progress store served by GET /progress/<user_id> from each
+profile's progress_history, skipping users whose log already has records.
+``--credentials`` moves Google OAuth credentials out of the profiles of the
+active profile store into the encrypted credential store, so the background
+token refresher knows every user without waiting for them to be loaded once.
+"""
+
+import argparse
+import json
+import os
+import sys
+
+from dotenv import load_dotenv
+
+from utils.credential_store import get_credential_store
+from utils.profile_store import JsonFileProfileStore, SqliteProfileStore, create_profile_store, get_profile_store
+from utils.progress_store import ProgressStore, records_from_history
+
+load_dotenv()
+
+
+def migrate(source_folder, db_path, overwrite=False):
+    """
+    Copy every JSON profile in ``source_folder`` into the sqlite store at ``db_path``.
+
+    Args:
+        source_folder (str): Folder containing <user_id>.json files.
+        db_path (str): Target sqlite database path.
+        overwrite (bool): Replace profiles that already exist in the database.
+
+    Returns:
+        dict: Counts of 'imported', 'skipped' and 'failed' profiles.
+    """
+    source = JsonFileProfileStore(source_folder)
+    target = SqliteProfileStore(db_path)
+    existing = set(target.list_user_ids())
+    counts = {"imported": 0, "skipped": 0, "failed": 0}
+
+    for user_id in source.list_user_ids():
+        if user_id in existing and not overwrite:
+            counts["skipped"] += 1
+            continue
+        try:
+            target.save(user_id, source.load(user_id))
+            counts["imported"] += 1
+        except (ValueError, OSError, json.JSONDecodeError) as e:
+            print(f"Failed to import {user_id}: {e}", file=sys.stderr)
+            counts["failed"] += 1
+    return counts
+
+
+def import_progress(source_folder, progress_folder, backend=None):
+    """
+    Seed each user's progress log from the progress_history in their profile.
+
+    Users whose log already has records are left alone: the app appends
+    every new entry to the log and keeps only the newest ones inline, so an
+    existing log holds more history than the profile.
+
+    Args:
+        source_folder (str): User data folder.
+        progress_folder (str): Target progress store folder.
+        backend (str, optional): Profile store to read, 'json' or 'sqlite'; defaults to PROFILE_STORE_BACKEND.
+
+    Returns:
+        dict: Counts of seeded 'users', their 'entries', unparseable 'skipped' entries
+            and users with an 'existing' log.
+    """
+    source = create_profile_store(source_folder, backend)
+    target = ProgressStore(progress_folder)
+    counts = {"users": 0, "entries": 0, "skipped": 0, "existing": 0}
+
+    for user_id in source.list_user_ids():
+        try:
+            history = source.load(user_id).get('progress_history') or []
+        except (ValueError, OSError) as e:
+            print(f"Failed to read {user_id}: {e}", file=sys.stderr)
+            continue
+        records = records_from_history(history)
+        if not records:
+            continue
+        if not target.seed(user_id, records):
+            counts["existing"] += 1
+            continue
+        counts["users"] += 1
+        counts["entries"] += len(records)
+        counts["skipped"] += len(history) - len(records)
+    return counts
+
+
+def move_credentials(user_data_folder):
+    """
+    Move ``google_auth_creds`` from every profile into the credential store and clear it in the profile.
+
+    Args:
+        user_data_folder (str): USER_DATA_FOLDER of the app; profiles are read through the active backend.
+
+    Returns:
+        dict: Counts of 'moved' and 'failed' users.
+    """
+    profiles = get_profile_store(user_data_folder)
+    credentials = get_credential_store(user_data_folder)
+    counts = {"moved": 0, "failed": 0}
+
+    for user_id in profiles.list_user_ids():
+        try:
+            creds = profiles.load(user_id).get('google_auth_creds')
+            if not creds:
+                continue
+            credentials.put(user_id, creds)
+            profiles.update_fields(user_id, {'google_auth_creds': None})
+            counts["moved"] += 1
+        except (ValueError, OSError) as e:
+            print(f"Failed to move credentials of {user_id}: {e}", file=sys.stderr)
+            counts["failed"] += 1
+    return counts
+
+
+def main():
+    user_data_folder = os.getenv('USER_DATA_FOLDER', 'user_data')
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--source', default=user_data_folder, help="folder with <user_id>.json profiles")
+    parser.add_argument('--db', default=os.getenv('PROFILE_DB_PATH') or os.path.join(user_data_folder, 'profiles.sqlite3'),
+                        help="target sqlite database")
+    parser.add_argument('--overwrite', action='store_true', help="replace profiles already in the database")
+    parser.add_argument('--no-profiles', action='store_true', help="skip the sqlite profile import")
+    parser.add_argument('--progress', action='store_true', help="also import progress_history into the progress store")
+    parser.add_argument('--progress-folder', default=os.getenv('PROGRESS_DATA_FOLDER', 'progress_data'),
+                        help="target progress store folder")
+    parser.add_argument('--credentials', action='store_true',
+                        help="move Google OAuth credentials into the encrypted credential store")
+    args = parser.parse_args()
+
+    failed = 0
+    if not args.no_profiles:
+        counts = migrate(args.source, args.db, overwrite=args.overwrite)
+        print(f"Imported {counts['imported']}, skipped {counts['skipped']}, failed {counts['failed']} -> {args.db}")
+        failed = counts["failed"]
+    if args.progress:
+        counts = import_progress(args.source, args.progress_folder)
+        print(f"Imported {counts['entries']} progress entries for {counts['users']} users, "
+              f"skipped {counts['skipped']}, left {counts['existing']} existing logs -> {args.progress_folder}")
+    if args.credentials:
+        counts = move_credentials(user_data_folder)
+        print(f"Moved credentials of {counts['moved']} users, failed {counts['failed']}")
+        failed += counts["failed"]
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,120 @@
+"""
+Recreate the weekly check-up calendar events of every user who scheduled one.
+
+Usage:
+    python reschedule_checkups.py [--folder user_data] [--users u1,u2] [--day MONDAY] [--time 10:00]
+                                  [--workers 4] [--batch-size 50] [--dry-run]
+
+Run after changing how check-up events look (CALENDAR_TIMEZONE,
+CALENDAR_CHECKUP_DURATION or the event text), or with ``--day``/``--time``
+to move everyone's check-up. Each user's old event is deleted and a new one
+created from their stored checkup_preference; the calls of many users are
+sent as Calendar API batch requests, ``--workers`` of them at once. Users
+whose calendar is no longer authorized are reported and left unchanged.
+An old event whose delete fails is kept in the profile's stale_event_ids
+and deleted again on the next run (or the next /schedule-checkup call).
+"""
+
+import argparse
+import os
+import sys
+import time
+
+from dotenv import load_dotenv
+
+from google_calendar_service import CALENDAR_BATCH_SIZE, CALENDAR_BATCH_WORKERS, calendar_service
+from utils.profile_store import get_profile_store
+
+load_dotenv()
+
+
+def collect_checkups(folder, user_ids=None, day_of_week=None, time_of_day=None):
+    """
+    Read the check-ups to recreate from the stored profiles.
+
+    Args:
+        folder (str): User data folder.
+        user_ids (list, optional): Only these users; default every user with a check-up.
+        day_of_week (str, optional): Day to use instead of each user's stored one.
+        time_of_day (str, optional): Time to use instead of each user's stored one.
+
+    Returns:
+        list of tuple: ``(user_id, day_of_week, time_of_day, old event ids)`` per user.
+    """
+    store = get_profile_store(folder)
+    checkups = []
+    for user_id in user_ids or store.list_user_ids():
+        preference = store.load(user_id).get('checkup_preference') or {}
+        if not preference.get('day_of_week') and not day_of_week:
+            continue
+        checkups.append((
+            user_id,
+            day_of_week or preference.get('day_of_week'),
+            time_of_day or preference.get('time_of_day'),
+            [event_id for event_id in [preference.get('google_calendar_event_id'),
+                                       *preference.get('stale_event_ids', [])] if event_id],
+        ))
+    return checkups
+
+
+def reschedule(folder, checkups, workers=CALENDAR_BATCH_WORKERS, batch_size=CALENDAR_BATCH_SIZE):
+    """
+    Recreate the given check-ups and store the new event IDs in the profiles.
+
+    Returns:
+        dict: Counts of 'rescheduled' and 'failed' users, and of users left with 'stale'
+            old events whose delete failed.
+    """
+    store = get_profile_store(folder)
+    results = calendar_service.reschedule_checkups(folder, checkups, max_workers=workers, batch_size=batch_size)
+    counts = {"rescheduled": 0, "failed": 0, "stale": 0}
+    for user_id, day_of_week, time_of_day, _ in checkups:
+        result = results.get(user_id)
+        if result is None or not result.event_id:
+            print(f"Could not reschedule check-up for {user_id}", file=sys.stderr)
+            counts["failed"] += 1
+            continue
+        preference = {
+            "day_of_week": day_of_week,
+            "time_of_day": time_of_day,
+            "google_calendar_event_id": result.event_id,
+        }
+        if result.undeleted_event_ids:
+            print(f"Old check-up events of {user_id} not deleted: {', '.join(result.undeleted_event_ids)}",
+                  file=sys.stderr)
+            preference["stale_event_ids"] = list(result.undeleted_event_ids)
+            counts["stale"] += 1
+        store.update_fields(user_id, {'checkup_preference': preference})
+        counts["rescheduled"] += 1
+    return counts
+
+
+def main():
+    user_data_folder = os.getenv('USER_DATA_FOLDER', 'user_data')
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--folder', default=user_data_folder, help="user data folder")
+    parser.add_argument('--users', help="comma-separated user ids (default: everyone with a check-up)")
+    parser.add_argument('--day', help="new day_of_week for all selected users")
+    parser.add_argument('--time', help="new time_of_day (HH:MM) for all selected users")
+    parser.add_argument('--workers', type=int, default=CALENDAR_BATCH_WORKERS, help="batch requests in flight")
+    parser.add_argument('--batch-size', type=int, default=CALENDAR_BATCH_SIZE, help="Calendar API calls per batch")
+    parser.add_argument('--dry-run', action='store_true', help="list the check-ups without changing anything")
+    args = parser.parse_args()
+
+    user_ids = [u.strip() for u in args.users.split(',') if u.strip()] if args.users else None
+    checkups = collect_checkups(args.folder, user_ids, args.day, args.time)
+    if args.dry_run:
+        for user_id, day_of_week, time_of_day, old_event_ids in checkups:
+            print(f"{user_id}: {day_of_week} {time_of_day} (replaces {', '.join(old_event_ids) or 'nothing'})")
+        print(f"Would reschedule {len(checkups)} check-ups")
+        return 0
+
+    started = time.perf_counter()
+    counts = reschedule(args.folder, checkups, workers=args.workers, batch_size=max(args.batch_size, 2))
+    print(f"Rescheduled {counts['rescheduled']} ({counts['stale']} with old events left), "
+          f"failed {counts['failed']} in {time.perf_counter() - started:.2f}s")
+    return 1 if counts['failed'] or counts['stale'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,322 @@
+"""
+Tests for the batched check-up scheduling in google_calendar_service.py against a local Calendar stand-in.
+
+The stand-in server answers Calendar API batch requests (multipart/mixed
+bodies of embedded HTTP requests) as well as plain event deletes, and
+records every call with the Authorization header it carried.
+
+Run with: python -m pytest test_calendar_batch.py
+"""
+
+import datetime
+import email.parser
+import importlib
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+
+class CalendarStandIn:
+    """
+    Local HTTP server emulating event insert/delete, alone or inside batch requests.
+    """
+
+    def __init__(self, delay=0.0, missing_events=(), failing_events=()):
+        self.delay = delay
+        self.missing_events = set(missing_events)
+        self.failing_events = set(failing_events)
+        self.calls = []
+        self.batches = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._next_id = 0
+        self._lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                if self.path.startswith('/batch/'):
+                    server._enter()
+                    try:
+                        self._reply(200, server.handle_batch(self.headers['Content-Type'], body),
+                                    'multipart/mixed; boundary=batch_resp')
+                    finally:
+                        server._leave()
+                else:
+                    status, payload = server.handle_call('POST', self.path, self.headers.get('Authorization'), body)
+                    self._reply(status, payload, 'application/json')
+
+            def do_DELETE(self):
+                status, payload = server.handle_call('DELETE', self.path, self.headers.get('Authorization'), b'')
+                self._reply(status, payload, 'application/json')
+
+            def _reply(self, status, payload, content_type):
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.root_url = f"http://127.0.0.1:{self.httpd.server_address[1]}/"
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def _enter(self):
+        with self._lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        time.sleep(self.delay)
+
+    def _leave(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def handle_call(self, method, path, authorization, body):
+        path = path.split('?')[0]
+        with self._lock:
+            self.calls.append((method, path, authorization))
+            if method == 'DELETE':
+                event_id = path.rsplit('/', 1)[-1]
+                if event_id in self.missing_events:
+                    return 404, json.dumps({"error": {"code": 404, "message": "Not Found"}}).encode()
+                if event_id in self.failing_events:
+                    return 500, json.dumps({"error": {"code": 500, "message": "Backend Error"}}).encode()
+                return 204, b''
+            self._next_id += 1
+            event = dict(json.loads(body), id=f"evt{self._next_id}")
+            return 200, json.dumps(event).encode()
+
+    def handle_batch(self, content_type, body):
+        message = email.parser.BytesParser().parsebytes(f"Content-Type: {content_type}\r\n\r\n".encode() + body)
+        parts = []
+        for part in message.get_payload():
+            request_line, _, rest = part.get_payload().replace('\r\n', '\n').partition('\n')
+            head, _, call_body = rest.partition('\n\n')
+            headers = dict(line.split(': ', 1) for line in head.split('\n') if line)
+            headers = {name.lower(): value for name, value in headers.items()}
+            method, path, _ = request_line.split(' ')
+            status, payload = self.handle_call(method, path, headers.get('authorization'), call_body.encode())
+            reason = {200: 'OK', 204: 'No Content', 404: 'Not Found', 500: 'Internal Server Error'}[status]
+            parts.append(
+                "--batch_resp\r\nContent-Type: application/http\r\n"
+                f"Content-ID: <response-{part['Content-ID'][1:-1]}>\r\n\r\n"
+                f"HTTP/1.1 {status} {reason}\r\nContent-Type: application/json\r\n\r\n{payload.decode()}\r\n"
+            )
+        with self._lock:
+            self.batches.append(len(parts))
+        return (''.join(parts) + "--batch_resp--\r\n").encode()
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+@pytest.fixture
+def calendar(tmp_path, monkeypatch):
+    """
+    Yield (service, stand-in factory, user data folder) with credentials for users u0..u9.
+    """
+    config = {"web": {"client_id": "cid", "client_secret": "secret", "javascript_origins": [],
+                      "redirect_uris": ["http://localhost:5000/oauth2callback"],
+                      "auth_uri": "https://accounts.google.com/o/oauth2/auth",
+                      "token_uri": "https://oauth2.googleapis.com/token"}}
+    config_path = tmp_path / 'client.json'
+    config_path.write_text(json.dumps(config))
+    monkeypatch.setenv('GOOGLE_CLIENT_CONFIG_JSON', str(config_path))
+    monkeypatch.setenv('GOOGLE_REDIRECT_URI', 'http://localhost:5000/oauth2callback')
+    monkeypatch.delenv('CREDENTIAL_STORE_PATH', raising=False)
+    monkeypatch.setenv('CREDENTIAL_STORE_KEY_PATH', str(tmp_path / 'credential_store.key'))
+    gcs = importlib.import_module('google_calendar_service')
+    from utils.credential_store import get_credential_store
+
+    folder = str(tmp_path / 'user_data')
+    expiry = (datetime.datetime.utcnow() + datetime.timedelta(hours=1)).isoformat() + 'Z'
+    get_credential_store(folder).put_many([
+        (f"u{i}", {"token": f"token-u{i}", "refresh_token": "r", "client_id": "cid", "client_secret": "secret",
+                   "token_uri": "https://oauth2.googleapis.com/token", "expiry": expiry})
+        for i in range(10)
+    ])
+
+    service = gcs.GoogleCalendarService()
+    servers = []
+
+    def serve(**kwargs):
+        server = CalendarStandIn(**kwargs)
+        servers.append(server)
+        service._discovery_doc = dict(service._discovery_doc, rootUrl=server.root_url)
+        return server
+
+    yield service, serve, folder
+    for server in servers:
+        server.close()
+
+
+def test_replacing_a_checkup_takes_one_round_trip(calendar):
+    service, serve, folder = calendar
+    server = serve()
+
+    result = service.create_weekly_checkup('u1', folder, 'monday', '10:00', replace_event_id='old1')
+
+    assert result.event_id == 'evt1' and result.ok
+    assert server.batches == [2]
+    assert sorted(server.calls) == [
+        ('DELETE', '/calendar/v3/calendars/primary/events/old1', 'Bearer token-u1'),
+        ('POST', '/calendar/v3/calendars/primary/events', 'Bearer token-u1'),
+    ]
+
+
+def test_already_deleted_event_does_not_fail_the_checkup(calendar):
+    service, serve, folder = calendar
+    server = serve(missing_events={'gone'})
+
+    assert service.create_weekly_checkup('u1', folder, 'FRIDAY', '18:30', replace_event_id='gone').ok
+    assert service.delete_event('u1', folder, 'gone') is True
+    assert service.delete_event('u1', folder, 'other') is True
+    assert len(server.calls) == 4
+
+
+def test_failed_delete_keeps_the_old_event_id_for_a_retry(calendar):
+    service, serve, folder = calendar
+    server = serve(failing_events={'stuck'})
+
+    result = service.create_weekly_checkup('u1', folder, 'MONDAY', '10:00', replace_event_id=['old1', 'stuck'])
+    assert result.event_id == 'evt1'
+    assert result.undeleted_event_ids == ('stuck',) and not result.ok
+
+    server.failing_events.clear()
+    retried = service.create_weekly_checkup('u1', folder, 'MONDAY', '10:00',
+                                            replace_event_id=[result.event_id, *result.undeleted_event_ids])
+    assert retried.ok
+    assert server.batches == [3, 3]
+
+
+def test_invalid_day_or_time_is_rejected_before_any_call(calendar):
+    service, serve, folder = calendar
+    server = serve()
+
+    with pytest.raises(ValueError):
+        service.create_weekly_checkup('u1', folder, 'someday', '10:00')
+    with pytest.raises(ValueError):
+        service.create_weekly_checkup('u1', folder, 'MONDAY', '25:00')
+    assert server.calls == []
+
+
+def test_bulk_reschedule_batches_users_with_bounded_parallelism(calendar):
+    service, serve, folder = calendar
+    server = serve(delay=0.1)
+    checkups = [(f"u{i}", 'TUESDAY', '09:00', f"old{i}") for i in range(7)]
+    checkups.append(('nobody', 'TUESDAY', '09:00', 'old-nobody'))
+
+    results = service.reschedule_checkups(folder, checkups, max_workers=2, batch_size=4)
+
+    assert results['nobody'].event_id is None
+    assert sorted(result.event_id for user, result in results.items() if user != 'nobody') == \
+        sorted(f"evt{i}" for i in range(1, 8))
+    assert sorted(server.batches) == [2, 4, 4, 4]
+    assert server.max_in_flight == 2
+    for method, path, authorization in server.calls:
+        if method == 'DELETE':
+            assert authorization == f"Bearer token-u{path[-1]}"
+
+
+def test_weekly_event_starts_at_the_next_matching_time():
+    from google_calendar_service import CALENDAR_TIMEZONE, build_weekly_checkup_event
+    from zoneinfo import ZoneInfo
+
+    wednesday_noon = datetime.datetime(2024, 5, 8, 12, 0, tzinfo=ZoneInfo(CALENDAR_TIMEZONE))
+    event = build_weekly_checkup_event('wednesday', '11:00', now=wednesday_noon)
+    assert event['start']['dateTime'].startswith('2024-05-15T11:00:00')
+    assert event['recurrence'] == ['RRULE:FREQ=WEEKLY;BYDAY=WE']
+
+    event = build_weekly_checkup_event('SUNDAY', '08:15', now=wednesday_noon)
+    assert event['start']['dateTime'].startswith('2024-05-12T08:15:00')
+
+
+def test_service_cache_ttl_follows_the_token_expiry(calendar, monkeypatch):
+    import google_calendar_service as gcs
+    from google.oauth2.credentials import Credentials
+
+    service, _, _ = calendar
+    monkeypatch.setattr(gcs, 'CALENDAR_SERVICE_CACHE_TTL', 3600)
+    monkeypatch.setattr(gcs, 'CALENDAR_TOKEN_EXPIRY_SKEW', 60)
+    now = datetime.datetime.utcnow()
+
+    def ttl(expiry):
+        return service._cache_ttl(Credentials('t', expiry=expiry))
+
+    assert ttl(None) == 3600
+    assert ttl(now + datetime.timedelta(hours=5)) == 3600
+    assert 535 < ttl(now + datetime.timedelta(minutes=10)) <= 540
+    assert ttl(now + datetime.timedelta(seconds=30)) == 0
+
+
+def test_cached_service_is_reused_until_invalidated_or_expired(calendar, monkeypatch):
+    import google_calendar_service as gcs
+    from utils.credential_store import get_credential_store
+
+    service, _, folder = calendar
+    first = service.get_calendar_service('u1', folder)
+    assert service.get_calendar_service('u1', folder) is first
+    assert service.service_cache_stats()["hits"] == 1
+
+    service.invalidate_user('u1', folder)
+    second = service.get_calendar_service('u1', folder)
+    assert second is not first
+
+    monkeypatch.setattr(gcs, 'CALENDAR_SERVICE_CACHE_TTL', 0.05)
+    service.invalidate_user('u1', folder)
+    third = service.get_calendar_service('u1', folder)
+    time.sleep(0.1)
+    assert service.get_calendar_service('u1', folder) is not third
+
+    # A token expiring within the skew is not cached at all.
+    monkeypatch.setattr(gcs, 'CALENDAR_SERVICE_CACHE_TTL', 3600)
+    monkeypatch.setattr(gcs, 'CALENDAR_TOKEN_EXPIRY_SKEW', 600)
+    store = get_credential_store(folder)
+    soon = (datetime.datetime.utcnow() + datetime.timedelta(minutes=5)).isoformat() + 'Z'
+    store.put('u2', dict(store.get('u2'), expiry=soon))
+    misses = service.service_cache_stats()["misses"]
+    assert service.get_calendar_service('u2', folder) is not service.get_calendar_service('u2', folder)
+    assert service.service_cache_stats()["misses"] == misses + 2
+
+
+def test_each_thread_reuses_its_own_http():
+    from google_calendar_service import _thread_local_http
+
+    mine = _thread_local_http()
+    others = []
+    thread = threading.Thread(target=lambda: others.extend([_thread_local_http(), _thread_local_http()]))
+    thread.start()
+    thread.join()
+
+    assert _thread_local_http() is mine
+    assert others[0] is others[1] and others[0] is not mine
+
+
+def test_token_refresher_runs_without_the_calendar_service(calendar, monkeypatch):
+    _, _, folder = calendar
+    gcs = importlib.import_module('google_calendar_service')
+    monkeypatch.delenv('GOOGLE_CLIENT_CONFIG_JSON')
+
+    lazy = gcs.LazyCalendarService(
+        refresher_factory=lambda user_profile_dir: gcs.CalendarTokenRefresher(
+            user_profile_dir, gcs.CALENDAR_SCOPES).start())
+    refresher = lazy.start_token_refresher(folder)
+    try:
+        deadline = time.time() + 5
+        while lazy.token_refresh_stats()["tracked"] < 10 and time.time() < deadline:
+            time.sleep(0.05)
+        stats = lazy.token_refresh_stats()
+        assert stats["tracked"] == 10 and stats["running"] and stats["leader"]
+        assert not lazy.initialized
+    finally:
+        refresher.stop(5)
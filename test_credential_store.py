@@ -0,0 +1,105 @@
+"""
+Tests for the encrypted append-only OAuth credential log in utils/credential_store.py.
+
+Run with: python -m pytest test_credential_store.py
+"""
+
+import os
+
+import pytest
+from cryptography.fernet import Fernet
+
+from utils.credential_store import HEADER, CredentialStore, load_keys
+
+
+@pytest.fixture
+def log_path(tmp_path):
+    return str(tmp_path / 'google_credentials.log')
+
+
+def creds(token):
+    return {"token": token, "refresh_token": "r"}
+
+
+def test_appends_of_one_instance_are_seen_by_another(log_path):
+    key = Fernet.generate_key()
+    first, second = CredentialStore(log_path, [key]), CredentialStore(log_path, [key])
+
+    first.put('u1', creds('a'))
+    assert second.get('u1') == creds('a')
+    second.put_many([('u1', creds('b')), ('u2', creds('c'))])
+    first.delete('u2')
+
+    assert first.get('u1') == creds('b')
+    assert second.get('u2') is None
+    assert first.user_ids() == second.user_ids() == ['u1']
+
+
+def test_torn_tail_is_ignored_and_truncated_on_the_next_write(log_path):
+    key = Fernet.generate_key()
+    store = CredentialStore(log_path, [key])
+    store.put('u1', creds('a'))
+    intact = os.path.getsize(log_path)
+    with open(log_path, 'ab') as f:
+        # A crash left the header and half of a record.
+        f.write(HEADER.pack(0, 2, 100) + b'u2' + b'x' * 10)
+
+    reader = CredentialStore(log_path, [key])
+    assert reader.user_ids() == ['u1']
+    reader.put('u3', creds('c'))
+
+    fresh = CredentialStore(log_path, [key])
+    assert fresh.user_ids() == ['u1', 'u3']
+    assert fresh.get('u3') == creds('c')
+    assert fresh.stats()["log_bytes"] == os.path.getsize(log_path) > intact
+
+
+def test_superseded_records_are_compacted_away(log_path):
+    key = Fernet.generate_key()
+    store = CredentialStore(log_path, [key], compact_min_bytes=2048, compact_ratio=0.5)
+    other = CredentialStore(log_path, [key])
+    for n in range(30):
+        store.put_many([('u1', creds(f"a{n}")), ('u2', creds(f"b{n}"))])
+
+    assert store.stats()["compactions"] >= 1
+    assert os.path.getsize(log_path) < 2 * 2048
+    store.compact()
+    assert store.stats()["live_ratio"] == 1.0
+    # Another instance notices the log was replaced and re-indexes it.
+    assert other.get('u1') == creds('a29') and other.get('u2') == creds('b29')
+
+
+def test_rotated_key_decrypts_old_records_and_compaction_re_encrypts(log_path):
+    old_key, new_key = Fernet.generate_key(), Fernet.generate_key()
+    CredentialStore(log_path, [old_key]).put('u1', creds('a'))
+
+    rotated = CredentialStore(log_path, [new_key, old_key])
+    assert rotated.get('u1') == creds('a')
+    rotated.compact()
+
+    assert CredentialStore(log_path, [new_key]).get('u1') == creds('a')
+    with pytest.raises(ValueError):
+        CredentialStore(log_path, [old_key]).get('u1')
+
+
+def test_key_file_is_created_outside_the_log_folder_unless_configured(tmp_path, monkeypatch):
+    monkeypatch.delenv('CREDENTIAL_STORE_KEY', raising=False)
+    monkeypatch.setenv('FLASK_ENV', 'development')
+    key_path = str(tmp_path / 'config' / 'credential_store.key')
+    legacy_path = str(tmp_path / 'data' / 'google_credentials.log.key')
+
+    keys = load_keys(key_path, legacy_path)
+    assert os.path.exists(key_path) and not os.path.exists(legacy_path)
+    assert load_keys(key_path, legacy_path) == keys
+
+    os.makedirs(os.path.dirname(legacy_path))
+    with open(legacy_path, 'wb') as f:
+        f.write(Fernet.generate_key())
+    assert load_keys(str(tmp_path / 'elsewhere.key'), legacy_path) == [open(legacy_path, 'rb').read()]
+
+    monkeypatch.setenv('FLASK_ENV', 'production')
+    with pytest.raises(ValueError):
+        load_keys(key_path)
+    configured = [Fernet.generate_key(), Fernet.generate_key()]
+    monkeypatch.setenv('CREDENTIAL_STORE_KEY', ','.join(k.decode() for k in configured))
+    assert load_keys(key_path) == configured
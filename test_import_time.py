@@ -0,0 +1,112 @@
+"""
+Import-time budget for google_calendar_service.py and tests for its lazily built calendar_service.
+
+Importing the module must not build the service (no client config is read)
+nor pull in the googleapiclient / google_auth_oauthlib stacks, and must stay
+within IMPORT_TIME_BUDGET_MS (default 150) in a fresh interpreter.
+
+Run with: python -m pytest test_import_time.py
+"""
+
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+from google_calendar_service import LazyCalendarService
+
+HEAVY_MODULES = ('googleapiclient', 'google_auth_oauthlib', 'google_auth_httplib2', 'httplib2',
+                 'google.oauth2.credentials')
+BUDGET_MS = float(os.getenv('IMPORT_TIME_BUDGET_MS', '150'))
+
+PROBE = """
+import json, sys, time
+started = time.perf_counter()
+import google_calendar_service
+elapsed = (time.perf_counter() - started) * 1000
+print(json.dumps({
+    "elapsed_ms": elapsed,
+    "loaded": [name for name in %r if name in sys.modules],
+    "initialized": google_calendar_service.calendar_service.initialized,
+}))
+""" % (HEAVY_MODULES,)
+
+
+def import_probe():
+    env = dict(os.environ)
+    # Without a client config, building the service at import would raise.
+    env.pop('GOOGLE_CLIENT_CONFIG_JSON', None)
+    env.pop('GOOGLE_REDIRECT_URI', None)
+    result = subprocess.run([sys.executable, '-c', PROBE], capture_output=True, text=True, env=env,
+                            cwd=os.path.dirname(os.path.abspath(__file__)), check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def test_import_is_lazy_and_within_budget():
+    runs = [import_probe() for _ in range(3)]
+
+    assert all(run["loaded"] == [] for run in runs), runs[0]["loaded"]
+    assert not any(run["initialized"] for run in runs)
+    fastest = min(run["elapsed_ms"] for run in runs)
+    assert fastest < BUDGET_MS, f"import took {fastest:.0f}ms, budget {BUDGET_MS:.0f}ms"
+
+
+class FakeRefresher:
+    def stats(self):
+        return {"tracked": 0}
+
+
+class FakeService:
+    built = 0
+
+    def __init__(self):
+        FakeService.built += 1
+        self.refresher_dirs = []
+
+    def start_token_refresher(self, user_profile_dir):
+        self.refresher_dirs.append(user_profile_dir)
+        return 'refresher'
+
+    def service_cache_stats(self):
+        return {"entries": 0}
+
+    def token_refresh_stats(self):
+        return {"tracked": 1}
+
+    def ping(self):
+        return 'pong'
+
+
+def test_refresher_starts_at_boot_and_service_on_first_use():
+    FakeService.built = 0
+    started = []
+    refresher = FakeRefresher()
+    lazy = LazyCalendarService(factory=FakeService,
+                               refresher_factory=lambda user_profile_dir: started.append(user_profile_dir) or refresher)
+
+    assert lazy.start_token_refresher('user_data') is refresher
+    assert started == ['user_data']
+    assert lazy.token_refresh_stats() == {"tracked": 0}
+    assert lazy.service_cache_stats() is None
+    assert FakeService.built == 0 and not lazy.initialized
+
+    assert lazy.ping() == 'pong'
+    assert lazy.ping() == 'pong'
+    assert FakeService.built == 1
+    # The built service attaches to the refresher that is already running.
+    assert lazy.refresher_dirs == ['user_data']
+    assert lazy.service_cache_stats() == {"entries": 0}
+    assert lazy.token_refresh_stats() == {"tracked": 1}
+    assert lazy.start_token_refresher('other') == 'refresher'
+
+
+def test_configuration_error_surfaces_on_first_use():
+    def broken():
+        raise ValueError("Missing required environment variables: GOOGLE_CLIENT_CONFIG_JSON")
+
+    lazy = LazyCalendarService(factory=broken)
+    with pytest.raises(ValueError):
+        lazy.get_calendar_service('u1', 'user_data')
+    assert not lazy.initialized
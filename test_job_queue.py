@@ -0,0 +1,97 @@
+"""
+Tests for the sqlite-backed background job queue in utils/job_queue.py.
+
+Run with: python -m pytest test_job_queue.py
+"""
+
+import io
+import threading
+import time
+
+import pytest
+
+from utils.job_queue import STATUS_DONE, STATUS_QUEUED, STATUS_RUNNING, JobQueue
+
+
+def make_queue(tmp_path, handler, **kwargs):
+    return JobQueue(str(tmp_path / 'jobs.sqlite3'), str(tmp_path / 'spool'), handler, max_workers=2, **kwargs)
+
+
+def test_heartbeat_keeps_a_long_job_from_being_recovered(tmp_path):
+    release = threading.Event()
+    runs = []
+
+    def handler(user_id, input_path):
+        runs.append(user_id)
+        release.wait(5)
+        return {"ok": True}
+
+    queue = make_queue(tmp_path, handler, stale_after_seconds=0.5, heartbeat_seconds=0.1, recover_interval=0.1)
+    queue.start()
+    try:
+        job_id = queue.submit('u1', io.BytesIO(b'img'))
+        time.sleep(1.0)
+        # A second process sharing the database must not take over the live job.
+        other = make_queue(tmp_path, handler, stale_after_seconds=0.5, heartbeat_seconds=0.1)
+        assert other.recover() == 0
+        assert queue.get(job_id)['status'] == STATUS_RUNNING
+        release.set()
+        deadline = time.time() + 5
+        while queue.get(job_id)['status'] != STATUS_DONE and time.time() < deadline:
+            time.sleep(0.05)
+        assert queue.get(job_id)['result'] == {"ok": True}
+        assert runs == ['u1']
+        other.shutdown()
+    finally:
+        release.set()
+        queue.shutdown()
+
+
+def test_jobs_of_a_dead_process_are_requeued_and_finished_jobs_purged(tmp_path):
+    queue = make_queue(tmp_path, lambda user_id, input_path: {"user": user_id},
+                       stale_after_seconds=60, heartbeat_seconds=10, retention_seconds=3600)
+    conn = queue._conn()
+    conn.execute(
+        "INSERT INTO jobs (id, user_id, status, input_path, created_at, updated_at, heartbeat)"
+        " VALUES ('dead', 'u1', ?, NULL, '2024-01-01T00:00:00Z', '2024-01-01T00:00:00Z', ?)",
+        (STATUS_RUNNING, time.time() - 120),
+    )
+    conn.execute(
+        "INSERT INTO jobs (id, user_id, status, created_at, updated_at, heartbeat)"
+        " VALUES ('old', 'u2', ?, '2024-01-01T00:00:00Z', '2024-01-01T00:00:00Z', 0)",
+        (STATUS_DONE,),
+    )
+
+    assert queue.recover() == 1
+    queue.shutdown()
+    assert queue.get('dead')['status'] == STATUS_DONE
+    assert queue.purge() == 1
+    assert queue.get('old') is None
+    assert queue.purge() == 0
+    assert queue.get('dead') is not None
+
+
+def test_recover_does_not_schedule_a_job_twice(tmp_path):
+    started = threading.Event()
+    release = threading.Event()
+
+    def handler(user_id, input_path):
+        started.set()
+        release.wait(5)
+        return {}
+
+    queue = JobQueue(str(tmp_path / 'jobs.sqlite3'), str(tmp_path / 'spool'), handler, max_workers=1)
+    try:
+        queue.submit('u1', io.BytesIO(b'a'))
+        started.wait(5)
+        queued = queue.submit('u2', io.BytesIO(b'b'))
+        assert queue.get(queued)['status'] == STATUS_QUEUED
+        assert queue.recover() == 0
+    finally:
+        release.set()
+        queue.shutdown()
+
+
+def test_heartbeat_must_be_shorter_than_the_stale_age(tmp_path):
+    with pytest.raises(ValueError):
+        make_queue(tmp_path, lambda *args: {}, stale_after_seconds=10, heartbeat_seconds=10)
@@ -0,0 +1,165 @@
+"""
+Tests for the profile storage backends in utils/profile_store.py.
+
+Run with: python -m pytest test_profile_store.py
+"""
+
+import json
+import os
+import threading
+
+import pytest
+
+from utils.profile_store import (PROGRESS_FIELD, VERSION_FIELD, CachedProfileStore, JsonFileProfileStore,
+                                 ProfileVersionConflict, SqliteProfileStore)
+
+
+@pytest.fixture
+def sqlite_store(tmp_path):
+    return SqliteProfileStore(str(tmp_path / 'profiles.sqlite3'))
+
+
+@pytest.fixture(params=['json', 'sqlite'])
+def store(request, tmp_path):
+    if request.param == 'json':
+        return JsonFileProfileStore(str(tmp_path))
+    return SqliteProfileStore(str(tmp_path / 'profiles.sqlite3'))
+
+
+def test_sqlite_save_extends_history_after_keep_last_trim(sqlite_store):
+    sqlite_store.save('u1', {"age": 30, PROGRESS_FIELD: [{"n": 0}]})
+    for n in range(1, 5):
+        sqlite_store.append_progress('u1', {"n": n}, keep_last=2)
+
+    profile = sqlite_store.load('u1')
+    assert [entry["n"] for entry in profile[PROGRESS_FIELD]] == [3, 4]
+
+    profile[PROGRESS_FIELD].append({"n": 5})
+    sqlite_store.save('u1', profile, expected_version=profile['_version'])
+    assert [entry["n"] for entry in sqlite_store.load('u1')[PROGRESS_FIELD]] == [3, 4, 5]
+
+    sqlite_store.append_progress('u1', {"n": 6}, keep_last=2)
+    assert [entry["n"] for entry in sqlite_store.load('u1')[PROGRESS_FIELD]] == [5, 6]
+
+
+def test_append_progress_merges_into_dict_fields(store):
+    store.save('u1', {"body_fat_estimates": {"from_photo": {"value": "%20"}}})
+    # A concurrent photo analysis updates from_photo after this request loaded the profile.
+    store.update_fields('u1', {"body_fat_estimates": {"from_photo": {"value": "%18"}}})
+
+    store.append_progress('u1', {"n": 1}, fields={"measurements": {"waist_cm": 80}},
+                          merge={"body_fat_estimates": {"from_measurements": {"value": 17.5}}})
+
+    profile = store.load('u1')
+    assert profile["body_fat_estimates"] == {"from_photo": {"value": "%18"}, "from_measurements": {"value": 17.5}}
+    assert profile["measurements"] == {"waist_cm": 80}
+    assert profile[PROGRESS_FIELD] == [{"n": 1}]
+
+
+def test_json_write_replaces_the_file_atomically(tmp_path, monkeypatch):
+    store = JsonFileProfileStore(str(tmp_path))
+    store.save('u1', {"age": 30})
+    before = store.fingerprint('u1')
+
+    def torn_dump(data, f, **kwargs):
+        f.write('{"age": ')
+        raise OSError("disk full")
+
+    monkeypatch.setattr(json, 'dump', torn_dump)
+    with pytest.raises(OSError):
+        store.save('u1', {"age": 31})
+    monkeypatch.undo()
+
+    # The failed write never touched the profile and left no temp file behind.
+    assert store.load('u1') == {"age": 30, VERSION_FIELD: 1}
+    assert sorted(os.listdir(tmp_path)) == ['.locks', 'u1.json']
+    store.save('u1', {"age": 31})
+    assert store.fingerprint('u1')[0] != before[0]
+
+
+def test_concurrent_writers_do_not_lose_updates(store):
+    store.save('u1', {})
+
+    def writer(n):
+        for i in range(20):
+            store.append_progress('u1', {"writer": n, "i": i})
+            store.update_fields('u1', {f"field_{n}": i})
+
+    threads = [threading.Thread(target=writer, args=(n,)) for n in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    profile = store.load('u1')
+    assert len(profile[PROGRESS_FIELD]) == 80
+    assert all(profile[f"field_{n}"] == 19 for n in range(4))
+    assert profile[VERSION_FIELD] == 1 + 4 * 20 * 2
+
+
+def test_save_with_a_stale_version_raises_a_conflict(store):
+    version = store.save('u1', {"age": 30})
+    store.update_fields('u1', {"gender": "female"})
+
+    with pytest.raises(ProfileVersionConflict) as excinfo:
+        store.save('u1', {"age": 40}, expected_version=version)
+    assert (excinfo.value.expected, excinfo.value.actual) == (version, version + 1)
+    assert store.load('u1')["age"] == 30
+
+    assert store.save('u1', {"age": 40}, expected_version=version + 1) == version + 2
+    assert store.save_many([('u1', {"age": 41}, version), ('u2', {"age": 20}, None)])[1] == 1
+    assert store.load('u1')["age"] == 40
+
+
+def test_cache_picks_up_writes_that_bypass_it(store):
+    cached = CachedProfileStore(store, max_entries=2)
+    cached.save('u1', {"age": 30})
+    assert cached.load('u1')["age"] == 30
+    assert cached.load('u1')["age"] == 30
+    assert cached.stats()["hits"] == 1
+
+    # Another worker writes straight to the backing store.
+    store.update_fields('u1', {"age": 31})
+    assert cached.load('u1')["age"] == 31
+    assert cached.stats()["misses"] == 2
+
+    loaded = cached.load('u1')
+    loaded["age"] = 99
+    assert cached.load('u1')["age"] == 31
+
+    for user_id in ('u2', 'u3'):
+        cached.save(user_id, {"age": 20})
+        cached.load(user_id)
+    stats = cached.stats()
+    assert (stats["entries"], stats["evictions"]) == (2, 1)
+    assert cached.load('u1')["age"] == 31
+
+
+def test_cache_save_does_not_pin_a_write_that_raced_it(store, monkeypatch):
+    cached = CachedProfileStore(store)
+    cached.save('u1', {"age": 30})
+    cached.load('u1')
+    save = store.save
+
+    def save_then_race(user_id, data, expected_version=None):
+        version = save(user_id, data, expected_version)
+        # Another worker's write lands before this one's save returns.
+        store.update_fields(user_id, {"age": 50})
+        return version
+
+    monkeypatch.setattr(store, 'save', save_then_race)
+    cached.save('u1', {"age": 40})
+    assert cached.load('u1')["age"] == 50
+    assert cached.load('u1')["age"] == 50
+
+
+@pytest.mark.parametrize('keep_last', [0, 1, 3, 10])
+def test_keep_last_trims_both_backends_alike(store, keep_last):
+    store.save('u1', {PROGRESS_FIELD: [{"n": n} for n in range(5)]})
+    store.append_progress('u1', {"n": 5}, keep_last=keep_last)
+    expected = list(range(6))[-keep_last:] if keep_last else []
+    assert [entry["n"] for entry in store.load('u1')[PROGRESS_FIELD]] == expected
+
+    store.append_progress('u1', {"n": 6}, keep_last=keep_last)
+    expected = (expected + [6])[-keep_last:] if keep_last else []
+    assert [entry["n"] for entry in store.load('u1')[PROGRESS_FIELD]] == expected
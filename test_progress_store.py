@@ -0,0 +1,79 @@
+"""
+Tests for the append-only progress log in utils/progress_store.py.
+
+Run with: python -m pytest test_progress_store.py
+"""
+
+import math
+
+import pytest
+
+from utils.progress_store import ProgressStore, records_from_history, to_iso
+
+
+@pytest.fixture
+def progress(tmp_path):
+    return ProgressStore(str(tmp_path / 'progress'))
+
+
+def test_seed_only_fills_an_empty_log(progress):
+    history = [
+        {"timestamp": "2024-01-02T00:00:00Z", "weight_kg": 81, "measurements": {"waist_cm": 90}},
+        {"date": "2024-01-01_08:00", "measurements": {"weight_kg": 82}},
+        {"measurements": {"waist_cm": 91}},
+    ]
+    records = records_from_history(history)
+    assert len(records) == 2
+
+    assert progress.seed('u1', records) is True
+    rows = progress.query('u1')
+    assert [row["weight_kg"] for row in rows] == [82, 81]
+    assert rows[1]["waist_cm"] == 90 and rows[0]["hip_cm"] is None
+
+    progress.append('u1', (1704240000.0, 80, 89, math.nan, math.nan))
+    # An existing log holds more than the trimmed inline history and is never overwritten.
+    assert progress.seed('u1', records[:1]) is False
+    assert progress.count('u1') == 3
+
+
+def test_query_bounds_are_inclusive(progress):
+    for day in range(10):
+        progress.append('u1', (86400.0 * day, 80 - day, math.nan, math.nan, math.nan))
+
+    weights = lambda rows: [row["weight_kg"] for row in rows]
+    assert weights(progress.query('u1', start=86400.0 * 3, end=86400.0 * 5)) == [77, 76, 75]
+    assert weights(progress.query('u1', start=86400.0 * 2.5, end=86400.0 * 4.5)) == [77, 76]
+    assert weights(progress.query('u1', end=86400.0)) == [80, 79]
+    assert weights(progress.query('u1', start=86400.0 * 9)) == [71]
+    assert progress.query('u1', start=86400.0 * 20) == []
+    assert progress.query('u1', start=86400.0 * 5, end=86400.0 * 4) == []
+    assert progress.query('u2') == []
+    assert progress.query('u1', start=0, end=0)[0]["timestamp"].startswith("1970-01-01")
+
+
+def test_append_keeps_the_log_sorted_and_drops_a_torn_record(progress):
+    progress.append('u1', (200.0, 80, math.nan, math.nan, math.nan))
+    # A worker with a slightly slow clock cannot break the binary search.
+    assert progress.append('u1', (100.0, 79, math.nan, math.nan, math.nan))[0] == 200.0
+
+    with open(progress.path_for('u1'), 'ab') as f:
+        f.write(b'\x00' * 7)
+    progress.append('u1', (300.0, 78, math.nan, math.nan, math.nan))
+    assert progress.count('u1') == 3
+    assert [row["weight_kg"] for row in progress.query('u1', start=200.0)] == [80, 79, 78]
+
+
+def test_query_downsamples_into_time_buckets(progress):
+    for hour in range(100):
+        waist = math.nan if hour % 2 else 90.0
+        progress.append('u1', (3600.0 * hour, 80 + hour % 4, waist, math.nan, math.nan))
+
+    rows = progress.query('u1', max_points=10)
+    assert len(rows) == 10
+    # 9.9-hour buckets: the first holds hours 0-9, reported at their mean time.
+    assert rows[0]["weight_kg"] == pytest.approx(81.3)
+    assert rows[0]["timestamp"] == to_iso(3600.0 * 4.5)
+    # Missing waist values are skipped rather than averaged in as zero.
+    assert all(row["waist_cm"] == 90.0 for row in rows) and all(row["hip_cm"] is None for row in rows)
+    assert len(progress.query('u1', max_points=200)) == 100
+    assert len(progress.query('u1', start=0, end=3600.0 * 9, max_points=5)) == 5
@@ -0,0 +1,333 @@
+"""
+Tests for gemini/resilience.py against a local fake model server.
+
+The fake server answers each POST with the next scripted action (a delay
+plus a reply or an HTTP error status), and FakeServerModel maps its HTTP
+errors to google.api_core exceptions the way the Gemini SDK does.
+
+Run with: python -m pytest test_resilience.py
+"""
+
+import json
+import threading
+import time
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import google.ai.generativelanguage as glm
+import pytest
+from google.api_core import exceptions as api_exceptions
+
+from gemini import backends, client, fat_analyzer
+from gemini.backends import FakeModel, GeminiBackend
+from gemini.governor import CallGovernor, GovernedModel, ModelOverloaded
+from gemini.resilience import CircuitBreaker, CircuitOpen, LatencyTracker, ResiliencePolicy, ResilientModel
+
+
+class FakeModelServer:
+    """
+    Local HTTP server replaying scripted (delay, status, text) actions; the last one repeats.
+    """
+
+    def __init__(self, *actions):
+        self.actions = list(actions)
+        self.requests = 0
+        self._lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                with server._lock:
+                    server.requests += 1
+                    delay, status, text = server.actions.pop(0) if len(server.actions) > 1 else server.actions[0]
+                time.sleep(delay)
+                body = json.dumps({"text": text}).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}/generate"
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class FakeReply:
+    def __init__(self, text):
+        self.text = text
+
+
+class FakeServerModel:
+    """
+    Minimal generate_content client for FakeModelServer.
+    """
+
+    def __init__(self, url):
+        self.url = url
+
+    def generate_content(self, contents, stream=False, **kwargs):
+        request = urllib.request.Request(self.url, data=json.dumps({"contents": contents}).encode(), method='POST')
+        try:
+            with urllib.request.urlopen(request, timeout=10) as response:
+                text = json.load(response)["text"]
+        except urllib.error.HTTPError as e:
+            raise api_exceptions.from_http_status(e.code, f"fake server returned {e.code}")
+        if stream:
+            return iter(FakeReply(part) for part in text.split(' '))
+        return FakeReply(text)
+
+
+@pytest.fixture
+def serve():
+    servers = []
+
+    def start(*actions):
+        server = FakeModelServer(*actions)
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.close()
+
+
+def make_model(server, **kwargs):
+    kwargs.setdefault('base_delay', 0.01)
+    kwargs.setdefault('max_delay', 0.05)
+    return ResilientModel(FakeServerModel(server.url), ResiliencePolicy(**kwargs))
+
+
+def test_retries_transient_errors_until_success(serve):
+    server = serve((0, 503, ''), (0, 500, ''), (0, 200, 'ok'))
+    model = make_model(server, attempts=3)
+
+    assert model.generate_content("hi").text == 'ok'
+    assert server.requests == 3
+    assert model.policy.stats()["retries"] == 2
+
+
+def test_gives_up_after_the_last_attempt(serve):
+    server = serve((0, 503, ''))
+    model = make_model(server, attempts=2)
+
+    with pytest.raises(api_exceptions.ServiceUnavailable):
+        model.generate_content("hi")
+    assert server.requests == 2
+    assert model.policy.stats()["failures"] == 1
+
+
+def test_client_errors_are_not_retried(serve):
+    server = serve((0, 400, ''))
+    model = make_model(server, attempts=3)
+
+    with pytest.raises(api_exceptions.BadRequest):
+        model.generate_content("hi")
+    assert server.requests == 1
+    assert model.policy.breaker.state == "closed"
+
+
+def test_governor_rejections_are_not_retried():
+    calls = []
+
+    class Shedding:
+        def generate_content(self, *args, **kwargs):
+            calls.append(1)
+            raise ModelOverloaded("busy", retry_after=2)
+
+    model = ResilientModel(Shedding(), ResiliencePolicy(attempts=3, base_delay=0.01))
+    with pytest.raises(ModelOverloaded):
+        model.generate_content("hi")
+    assert len(calls) == 1
+
+
+def test_breaker_opens_fails_fast_and_recovers(serve):
+    server = serve((0, 503, ''), (0, 503, ''), (0, 200, 'back'))
+    breaker = CircuitBreaker(failure_threshold=2, cooldown=0.3)
+    model = make_model(server, attempts=1, breaker=breaker)
+
+    for _ in range(2):
+        with pytest.raises(api_exceptions.ServiceUnavailable):
+            model.generate_content("hi")
+    assert breaker.state == "open"
+
+    with pytest.raises(CircuitOpen) as excinfo:
+        model.generate_content("hi")
+    assert excinfo.value.retry_after >= 1
+    assert server.requests == 2
+
+    time.sleep(0.35)
+    assert breaker.state == "half_open"
+    assert model.generate_content("hi").text == 'back'
+    assert breaker.state == "closed"
+
+
+def test_failed_probe_reopens_the_breaker(serve):
+    server = serve((0, 503, ''))
+    breaker = CircuitBreaker(failure_threshold=1, cooldown=0.2)
+    model = make_model(server, attempts=1, breaker=breaker)
+
+    with pytest.raises(api_exceptions.ServiceUnavailable):
+        model.generate_content("hi")
+    time.sleep(0.25)
+    with pytest.raises(api_exceptions.ServiceUnavailable):
+        model.generate_content("hi")
+    assert breaker.state == "open"
+    assert breaker.stats()["times_opened"] == 2
+
+
+def test_stream_closed_during_the_probe_releases_it():
+    breaker = CircuitBreaker(failure_threshold=1, cooldown=0.1)
+    policy = ResiliencePolicy(attempts=1, breaker=breaker)
+    breaker.record(False)
+    time.sleep(0.15)
+
+    stream = policy.stream(lambda: iter(['a', 'b', 'c']))
+    assert next(stream) == 'a'
+    stream.close()
+    assert breaker.state == "closed"
+
+    breaker.record(False)
+    time.sleep(0.15)
+
+    def broken():
+        raise ValueError("bad request")
+        yield
+
+    with pytest.raises(ValueError):
+        list(policy.stream(broken))
+    # A non-transient error gives no verdict but still frees the probe slot.
+    assert breaker.state == "half_open"
+
+
+def test_slow_call_is_hedged(serve):
+    latency = LatencyTracker(min_samples=5)
+    for _ in range(5):
+        latency.add(0.02)
+    server = serve((1.0, 200, 'slow'), (0, 200, 'fast'))
+    model = make_model(server, hedge=True, hedge_percentile=95, hedge_min_delay=0.05, latency=latency)
+
+    started = time.monotonic()
+    assert model.generate_content("hi").text == 'fast'
+    assert time.monotonic() - started < 0.8
+    stats = model.policy.stats()
+    assert stats["hedges"] == 1 and stats["hedge_wins"] == 1
+
+
+def test_no_hedge_until_latency_is_calibrated(serve):
+    server = serve((0.2, 200, 'ok'))
+    model = make_model(server, hedge=True, hedge_min_delay=0.01, latency=LatencyTracker(min_samples=5))
+
+    assert model.generate_content("hi").text == 'ok'
+    assert server.requests == 1
+    assert model.policy.stats()["hedges"] == 0
+
+
+def test_stream_is_retried_before_the_first_chunk(serve):
+    server = serve((0, 503, ''), (0, 200, 'a b c'))
+    model = make_model(server, attempts=2)
+
+    assert [chunk.text for chunk in model.generate_content("hi", stream=True)] == ['a', 'b', 'c']
+    assert server.requests == 2
+
+
+def test_request_timeout_is_a_deadline_for_every_attempt():
+    timeouts = []
+
+    class Failing:
+        def generate_content(self, *args, request_options=None, **kwargs):
+            timeouts.append(request_options["timeout"])
+            time.sleep(0.1)
+            raise api_exceptions.ServiceUnavailable("down")
+
+    model = ResilientModel(Failing(), ResiliencePolicy(attempts=10, base_delay=0.01, max_delay=0.01))
+    started = time.monotonic()
+    with pytest.raises(api_exceptions.ServiceUnavailable):
+        model.generate_content("hi", request_options={"timeout": 0.35})
+
+    assert time.monotonic() - started < 0.5
+    assert 2 <= len(timeouts) < 10
+    assert timeouts == sorted(timeouts, reverse=True) and timeouts[0] <= 0.35
+
+
+def test_timed_out_call_gives_back_its_governor_slot():
+    governor = CallGovernor(max_concurrent=1, queue_timeout=10)
+    model = GovernedModel(FakeModel(latency=lambda rng: 5.0), governor, 'u1')
+
+    started = time.monotonic()
+    with pytest.raises(api_exceptions.DeadlineExceeded):
+        model.generate_content("hi", request_options={"timeout": 0.2})
+    assert time.monotonic() - started < 1.0
+    assert governor.stats()["in_flight"] == 0
+
+
+def test_slot_wait_is_bounded_by_the_request_timeout():
+    governor = CallGovernor(max_concurrent=1, queue_timeout=10)
+
+    with governor.slot('u0'):
+        started = time.monotonic()
+        with pytest.raises(ModelOverloaded):
+            GovernedModel(FakeModel(), governor, 'u1').generate_content("hi", request_options={"timeout": 0.2})
+        assert time.monotonic() - started < 1.0
+    assert governor.stats()["in_flight"] == 0
+
+
+class StubApiClient:
+    """
+    Stands in for the SDK's API client under a real GenerativeModel; replies like FakeModel.
+    """
+
+    def __init__(self):
+        self.timeouts = []
+
+    def _response(self, request, timeout):
+        self.timeouts.append(timeout)
+        prompt = "\n".join(part.text for content in request.contents for part in content.parts)
+        return glm.GenerateContentResponse(candidates=[{
+            "content": {"role": "model", "parts": [{"text": FakeModel()._reply(prompt)}]},
+            "finish_reason": "STOP",
+        }])
+
+    def generate_content(self, request, timeout=None, **kwargs):
+        return self._response(request, timeout)
+
+    def stream_generate_content(self, request, timeout=None, **kwargs):
+        return iter([self._response(request, timeout)])
+
+
+@pytest.fixture
+def sdk_model(monkeypatch):
+    monkeypatch.setattr(backends, 'model_backend', GeminiBackend())
+    monkeypatch.setattr(fat_analyzer, 'response_cache', None)
+    client.reset()
+    model = client.get_model(fat_analyzer.MODEL_NAME)
+    model._client = StubApiClient()
+    yield model
+    client.reset()
+
+
+def test_sdk_model_sends_the_deadline_as_the_transport_timeout(sdk_model):
+    result = fat_analyzer.analyze_fat_percentage_with_gemini({
+        "user_id": "u1", "age": 30, "gender": "male",
+        "measurements": {"height_cm": 180, "weight_kg": 80, "waist_cm": 85, "hip_cm": 95},
+    })
+
+    assert result["eksik_bolumler"] == []
+    assert result["egzersiz_programi"] and result["diyet_listesi"]
+    timeouts = sdk_model._client.timeouts
+    assert len(timeouts) == 3
+    assert all(0 < timeout <= fat_analyzer.GEMINI_CALL_TIMEOUT for timeout in timeouts)
+
+    chunks = sdk_model.generate_content("hi", stream=True, request_options={"timeout": 5.0})
+    assert "".join(chunk.text for chunk in chunks)
+    assert sdk_model.generate_content("hi").text
+    assert sdk_model._client.timeouts[3:] == [5.0, None]
@@ -0,0 +1,131 @@
+"""
+Tests for the background token refresher in utils/token_refresh.py with fake refresh and persist callables.
+
+Run with: python -m pytest test_token_refresh.py
+"""
+
+import threading
+import time
+
+import pytest
+
+from utils.token_refresh import TokenRefreshScheduler
+
+
+class FakeTokens:
+    """
+    Records refresh and persist calls; ``outcomes[key]`` lists what successive refreshes do.
+    """
+
+    def __init__(self, outcomes=None, lifetime=3600.0):
+        self.outcomes = outcomes or {}
+        self.lifetime = lifetime
+        self.refreshes = []
+        self.batches = []
+        self.lock = threading.Lock()
+
+    def refresh(self, key, token):
+        with self.lock:
+            self.refreshes.append((key, token, time.time()))
+            outcome = self.outcomes.get(key, ['ok'])
+            action = outcome.pop(0) if len(outcome) > 1 else outcome[0]
+        if action == 'error':
+            raise ConnectionError("token endpoint unavailable")
+        if action == 'revoked':
+            return None
+        if action == 'stored':
+            return f"{token}+stored", time.time() + self.lifetime, False
+        return f"{token}+1", time.time() + self.lifetime
+
+    def persist(self, batch):
+        with self.lock:
+            self.batches.append(sorted(batch))
+
+
+def wait_for(condition, timeout=3.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+@pytest.fixture
+def schedulers():
+    started = []
+
+    def make(tokens, **kwargs):
+        kwargs.setdefault('flush_interval', 60)
+        scheduler = TokenRefreshScheduler(tokens.refresh, tokens.persist, **kwargs)
+        started.append(scheduler)
+        scheduler.start()
+        return scheduler
+
+    yield make
+    for scheduler in started:
+        scheduler.stop(timeout=2)
+
+
+def test_tokens_are_refreshed_lead_time_before_expiry(schedulers):
+    tokens = FakeTokens()
+    scheduler = schedulers(tokens, lead_time=10.0)
+    now = time.time()
+    scheduler.track('soon', 't-soon', now + 10.3)
+    scheduler.track('later', 't-later', now + 3600)
+
+    assert wait_for(lambda: tokens.refreshes)
+    key, token, refreshed_at = tokens.refreshes[0]
+    assert (key, token) == ('soon', 't-soon')
+    assert refreshed_at - now >= 0.25
+    time.sleep(0.2)
+    assert [key for key, _, _ in tokens.refreshes] == ['soon']
+    assert 3500 < scheduler.stats()["next_due_in_s"] <= 3600
+
+
+def test_failed_refresh_is_retried_and_revoked_token_dropped(schedulers):
+    tokens = FakeTokens({'flaky': ['error', 'ok'], 'revoked': ['revoked']})
+    scheduler = schedulers(tokens, retry_delay=0.2)
+    scheduler.track('flaky', 't1', None)
+    scheduler.track('revoked', 't2', None)
+
+    assert wait_for(lambda: scheduler.stats()["refreshed"] == 1 and scheduler.stats()["dropped"] == 1)
+    stats = scheduler.stats()
+    assert stats["failed"] == 1 and stats["tracked"] == 1
+    flaky = [at for key, _, at in tokens.refreshes if key == 'flaky']
+    assert len(flaky) == 2 and flaky[1] - flaky[0] >= 0.15
+
+
+def test_refreshed_tokens_are_flushed_in_batches(schedulers):
+    tokens = FakeTokens({'k2': ['stored']})
+    scheduler = schedulers(tokens, batch_size=3)
+    for i in range(5):
+        scheduler.track(f"k{i}", f"t{i}", None)
+
+    assert wait_for(lambda: scheduler.stats()["refreshed"] + scheduler.stats()["adopted"] == 5)
+    assert wait_for(lambda: len(tokens.batches) == 1)
+    assert len(tokens.batches[0]) == 3
+    assert scheduler.stats()["pending_writes"] == 1
+
+    scheduler.flush()
+    persisted = dict(token for batch in tokens.batches for token in batch)
+    # A token another process already stored is rescheduled but not written again.
+    assert sorted(persisted) == ['k0', 'k1', 'k3', 'k4']
+    assert persisted['k0'] == 't0+1'
+    assert scheduler.stats()["adopted"] == 1
+
+
+def test_only_the_lock_holder_refreshes(schedulers, tmp_path):
+    lock_path = str(tmp_path / 'refresher.lock')
+    leader_tokens, standby_tokens = FakeTokens(), FakeTokens()
+    leader = schedulers(leader_tokens, lock_path=lock_path, retry_delay=0.1)
+    assert wait_for(lambda: leader.stats()["leader"])
+    standby = schedulers(standby_tokens, lock_path=lock_path, retry_delay=0.1)
+
+    leader.track('k', 't', None)
+    standby.track('k', 't', None)
+    assert wait_for(lambda: leader_tokens.refreshes)
+    time.sleep(0.3)
+    assert standby_tokens.refreshes == [] and not standby.stats()["leader"]
+
+    leader.stop(timeout=2)
+    assert wait_for(lambda: standby_tokens.refreshes)
+    assert standby.stats()["leader"]
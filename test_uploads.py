@@ -0,0 +1,47 @@
+"""
+Tests for the upload buffers in utils/uploads.py.
+
+Run with: python -m pytest test_uploads.py
+"""
+
+import io
+import tempfile
+
+from PIL import Image
+
+from utils.images import ImagePreprocessor, perceptual_hash
+from utils.uploads import BufferReader, image_buffer
+
+
+def jpeg_bytes(size=(64, 48)):
+    buffer = io.BytesIO()
+    Image.new('RGB', size, (200, 120, 40)).save(buffer, format='JPEG')
+    return buffer.getvalue()
+
+
+def test_spilled_upload_is_mapped_not_read_back():
+    data = jpeg_bytes()
+    with tempfile.TemporaryFile('wb+') as upload:
+        upload.write(data)
+        with image_buffer(upload) as image:
+            assert image.readonly and image.obj is not None and not isinstance(image.obj, bytes)
+            assert image == data
+            assert perceptual_hash(image) == perceptual_hash(data)
+
+    with tempfile.TemporaryFile('wb+') as empty:
+        assert len(image_buffer(empty)) == 0
+
+
+def test_buffer_reader_serves_pillow_from_the_view():
+    data = jpeg_bytes((3000, 200))
+    reader = BufferReader(memoryview(data))
+    assert reader.read(3) == data[:3]
+    assert reader.seek(-2, io.SEEK_END) == len(data) - 2
+    chunk = bytearray(8)
+    assert reader.readinto(chunk) == 2 and bytes(chunk[:2]) == data[-2:]
+    assert reader.read() == b''
+
+    encoded, mime_type = ImagePreprocessor(max_edge=100, max_workers=1).prepare(memoryview(data), 'image/jpeg')
+    assert isinstance(encoded, bytes) and mime_type == 'image/webp'
+    with Image.open(io.BytesIO(encoded)) as decoded:
+        assert max(decoded.size) == 100
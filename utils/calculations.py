@@ -6,10 +6,35 @@ Provides functions to compute health-related metrics:
 - Waist-to-Hip Ratio (WHR)
 - Body fat percentage using the U.S. Navy method
 - Aggregation of all available metrics
+- Vectorized batch versions of the above for many measurement sets at once
 """
 
 import math
 
+import numpy as np
+
+GENDER_ALIASES = {
+    'male': 'male',
+    'erkek': 'male',
+    'female': 'female',
+    'kadın': 'female',
+    'kadin': 'female',
+}
+
+def normalize_gender(gender):
+    """
+    Maps a stored gender label, including the Turkish "Erkek"/"Kadın" sent by the client, to "male"/"female".
+
+    Args:
+        gender (str): Gender label in any case
+
+    Returns:
+        str: "male" or "female", or None if the label is not recognized
+    """
+    if not isinstance(gender, str):
+        return None
+    return GENDER_ALIASES.get(gender.strip().lower())
+
 def calculate_bmi(weight_kg, height_cm):
     """
     Calculates Body Mass Index (BMI).
@@ -48,7 +73,7 @@ def calculate_body_fat_navy(gender, height_cm, neck_cm, waist_cm, hip_cm=None):
     Estimates body fat percentage using the U.S. Navy method.
 
     Args:
-        gender (str): "male" or "female"
+        gender (str): "male" or "female" (Turkish "Erkek"/"Kadın" also accepted)
         height_cm (float): Height in centimeters
         neck_cm (float): Neck circumference in centimeters
         waist_cm (float): Waist circumference in centimeters
@@ -62,7 +87,7 @@ def calculate_body_fat_navy(gender, height_cm, neck_cm, waist_cm, hip_cm=None):
     if height_cm <= 0 or neck_cm <= 0 or waist_cm <= 0:
         return None
 
-    gender = gender.lower()
+    gender = normalize_gender(gender)
 
     if gender == "male":
         if waist_cm <= neck_cm:
@@ -98,7 +123,7 @@ def calculate_all_metrics(measurements, gender=None):
             - waist_cm (float)
             - hip_cm (float)
             - neck_cm (float)
-        gender (str, optional): "male" or "female" to enable body fat calculation
+        gender (str, optional): "male"/"female" (or "Erkek"/"Kadın") to enable body fat calculation
 
     Returns:
         dict: Keys may include 'bmi', 'whr', and 'bfp_from_measurements_navy'
@@ -128,9 +153,129 @@ def calculate_all_metrics(measurements, gender=None):
             measurements.get('height_cm'),
             measurements.get('neck_cm'),
             measurements.get('waist_cm'),
-            measurements.get('hip_cm') if gender.lower() == 'female' else None
+            measurements.get('hip_cm') if normalize_gender(gender) == 'female' else None
         )
         if bfp_navy is not None:
             calculated_metrics['bfp_from_measurements_navy'] = bfp_navy
 
     return calculated_metrics
+
+
+def _as_float_array(values):
+    """
+    Convert a sequence (None allowed) to a float64 array with NaN for missing values.
+    """
+    return np.asarray(values, dtype=float)
+
+
+def _valid(*arrays):
+    """
+    Element-wise mask matching the scalar checks: present, non-zero and positive.
+    """
+    mask = np.ones(arrays[0].shape, dtype=bool)
+    for arr in arrays:
+        mask &= np.isfinite(arr) & (arr > 0)
+    return mask
+
+
+def _near_rounding_tie(values):
+    """
+    Indices whose second decimal sits on a rounding tie, where numpy.round and round() may disagree.
+    """
+    scaled = values * 100
+    return np.flatnonzero(np.isfinite(values) & (np.abs(scaled - np.floor(scaled) - 0.5) < 1e-6))
+
+
+def calculate_metrics_batch(weight_kg, height_cm, waist_cm, hip_cm, neck_cm, genders=None):
+    """
+    Calculates BMI, WHR and Navy body fat for many measurement sets in one pass.
+
+    Each argument is a sequence with one element per measurement set; None
+    marks a missing value. An output element is NaN exactly where the scalar
+    function would return None.
+
+    Args:
+        weight_kg, height_cm, waist_cm, hip_cm, neck_cm (sequence of float): Measurement columns
+        genders (sequence of str, optional): Gender label per row (see normalize_gender);
+            unrecognized labels skip body fat
+
+    Returns:
+        dict: 'bmi', 'whr' and 'bfp_from_measurements_navy' float64 arrays rounded to two decimals
+    """
+    weight = _as_float_array(weight_kg)
+    height = _as_float_array(height_cm)
+    waist = _as_float_array(waist_cm)
+    hip = _as_float_array(hip_cm)
+    neck = _as_float_array(neck_cm)
+    n = weight.shape[0]
+
+    if genders is None:
+        gender = np.full(n, '', dtype=object)
+    else:
+        labels = {g: normalize_gender(g) or '' for g in set(genders) if isinstance(g, str)}
+        gender = np.asarray([labels.get(g, '') if isinstance(g, str) else '' for g in genders], dtype=object)
+    is_male = gender == 'male'
+    is_female = gender == 'female'
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        height_m = height / 100
+        bmi = np.where(_valid(weight, height), weight / (height_m * height_m), np.nan)
+        whr = np.where(_valid(waist, hip), waist / hip, np.nan)
+
+        base_ok = _valid(height, neck, waist)
+        male_ok = base_ok & is_male & (waist > neck)
+        female_ok = base_ok & is_female & _valid(hip) & ((waist + hip) > neck)
+        male_bfp = 86.010 * np.log10(waist - neck) - 70.041 * np.log10(height) + 36.76
+        female_bfp = 163.205 * np.log10(waist + hip - neck) - 97.684 * np.log10(height) - 78.387
+        bfp = np.where(male_ok, male_bfp, np.where(female_ok, female_bfp, np.nan))
+        bfp = np.where(bfp > 0, bfp, np.nan)
+
+    # numpy.round scales by 100 and rounds half to even, which can differ from
+    # round() on values like 1.075; recompute those few rows with the scalar
+    # functions so batch results always equal the per-dict path.
+    bmi_ties, whr_ties, bfp_ties = _near_rounding_tie(bmi), _near_rounding_tie(whr), _near_rounding_tie(bfp)
+    bmi, whr, bfp = np.round(bmi, 2), np.round(whr, 2), np.round(bfp, 2)
+    for i in bmi_ties:
+        bmi[i] = calculate_bmi(float(weight[i]), float(height[i]))
+    for i in whr_ties:
+        whr[i] = calculate_whr(float(waist[i]), float(hip[i]))
+    for i in bfp_ties:
+        value = calculate_body_fat_navy(
+            gender[i], float(height[i]), float(neck[i]), float(waist[i]),
+            float(hip[i]) if is_female[i] else None
+        )
+        bfp[i] = np.nan if value is None else value
+
+    return {'bmi': bmi, 'whr': whr, 'bfp_from_measurements_navy': bfp}
+
+
+def calculate_all_metrics_batch(measurements_list, genders=None):
+    """
+    Batch equivalent of calculate_all_metrics over a list of measurement dicts.
+
+    Args:
+        measurements_list (list of dict): Measurement dicts as accepted by calculate_all_metrics
+        genders (sequence of str, optional): Gender per measurement dict
+
+    Returns:
+        list of dict: One metrics dict per input, with the same keys calculate_all_metrics would set
+    """
+    if not measurements_list:
+        return []
+    rows = [m or {} for m in measurements_list]
+
+    columns = {
+        key: [row.get(key) for row in rows]
+        for key in ('weight_kg', 'height_cm', 'waist_cm', 'hip_cm', 'neck_cm')
+    }
+    metrics = calculate_metrics_batch(
+        columns['weight_kg'], columns['height_cm'], columns['waist_cm'],
+        columns['hip_cm'], columns['neck_cm'], genders
+    )
+
+    keys = ('bmi', 'whr', 'bfp_from_measurements_navy')
+    value_lists = [metrics[key].tolist() for key in keys]
+    return [
+        {key: value for key, value in zip(keys, values) if value == value}
+        for values in zip(*value_lists)
+    ]
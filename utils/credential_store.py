@@ -0,0 +1,334 @@
+"""
+utils/credential_store.py
+
+Encrypted OAuth credential storage, kept apart from user profiles.
+
+All users' credentials live in one append-only log. Each record is a small
+header (CRC-32, user id length, payload length), the user id and the
+credentials as a Fernet token, so saving a refreshed token appends a few
+hundred bytes instead of rewriting a profile. An empty payload marks a
+deleted user. An in-memory index maps each user id to its latest record;
+other processes' appends are picked up by scanning only the log's new tail.
+
+Writers append under an inter-process file lock. Once superseded records
+make up more than half of the log it is compacted: the live records are
+re-encrypted with the current key into a new file that replaces the log.
+
+The key must not live next to the log, or a copy of the data folder is
+enough to decrypt every token. It comes from CREDENTIAL_STORE_KEY, which is
+required when FLASK_ENV=production; elsewhere a key file is created at
+CREDENTIAL_STORE_KEY_PATH, by default in the user's config directory.
+"""
+
+import contextlib
+import json
+import logging
+import os
+import struct
+import tempfile
+import threading
+import zlib
+
+from cryptography.fernet import Fernet, InvalidToken, MultiFernet
+from dotenv import load_dotenv
+
+from utils.profile_store import file_lock
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+HEADER = struct.Struct('<IHI')  # crc32 of user id + payload, user id length, payload length
+
+COMPACT_MIN_BYTES = int(os.getenv('CREDENTIAL_STORE_COMPACT_MIN_BYTES', str(64 * 1024)))
+COMPACT_RATIO = float(os.getenv('CREDENTIAL_STORE_COMPACT_RATIO', '0.5'))
+
+
+def default_key_path():
+    """
+    Return CREDENTIAL_STORE_KEY_PATH, or ``credential_store.key`` in the user's config directory.
+    """
+    configured = os.getenv('CREDENTIAL_STORE_KEY_PATH')
+    if configured:
+        return configured
+    config_home = os.getenv('XDG_CONFIG_HOME') or os.path.join(os.path.expanduser('~'), '.config')
+    return os.path.join(config_home, 'fitalyze', 'credential_store.key')
+
+
+def load_keys(key_path, legacy_key_path=None):
+    """
+    Return the Fernet keys from CREDENTIAL_STORE_KEY, or from ``key_path``, creating it on first use.
+
+    CREDENTIAL_STORE_KEY may list several comma-separated keys: the first
+    encrypts, the rest can still decrypt, and compaction re-encrypts old
+    records with the first key.
+
+    Args:
+        key_path (str): Key file used when CREDENTIAL_STORE_KEY is not set.
+        legacy_key_path (str, optional): Key file an older version created next to the log;
+            used, with a warning, while ``key_path`` does not exist yet.
+
+    Raises:
+        ValueError: If CREDENTIAL_STORE_KEY is not set and FLASK_ENV is 'production'.
+    """
+    configured = os.getenv('CREDENTIAL_STORE_KEY')
+    if configured:
+        return [key.strip().encode() for key in configured.split(',') if key.strip()]
+    if os.getenv('FLASK_ENV') == 'production':
+        raise ValueError("CREDENTIAL_STORE_KEY must be set in production")
+
+    if legacy_key_path and not os.path.exists(key_path) and os.path.exists(legacy_key_path):
+        logger.warning("Credential store key %s sits next to the log; move it to %s or set CREDENTIAL_STORE_KEY",
+                       legacy_key_path, key_path)
+        key_path = legacy_key_path
+    os.makedirs(os.path.dirname(os.path.abspath(key_path)), mode=0o700, exist_ok=True)
+    with file_lock(key_path + '.lock'):
+        if not os.path.exists(key_path):
+            fd = os.open(key_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+            with os.fdopen(fd, 'wb') as f:
+                f.write(Fernet.generate_key())
+                f.flush()
+                os.fsync(f.fileno())
+    with open(key_path, 'rb') as f:
+        return [f.read().strip()]
+
+
+def _encode(user_id, payload):
+    uid = user_id.encode('utf-8')
+    return HEADER.pack(zlib.crc32(uid + payload), len(uid), len(payload)) + uid + payload
+
+
+class CredentialStore:
+    """
+    Append-only log of encrypted per-user credentials at ``path``, with an in-memory index.
+    """
+
+    def __init__(self, path, keys, compact_min_bytes=COMPACT_MIN_BYTES, compact_ratio=COMPACT_RATIO):
+        """
+        Args:
+            path (str): Log file path; created on the first write.
+            keys (list): Fernet keys, the first of which encrypts.
+            compact_min_bytes (int): Log size below which compaction is never attempted.
+            compact_ratio (float): Share of dead bytes above which the log is compacted.
+        """
+        self.path = path
+        self.lock_path = path + '.lock'
+        self.compact_min_bytes = compact_min_bytes
+        self.compact_ratio = compact_ratio
+        self._fernet = MultiFernet([Fernet(key) for key in keys])
+        self._lock = threading.RLock()
+        # user id -> (record offset, record length) of its latest record
+        self._index = {}
+        self._live_bytes = 0
+        self._end = 0
+        self._file_id = None
+        self.appends = 0
+        self.compactions = 0
+
+    def _reset(self, file_id=None):
+        self._index, self._live_bytes, self._end, self._file_id = {}, 0, 0, file_id
+
+    def _sync(self):
+        """
+        Bring the index up to date with the log: scan new records, or rebuild after a compaction replaced the file.
+        """
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            self._reset()
+            return
+        file_id = (st.st_dev, st.st_ino)
+        if file_id != self._file_id or st.st_size < self._end:
+            self._reset(file_id)
+        if st.st_size > self._end:
+            with open(self.path, 'rb') as f:
+                self._scan(f, st.st_size)
+
+    def _scan(self, f, size):
+        """
+        Index records from ``self._end`` up to ``size``, stopping at a torn or corrupt tail.
+        """
+        f.seek(self._end)
+        data = f.read(size - self._end)
+        position = 0
+        while position + HEADER.size <= len(data):
+            crc, uid_length, payload_length = HEADER.unpack_from(data, position)
+            length = HEADER.size + uid_length + payload_length
+            body = data[position + HEADER.size:position + length]
+            if len(body) < uid_length + payload_length or zlib.crc32(body) != crc:
+                break
+            user_id = body[:uid_length].decode('utf-8')
+            previous = self._index.pop(user_id, None)
+            if previous is not None:
+                self._live_bytes -= previous[1]
+            if payload_length:
+                self._index[user_id] = (self._end + position, length)
+                self._live_bytes += length
+            position += length
+        self._end += position
+
+    def _read(self, user_id, offset, length):
+        """
+        Return the payload of the record at ``offset``, or None if the file no longer holds it there.
+        """
+        try:
+            with open(self.path, 'rb') as f:
+                f.seek(offset)
+                record = f.read(length)
+        except FileNotFoundError:
+            return None
+        if len(record) != length:
+            return None
+        crc, uid_length, _ = HEADER.unpack_from(record)
+        body = record[HEADER.size:]
+        if zlib.crc32(body) != crc or body[:uid_length].decode('utf-8', 'replace') != user_id:
+            return None
+        return body[uid_length:]
+
+    def get(self, user_id):
+        """
+        Return the user's stored credentials as a dict, or None.
+
+        Raises:
+            ValueError: If the record cannot be decrypted with the configured keys.
+        """
+        with self._lock:
+            for _ in range(2):
+                self._sync()
+                entry = self._index.get(user_id)
+                if entry is None:
+                    return None
+                payload = self._read(user_id, *entry)
+                if payload is not None:
+                    break
+                # Compacted by another process between the stat and the read.
+                self._reset()
+            else:
+                return None
+        try:
+            return json.loads(self._fernet.decrypt(payload))
+        except InvalidToken:
+            raise ValueError(f"Stored credentials for {user_id} cannot be decrypted with CREDENTIAL_STORE_KEY")
+
+    def put(self, user_id, credentials):
+        """
+        Store the user's credentials, replacing any earlier ones.
+        """
+        self.put_many([(user_id, credentials)])
+
+    def delete(self, user_id):
+        """
+        Remove the user's credentials.
+        """
+        self.put_many([(user_id, None)])
+
+    def put_many(self, items):
+        """
+        Append ``[(user id, credentials dict or None to delete), ...]`` in a single write.
+        """
+        records = []
+        for user_id, credentials in items:
+            payload = b'' if credentials is None else self._fernet.encrypt(json.dumps(credentials).encode())
+            records.append(_encode(user_id, payload))
+        if not records:
+            return
+
+        with self._lock, file_lock(self.lock_path):
+            self._sync()
+            with open(self.path, 'ab') as f:
+                if f.tell() != self._end:
+                    # Drop a torn record left by a crash mid-write.
+                    f.truncate(self._end)
+                    f.seek(self._end)
+                f.write(b''.join(records))
+                f.flush()
+                os.fsync(f.fileno())
+            if self._file_id is None:
+                st = os.stat(self.path)
+                self._file_id = (st.st_dev, st.st_ino)
+            self.appends += len(records)
+            with open(self.path, 'rb') as f:
+                self._scan(f, os.fstat(f.fileno()).st_size)
+            if self._end >= self.compact_min_bytes and self._live_bytes < self._end * (1 - self.compact_ratio):
+                self._compact()
+
+    def compact(self):
+        """
+        Rewrite the log with only each user's latest record, re-encrypted with the current key.
+        """
+        with self._lock, file_lock(self.lock_path):
+            self._sync()
+            self._compact()
+
+    def _compact(self):
+        live = []
+        with open(self.path, 'rb') as f:
+            for user_id, (offset, length) in sorted(self._index.items(), key=lambda item: item[1][0]):
+                f.seek(offset)
+                record = f.read(length)
+                uid_length = HEADER.unpack_from(record)[1]
+                live.append((user_id, record[HEADER.size + uid_length:]))
+
+        folder = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(dir=folder, prefix='.tmp-', suffix='.log')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(b''.join(_encode(user_id, self._fernet.rotate(payload)) for user_id, payload in live))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            with contextlib.suppress(OSError):
+                os.unlink(tmp_path)
+            raise
+        self._reset()
+        self._sync()
+        self.compactions += 1
+
+    def user_ids(self):
+        """
+        Return the ids of all users with stored credentials.
+        """
+        with self._lock:
+            self._sync()
+            return sorted(self._index)
+
+    def stats(self):
+        """
+        Return user count, log size, live share of the log and write counters.
+        """
+        with self._lock:
+            self._sync()
+            return {
+                "users": len(self._index),
+                "log_bytes": self._end,
+                "live_ratio": round(self._live_bytes / self._end, 4) if self._end else 1.0,
+                "appends": self.appends,
+                "compactions": self.compactions,
+            }
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_credential_store(folder):
+    """
+    Return the process-wide credential store for ``folder``, creating it on first use.
+
+    The log is CREDENTIAL_STORE_PATH if set, otherwise ``folder/google_credentials.log``;
+    the key comes from CREDENTIAL_STORE_KEY or the file at ``default_key_path()``.
+
+    Raises:
+        ValueError: If CREDENTIAL_STORE_KEY is required but not set (see ``load_keys``).
+    """
+    key = os.path.abspath(folder)
+    store = _stores.get(key)
+    if store is None:
+        with _stores_lock:
+            store = _stores.get(key)
+            if store is None:
+                os.makedirs(folder, exist_ok=True)
+                path = os.getenv('CREDENTIAL_STORE_PATH') or os.path.join(folder, 'google_credentials.log')
+                store = _stores[key] = CredentialStore(path, load_keys(default_key_path(), path + '.key'))
+    return store
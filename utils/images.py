@@ -0,0 +1,194 @@
+"""
+utils/images.py
+
+Downscaling and re-encoding of user photos before they are sent to Gemini.
+
+Phone photos are often several megabytes at full resolution, far more than
+the model needs to estimate body fat. ``ImagePreprocessor`` applies the EXIF
+orientation, strips the metadata, shrinks the long edge to IMAGE_MAX_EDGE and
+re-encodes to IMAGE_FORMAT on a small thread pool (Pillow releases the GIL
+while decoding, resizing and encoding), and counts the bytes saved.
+``perceptual_hash`` fingerprints a photo for near-duplicate detection.
+"""
+
+import io
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from dotenv import load_dotenv
+from PIL import Image, ImageOps
+
+from utils.uploads import BufferReader
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# format name -> (Pillow encoder, MIME type)
+_FORMATS = {
+    'webp': ('WEBP', 'image/webp'),
+    'jpeg': ('JPEG', 'image/jpeg'),
+}
+
+
+def perceptual_hash(data, hash_size=8):
+    """
+    Compute a difference hash (dHash) of an image.
+
+    The orientation-corrected image is reduced to a (hash_size + 1) x
+    hash_size grayscale grid and each bit records whether a pixel is
+    brighter than its right-hand neighbour, so re-encoding, rescaling or
+    small edits flip only a few bits.
+
+    Args:
+        data (bytes-like): Image bytes.
+        hash_size (int): Grid height; the hash has hash_size ** 2 bits.
+
+    Returns:
+        int or None: The hash, or None if the image cannot be decoded.
+    """
+    try:
+        with Image.open(BufferReader(data)) as image:
+            image.draft('L', (hash_size * 8, hash_size * 8))
+            image = ImageOps.exif_transpose(image).convert('L')
+        pixels = image.resize((hash_size + 1, hash_size), Image.Resampling.BOX).tobytes()
+    except (OSError, ValueError, Image.DecompressionBombError) as e:
+        logger.warning("Could not hash image: %s", e)
+        return None
+
+    value = 0
+    for row in range(hash_size):
+        start = row * (hash_size + 1)
+        for col in range(start, start + hash_size):
+            value = (value << 1) | (pixels[col] > pixels[col + 1])
+    return value
+
+
+class ImagePreprocessor:
+    """
+    Thread-pooled photo normalizer with byte counters.
+    """
+
+    def __init__(self, max_edge=1536, output_format='webp', quality=80, max_workers=4):
+        """
+        Args:
+            max_edge (int): Longest side of the output image in pixels.
+            output_format (str): 'webp' or 'jpeg'.
+            quality (int): Encoder quality, 1-100.
+            max_workers (int): Threads used by ``submit``.
+
+        Raises:
+            ValueError: If the output format is unknown.
+        """
+        if output_format not in _FORMATS:
+            raise ValueError(f"Unknown IMAGE_FORMAT: {output_format}")
+        self.max_edge = max_edge
+        self.encoder, self.mime_type = _FORMATS[output_format]
+        self.quality = quality
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='image')
+        self._lock = threading.Lock()
+        self.processed = 0
+        self.failed = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def _encode(self, data):
+        """
+        Decode, orient, downscale and re-encode ``data``.
+
+        Returns:
+            tuple: (encoded bytes, True if the image had to change regardless of size)
+        """
+        with Image.open(BufferReader(data)) as image:
+            # For JPEG, let the decoder skip detail beyond the target size.
+            image.draft('RGB', (self.max_edge, self.max_edge))
+            had_metadata = bool(image.info.get('exif') or image.getexif())
+            oriented = ImageOps.exif_transpose(image)
+
+        if oriented.mode not in ('RGB', 'L'):
+            oriented = oriented.convert('RGB')
+        resized = max(oriented.size) > self.max_edge
+        if resized:
+            oriented.thumbnail((self.max_edge, self.max_edge), Image.Resampling.LANCZOS, reducing_gap=3.0)
+
+        buffer = io.BytesIO()
+        oriented.save(buffer, format=self.encoder, quality=self.quality)
+        return buffer.getvalue(), resized or had_metadata
+
+    def prepare(self, data, mime_type=None):
+        """
+        Normalize one photo.
+
+        The original is kept when re-encoding would not shrink an image that
+        needs no rotation, resizing or metadata removal, and when it cannot
+        be decoded (the model is then asked to handle it as uploaded).
+
+        Args:
+            data (bytes-like): Photo bytes.
+            mime_type (str, optional): MIME type of ``data``.
+
+        Returns:
+            tuple: (bytes-like image data, MIME type)
+        """
+        size = len(data)
+        try:
+            encoded, must_change = self._encode(data)
+        except (OSError, ValueError, Image.DecompressionBombError) as e:
+            logger.warning("Image preprocessing failed, sending original (%d bytes): %s", size, e)
+            with self._lock:
+                self.failed += 1
+                self.bytes_in += size
+                self.bytes_out += size
+            return data, mime_type
+
+        if not must_change and len(encoded) >= size:
+            encoded, out_mime = data, mime_type
+        else:
+            out_mime = self.mime_type
+        with self._lock:
+            self.processed += 1
+            self.bytes_in += size
+            self.bytes_out += len(encoded)
+        logger.info("Image preprocessed: %d -> %d bytes (%d saved)", size, len(encoded), size - len(encoded))
+        return encoded, out_mime
+
+    def submit(self, data, mime_type=None):
+        """
+        Run ``prepare`` on the pool and return its Future.
+        """
+        return self._executor.submit(self.prepare, data, mime_type)
+
+    def stats(self):
+        """
+        Return processed/failed counts and the bytes received, sent and saved.
+        """
+        with self._lock:
+            return {
+                "processed": self.processed,
+                "failed": self.failed,
+                "bytes_in": self.bytes_in,
+                "bytes_out": self.bytes_out,
+                "bytes_saved": self.bytes_in - self.bytes_out,
+            }
+
+
+def create_image_preprocessor():
+    """
+    Build the preprocessor described by the IMAGE_* environment variables.
+
+    Returns:
+        ImagePreprocessor or None: None when IMAGE_PREPROCESS is disabled.
+    """
+    if os.getenv('IMAGE_PREPROCESS', 'true').lower() not in ('1', 'true', 'yes'):
+        return None
+    return ImagePreprocessor(
+        max_edge=int(os.getenv('IMAGE_MAX_EDGE', '1536')),
+        output_format=os.getenv('IMAGE_FORMAT', 'webp').lower(),
+        quality=int(os.getenv('IMAGE_QUALITY', '80')),
+        max_workers=int(os.getenv('IMAGE_WORKERS', '4')),
+    )
+
+
+image_preprocessor = create_image_preprocessor()
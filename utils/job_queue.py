@@ -0,0 +1,313 @@
+"""
+utils/job_queue.py
+
+Persistent background job queue backed by sqlite.
+
+Jobs are recorded in a sqlite table and their input file is spooled to disk,
+so queued or interrupted jobs survive a restart and are picked up again by
+``recover``. Work runs on a bounded thread pool; a job is claimed with an
+atomic status update so several worker processes can share one database.
+
+Once ``start``ed, a maintenance thread refreshes the heartbeat of the jobs
+this process is running, periodically re-queues jobs whose process stopped
+heart-beating, and deletes finished jobs older than the retention period.
+"""
+
+import datetime
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+STATUS_QUEUED = "queued"
+STATUS_RUNNING = "running"
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+
+
+class QueueFullError(Exception):
+    """
+    Raised when the number of pending jobs has reached the configured limit.
+    """
+
+
+def _utcnow():
+    return datetime.datetime.utcnow().isoformat() + "Z"
+
+
+class JobQueue:
+    """
+    Bounded worker pool whose jobs are persisted in sqlite.
+    """
+
+    def __init__(self, db_path, spool_dir, handler, max_workers=4, max_pending=100, stale_after_seconds=120,
+                 heartbeat_seconds=30, recover_interval=60, retention_seconds=7 * 24 * 3600):
+        """
+        Args:
+            db_path (str): Path of the sqlite database file.
+            spool_dir (str): Directory where job input files are kept until completion.
+            handler (callable): ``handler(user_id, input_path) -> dict`` run for each job.
+            max_workers (int): Number of jobs processed concurrently.
+            max_pending (int): Maximum queued + running jobs before submissions are refused.
+            stale_after_seconds (float): Age of the last heartbeat after which a 'running'
+                job is considered abandoned by a dead process and re-queued by ``recover``.
+            heartbeat_seconds (float): Interval at which running jobs' heartbeats are refreshed;
+                must be well below ``stale_after_seconds``.
+            recover_interval (float): Interval at which the maintenance thread calls ``recover``
+                and ``purge``.
+            retention_seconds (float): Age after which finished jobs are deleted by ``purge``;
+                0 keeps them forever.
+        """
+        if heartbeat_seconds >= stale_after_seconds:
+            raise ValueError("heartbeat_seconds must be smaller than stale_after_seconds")
+        self.db_path = db_path
+        self.spool_dir = spool_dir
+        self.handler = handler
+        self.max_pending = max_pending
+        self.stale_after_seconds = stale_after_seconds
+        self.heartbeat_seconds = heartbeat_seconds
+        self.recover_interval = recover_interval
+        self.retention_seconds = retention_seconds
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='job')
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        # Jobs handed to the pool but not yet finished, so recover does not schedule them twice.
+        self._scheduled = set()
+        self._running = set()
+        self._stop = threading.Event()
+        self._thread = None
+
+        os.makedirs(spool_dir, exist_ok=True)
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        self._conn().executescript(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id TEXT PRIMARY KEY,"
+            " user_id TEXT NOT NULL,"
+            " status TEXT NOT NULL,"
+            " input_path TEXT,"
+            " result TEXT,"
+            " error TEXT,"
+            " created_at TEXT NOT NULL,"
+            " updated_at TEXT NOT NULL,"
+            " heartbeat REAL NOT NULL);"
+            "CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status);"
+            "CREATE INDEX IF NOT EXISTS jobs_status_updated ON jobs (status, updated_at);"
+        )
+
+    def _conn(self):
+        """
+        Return this thread's sqlite connection, opening it on first use.
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def pending_count(self):
+        """
+        Return the number of queued or running jobs.
+        """
+        return self._conn().execute(
+            "SELECT COUNT(*) FROM jobs WHERE status IN (?, ?)", (STATUS_QUEUED, STATUS_RUNNING)
+        ).fetchone()[0]
+
+    def submit(self, user_id, source, suffix=''):
+        """
+        Persist a new job and schedule it on the worker pool.
+
+        Args:
+            user_id (str): Owner of the job.
+            source: Path of the input file, or a file-like object to copy from.
+            suffix (str): Extension for the spooled input file.
+
+        Returns:
+            str: The new job id.
+
+        Raises:
+            QueueFullError: If ``max_pending`` jobs are already waiting.
+        """
+        if self.pending_count() >= self.max_pending:
+            raise QueueFullError(f"Job queue is full ({self.max_pending} pending jobs)")
+
+        job_id = uuid.uuid4().hex
+        input_path = os.path.join(self.spool_dir, f"{job_id}{suffix}")
+        if isinstance(source, str):
+            shutil.copyfile(source, input_path)
+        else:
+            with open(input_path, 'wb') as f:
+                shutil.copyfileobj(source, f)
+
+        now = _utcnow()
+        self._conn().execute(
+            "INSERT INTO jobs (id, user_id, status, input_path, created_at, updated_at, heartbeat)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (job_id, user_id, STATUS_QUEUED, input_path, now, now, time.time()),
+        )
+        self._schedule(job_id)
+        return job_id
+
+    def _schedule(self, job_id):
+        """
+        Hand a job to the worker pool unless this process already has it.
+        """
+        with self._lock:
+            if job_id in self._scheduled:
+                return False
+            self._scheduled.add(job_id)
+        self._executor.submit(self._run, job_id)
+        return True
+
+    def get(self, job_id):
+        """
+        Return the job record as a dict (result decoded), or None if unknown.
+        """
+        row = self._conn().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job.pop('input_path', None)
+        job.pop('heartbeat', None)
+        job['result'] = json.loads(job['result']) if job['result'] else None
+        return job
+
+    def recover(self):
+        """
+        Re-schedule jobs left queued, or running in a process that has gone away.
+
+        Returns:
+            int: Number of jobs scheduled.
+        """
+        conn = self._conn()
+        conn.execute(
+            "UPDATE jobs SET status = ?, updated_at = ? WHERE status = ? AND heartbeat < ?",
+            (STATUS_QUEUED, _utcnow(), STATUS_RUNNING, time.time() - self.stale_after_seconds),
+        )
+        job_ids = [row[0] for row in conn.execute(
+            "SELECT id FROM jobs WHERE status = ? ORDER BY created_at", (STATUS_QUEUED,)
+        )]
+        return sum(1 for job_id in job_ids if self._schedule(job_id))
+
+    def heartbeat(self):
+        """
+        Refresh the heartbeat of the jobs this process is running.
+
+        Returns:
+            int: Number of jobs whose heartbeat was refreshed.
+        """
+        with self._lock:
+            job_ids = list(self._running)
+        if not job_ids:
+            return 0
+        cursor = self._conn().execute(
+            f"UPDATE jobs SET heartbeat = ? WHERE status = ? AND id IN ({', '.join('?' * len(job_ids))})",
+            (time.time(), STATUS_RUNNING, *job_ids),
+        )
+        return cursor.rowcount
+
+    def purge(self, older_than_seconds=None):
+        """
+        Delete finished jobs last updated more than ``older_than_seconds`` (default ``retention_seconds``) ago.
+
+        Returns:
+            int: Number of jobs deleted.
+        """
+        if older_than_seconds is None:
+            older_than_seconds = self.retention_seconds
+        if not older_than_seconds:
+            return 0
+        cutoff = (datetime.datetime.utcnow() - datetime.timedelta(seconds=older_than_seconds)).isoformat() + "Z"
+        cursor = self._conn().execute(
+            "DELETE FROM jobs WHERE status IN (?, ?) AND updated_at < ?", (STATUS_DONE, STATUS_FAILED, cutoff)
+        )
+        return cursor.rowcount
+
+    def start(self):
+        """
+        Recover left-over jobs and start the maintenance thread (heartbeats, periodic recover and purge).
+        """
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._maintain, name='job-maintenance', daemon=True)
+        self.recover()
+        self._thread.start()
+
+    def _maintain(self):
+        next_recover = time.monotonic() + self.recover_interval
+        while not self._stop.wait(self.heartbeat_seconds):
+            try:
+                self.heartbeat()
+                if time.monotonic() >= next_recover:
+                    next_recover = time.monotonic() + self.recover_interval
+                    self.recover()
+                    self.purge()
+            except sqlite3.Error as e:
+                logger.error("Job queue maintenance failed: %s", e)
+
+    def _claim(self, job_id):
+        """
+        Atomically move a queued job to running. Returns its row, or None if another worker took it.
+        """
+        conn = self._conn()
+        cursor = conn.execute(
+            "UPDATE jobs SET status = ?, updated_at = ?, heartbeat = ? WHERE id = ? AND status = ?",
+            (STATUS_RUNNING, _utcnow(), time.time(), job_id, STATUS_QUEUED),
+        )
+        if cursor.rowcount != 1:
+            return None
+        return conn.execute("SELECT user_id, input_path FROM jobs WHERE id = ?", (job_id,)).fetchone()
+
+    def _finish(self, job_id, status, result=None, error=None):
+        self._conn().execute(
+            "UPDATE jobs SET status = ?, result = ?, error = ?, updated_at = ? WHERE id = ?",
+            (status, json.dumps(result) if result is not None else None, error, _utcnow(), job_id),
+        )
+
+    def _run(self, job_id):
+        """
+        Worker entry point: claim the job, run the handler and record the outcome.
+        """
+        try:
+            row = self._claim(job_id)
+            if row is None:
+                return
+            with self._lock:
+                self._running.add(job_id)
+        finally:
+            with self._lock:
+                self._scheduled.discard(job_id)
+        input_path = row['input_path']
+        try:
+            result = self.handler(row['user_id'], input_path)
+            self._finish(job_id, STATUS_DONE, result=result)
+        except Exception as e:
+            logger.exception("Job %s failed", job_id)
+            self._finish(job_id, STATUS_FAILED, error=str(e))
+        finally:
+            with self._lock:
+                self._running.discard(job_id)
+            try:
+                if input_path and os.path.exists(input_path):
+                    os.unlink(input_path)
+            except OSError as e:
+                logger.error("Error cleaning up job input %s: %s", input_path, e)
+
+    def shutdown(self, wait=True):
+        self._stop.set()
+        if self._thread is not None and wait:
+            self._thread.join()
+        self._thread = None
+        self._executor.shutdown(wait=wait)
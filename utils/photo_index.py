@@ -0,0 +1,123 @@
+"""
+utils/photo_index.py
+
+Per-user index of analyzed photos for skipping repeat Gemini analyses.
+
+Each analysis is stored with a 64-bit perceptual hash of the photo and the
+measurements it was run with. A new upload whose hash is within a small
+Hamming distance of an indexed photo, for the same measurements, can reuse
+that analysis instead of calling the model again.
+"""
+
+import datetime
+import json
+import os
+import sqlite3
+import threading
+
+
+def measurement_key(profile):
+    """
+    Serialize the profile fields that go into the analysis prompt.
+    """
+    measurements = profile.get('measurements') or {}
+    return json.dumps([
+        profile.get('age'),
+        profile.get('gender'),
+        measurements.get('height_cm'),
+        measurements.get('weight_kg'),
+        measurements.get('waist_cm'),
+        measurements.get('hip_cm'),
+    ])
+
+
+def hamming_distance(a, b):
+    """
+    Return the number of differing bits between two integer hashes.
+    """
+    return bin(a ^ b).count('1')
+
+
+class PhotoIndex:
+    """
+    sqlite-backed store of (user, photo hash, measurements) -> analysis result.
+    """
+
+    def __init__(self, db_path, max_per_user=20):
+        """
+        Args:
+            db_path (str): Path of the sqlite database file.
+            max_per_user (int): Most recent analyses kept per user.
+        """
+        self.db_path = db_path
+        self.max_per_user = max_per_user
+        self._local = threading.local()
+
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        self._conn().executescript(
+            "CREATE TABLE IF NOT EXISTS photos ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " user_id TEXT NOT NULL,"
+            " photo_hash TEXT NOT NULL,"
+            " measurement_key TEXT NOT NULL,"
+            " result TEXT NOT NULL,"
+            " created_at TEXT NOT NULL);"
+            "CREATE INDEX IF NOT EXISTS photos_user ON photos (user_id, measurement_key);"
+        )
+
+    def _conn(self):
+        """
+        Return this thread's sqlite connection, opening it on first use.
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def find(self, user_id, photo_hash, key, max_distance):
+        """
+        Return the closest indexed analysis for the user's photo, if close enough.
+
+        Args:
+            user_id (str): Owner of the photo.
+            photo_hash (int): Perceptual hash of the new photo.
+            key (str): ``measurement_key`` of the profile used for the analysis.
+            max_distance (int): Largest Hamming distance treated as the same photo.
+
+        Returns:
+            tuple or None: (result dict, distance), or None if nothing matches.
+        """
+        best = None
+        rows = self._conn().execute(
+            "SELECT photo_hash, result FROM photos WHERE user_id = ? AND measurement_key = ? ORDER BY id DESC",
+            (user_id, key),
+        )
+        for stored_hash, result in rows:
+            distance = hamming_distance(photo_hash, int(stored_hash, 16))
+            if distance <= max_distance and (best is None or distance < best[1]):
+                best = (result, distance)
+        if best is None:
+            return None
+        return json.loads(best[0]), best[1]
+
+    def add(self, user_id, photo_hash, key, result):
+        """
+        Index an analysis result, dropping the user's oldest entries beyond ``max_per_user``.
+        """
+        conn = self._conn()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute(
+                "INSERT INTO photos (user_id, photo_hash, measurement_key, result, created_at) VALUES (?, ?, ?, ?, ?)",
+                (user_id, f"{photo_hash:016x}", key, json.dumps(result),
+                 datetime.datetime.utcnow().isoformat() + "Z"),
+            )
+            conn.execute(
+                "DELETE FROM photos WHERE user_id = ? AND id NOT IN"
+                " (SELECT id FROM photos WHERE user_id = ? ORDER BY id DESC LIMIT ?)",
+                (user_id, user_id, self.max_per_user),
+            )
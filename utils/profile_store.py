@@ -0,0 +1,621 @@
+"""
+utils/profile_store.py
+
+Storage backends for user profiles.
+
+- JsonFileProfileStore keeps the original one-file-per-user layout under
+  USER_DATA_FOLDER.
+- SqliteProfileStore keeps each top-level profile field and each progress
+  entry in its own row of a WAL-mode sqlite database, so updating one field
+  or appending a progress entry writes a few rows instead of reserializing
+  the whole profile.
+
+Both backends expose the same interface; ``get_profile_store`` picks one
+from PROFILE_STORE_BACKEND and shares it per data folder.
+
+Every write bumps the profile's ``_version`` field. ``save`` accepts the
+version the caller loaded and raises ProfileVersionConflict if another
+writer got there first, so callers can reload and retry instead of
+silently overwriting each other.
+"""
+
+import contextlib
+import copy
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+from collections import OrderedDict
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+PROGRESS_FIELD = 'progress_history'
+VERSION_FIELD = '_version'
+
+
+class ProfileVersionConflict(Exception):
+    """
+    Raised when a save's expected version no longer matches the stored profile.
+    """
+
+    def __init__(self, user_id, expected, actual):
+        super().__init__(f"Profile for {user_id} is at version {actual}, expected {expected}")
+        self.user_id = user_id
+        self.expected = expected
+        self.actual = actual
+
+
+def safe_user_id(user_id):
+    """
+    Map a user_id to the filesystem-safe key used by every backend.
+
+    Raises:
+        ValueError: If nothing usable remains after sanitizing.
+    """
+    safe_id = "".join(c if c.isalnum() else "_" for c in str(user_id))
+    if not safe_id:
+        raise ValueError("Invalid user_id for file path generation.")
+    return safe_id
+
+
+class ProfileStore:
+    """
+    Interface shared by the profile storage backends.
+    """
+
+    def load(self, user_id):
+        """
+        Return the stored profile dict, or an empty dict if the user has none.
+        """
+        raise NotImplementedError
+
+    def save(self, user_id, data, expected_version=None):
+        """
+        Store ``data`` as the user's complete profile and return its new version.
+
+        Raises:
+            ProfileVersionConflict: If ``expected_version`` is given and differs
+                from the stored version.
+        """
+        raise NotImplementedError
+
+    def save_many(self, items):
+        """
+        Save several (user_id, data, expected_version) profiles in one batch.
+
+        Returns:
+            list: The new version for each item, or the ProfileVersionConflict
+                raised for it; conflicts do not stop the other saves.
+        """
+        results = []
+        for user_id, data, expected_version in items:
+            try:
+                results.append(self.save(user_id, data, expected_version))
+            except ProfileVersionConflict as e:
+                results.append(e)
+        return results
+
+    def update_fields(self, user_id, fields):
+        """
+        Set the given top-level fields, leaving the rest of the profile untouched. Returns the new version.
+        """
+        raise NotImplementedError
+
+    def append_progress(self, user_id, entry, fields=None, keep_last=None, merge=None):
+        """
+        Append ``entry`` to progress_history and optionally set ``fields`` in the same write.
+        With ``keep_last`` only that many of the newest entries are kept. ``merge`` maps
+        dict-valued fields to keys set inside them, leaving their other keys as stored,
+        so concurrent writers of sibling keys are not overwritten. Returns the new version.
+        """
+        raise NotImplementedError
+
+    def list_user_ids(self):
+        """
+        Return the keys of every stored profile.
+        """
+        raise NotImplementedError
+
+    def fingerprint(self, user_id):
+        """
+        Return a cheap token that changes whenever the stored profile changes, or None if it does not exist.
+        """
+        raise NotImplementedError
+
+
+@contextlib.contextmanager
+def file_lock(lock_path):
+    """
+    Hold an exclusive advisory lock on ``lock_path`` across threads and processes.
+    """
+    with open(lock_path, 'a+b') as lock_file:
+        if fcntl:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        else:
+            lock_file.seek(0)
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+            else:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def try_file_lock(lock_path):
+    """
+    Take an exclusive advisory lock on ``lock_path`` without waiting.
+
+    Returns:
+        file or None: The open lock file, which holds the lock until it is closed,
+            or None if another holder has it.
+    """
+    lock_file = open(lock_path, 'a+b')
+    try:
+        if fcntl:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            lock_file.seek(0)
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+    except OSError:
+        lock_file.close()
+        return None
+    return lock_file
+
+
+def _merged(current, values):
+    return dict(current if isinstance(current, dict) else {}, **values)
+
+
+def _check_version(user_id, stored_version, expected_version):
+    if expected_version is not None and int(expected_version) != stored_version:
+        raise ProfileVersionConflict(user_id, expected_version, stored_version)
+
+
+class JsonFileProfileStore(ProfileStore):
+    """
+    One pretty-printed JSON file per user in ``folder``.
+
+    Writes go to a temporary file that is renamed over the profile, so readers
+    never see a truncated file, and are serialized per user with an advisory
+    lock file under ``folder/.locks`` that also holds across worker processes.
+    """
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.lock_folder = os.path.join(folder, '.locks')
+        os.makedirs(self.lock_folder, exist_ok=True)
+
+    def path_for(self, user_id):
+        return os.path.join(self.folder, f"{safe_user_id(user_id)}.json")
+
+    def lock(self, user_id):
+        """
+        Hold an exclusive inter-process lock on the user's profile.
+        """
+        return file_lock(os.path.join(self.lock_folder, f"{safe_user_id(user_id)}.lock"))
+
+    def load(self, user_id):
+        path = self.path_for(user_id)
+        if not os.path.exists(path):
+            return {}
+        with open(path, 'r') as f:
+            return json.load(f)
+
+    def _write(self, user_id, data):
+        """
+        Atomically replace the profile file with ``data``.
+        """
+        path = self.path_for(user_id)
+        fd, tmp_path = tempfile.mkstemp(dir=self.folder, prefix='.tmp-', suffix='.json')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(data, f, indent=4)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+        except BaseException:
+            with contextlib.suppress(OSError):
+                os.unlink(tmp_path)
+            raise
+
+    def _modify(self, user_id, apply):
+        with self.lock(user_id):
+            profile = self.load(user_id)
+            apply(profile)
+            profile[VERSION_FIELD] = profile.get(VERSION_FIELD, 0) + 1
+            self._write(user_id, profile)
+            return profile[VERSION_FIELD]
+
+    def save(self, user_id, data, expected_version=None):
+        with self.lock(user_id):
+            stored_version = self.load(user_id).get(VERSION_FIELD, 0)
+            _check_version(user_id, stored_version, expected_version)
+            data = dict(data, **{VERSION_FIELD: stored_version + 1})
+            self._write(user_id, data)
+            return data[VERSION_FIELD]
+
+    def update_fields(self, user_id, fields):
+        return self._modify(user_id, lambda profile: profile.update(fields))
+
+    def append_progress(self, user_id, entry, fields=None, keep_last=None, merge=None):
+        def apply(profile):
+            history = profile.setdefault(PROGRESS_FIELD, [])
+            history.append(entry)
+            if keep_last is not None:
+                history[:] = history[-keep_last:] if keep_last else []
+            profile.update(fields or {})
+            for field, values in (merge or {}).items():
+                profile[field] = _merged(profile.get(field), values)
+        return self._modify(user_id, apply)
+
+    def list_user_ids(self):
+        return sorted(name[:-5] for name in os.listdir(self.folder)
+                      if name.endswith('.json') and not name.startswith('.'))
+
+    def fingerprint(self, user_id):
+        # Writes rename a fresh file into place, so the inode changes even
+        # when the mtime resolution is too coarse to tell two writes apart.
+        try:
+            st = os.stat(self.path_for(user_id))
+        except FileNotFoundError:
+            return None
+        return st.st_ino, st.st_mtime_ns, st.st_size
+
+
+class SqliteProfileStore(ProfileStore):
+    """
+    Field-per-row profile storage in a WAL-mode sqlite database.
+
+    Each write runs in a ``BEGIN IMMEDIATE`` transaction, which serializes
+    writers for the whole database across threads and processes.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._local = threading.local()
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        self._conn().executescript(
+            "CREATE TABLE IF NOT EXISTS profile_fields ("
+            " user_id TEXT NOT NULL,"
+            " field TEXT NOT NULL,"
+            " value TEXT NOT NULL,"
+            " PRIMARY KEY (user_id, field)) WITHOUT ROWID;"
+            "CREATE TABLE IF NOT EXISTS progress_entries ("
+            " user_id TEXT NOT NULL,"
+            " seq INTEGER NOT NULL,"
+            " entry TEXT NOT NULL,"
+            " PRIMARY KEY (user_id, seq)) WITHOUT ROWID;"
+        )
+
+    def _conn(self):
+        """
+        Return this thread's connection, opening it in WAL mode on first use.
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def load(self, user_id):
+        key = safe_user_id(user_id)
+        conn = self._conn()
+        profile = {
+            field: json.loads(value)
+            for field, value in conn.execute(
+                "SELECT field, value FROM profile_fields WHERE user_id = ?", (key,)
+            )
+        }
+        entries = [
+            json.loads(entry)
+            for (entry,) in conn.execute(
+                "SELECT entry FROM progress_entries WHERE user_id = ? ORDER BY seq", (key,)
+            )
+        ]
+        if entries or PROGRESS_FIELD in profile:
+            profile[PROGRESS_FIELD] = entries
+        return profile
+
+    def _write_fields(self, conn, key, fields):
+        conn.executemany(
+            "INSERT OR REPLACE INTO profile_fields (user_id, field, value) VALUES (?, ?, ?)",
+            [(key, field, json.dumps(value)) for field, value in fields.items()],
+        )
+
+    def _bump_version(self, conn, key, expected_version=None, user_id=None):
+        """
+        Check ``expected_version`` against the stored one and write the next version.
+        """
+        row = conn.execute(
+            "SELECT value FROM profile_fields WHERE user_id = ? AND field = ?", (key, VERSION_FIELD)
+        ).fetchone()
+        stored_version = json.loads(row[0]) if row else 0
+        _check_version(user_id or key, stored_version, expected_version)
+        self._write_fields(conn, key, {VERSION_FIELD: stored_version + 1})
+        return stored_version + 1
+
+    def _append_entries(self, conn, key, entries):
+        start = conn.execute(
+            "SELECT COALESCE(MAX(seq), 0) FROM progress_entries WHERE user_id = ?", (key,)
+        ).fetchone()[0]
+        conn.executemany(
+            "INSERT INTO progress_entries (user_id, seq, entry) VALUES (?, ?, ?)",
+            [(key, start + i, json.dumps(entry)) for i, entry in enumerate(entries, 1)],
+        )
+
+    def _save_rows(self, conn, user_id, data, expected_version):
+        """
+        Body of ``save``, run inside the caller's transaction.
+        """
+        key = safe_user_id(user_id)
+        data = dict(data)
+        data.pop(VERSION_FIELD, None)
+        progress = data.pop(PROGRESS_FIELD, None)
+        version = self._bump_version(conn, key, expected_version, user_id)
+        stored = dict(conn.execute(
+            "SELECT field, value FROM profile_fields WHERE user_id = ?", (key,)
+        ).fetchall())
+        serialized = {field: json.dumps(value) for field, value in data.items()}
+        changed = {f: v for f, v in serialized.items() if stored.get(f) != v}
+        removed = [f for f in stored if f not in serialized and f not in (PROGRESS_FIELD, VERSION_FIELD)]
+        conn.executemany(
+            "INSERT OR REPLACE INTO profile_fields (user_id, field, value) VALUES (?, ?, ?)",
+            [(key, f, v) for f, v in changed.items()],
+        )
+        conn.executemany(
+            "DELETE FROM profile_fields WHERE user_id = ? AND field = ?",
+            [(key, f) for f in removed],
+        )
+
+        if progress is None:
+            conn.execute("DELETE FROM progress_entries WHERE user_id = ?", (key,))
+            conn.execute("DELETE FROM profile_fields WHERE user_id = ? AND field = ?", (key, PROGRESS_FIELD))
+            return version
+        if PROGRESS_FIELD not in stored:
+            # Marks an empty-but-present history so load() round-trips it.
+            self._write_fields(conn, key, {PROGRESS_FIELD: []})
+        stored_entries = [entry for (entry,) in conn.execute(
+            "SELECT entry FROM progress_entries WHERE user_id = ? ORDER BY seq", (key,)
+        )]
+        new_entries = [json.dumps(entry) for entry in progress]
+        if new_entries[:len(stored_entries)] != stored_entries:
+            conn.execute("DELETE FROM progress_entries WHERE user_id = ?", (key,))
+            stored_entries = []
+        # Stored seqs need not start at 1 once keep_last has trimmed the oldest rows.
+        self._append_entries(conn, key, progress[len(stored_entries):])
+        return version
+
+    def save(self, user_id, data, expected_version=None):
+        """
+        Store ``data`` as the full profile, writing only the rows that changed.
+
+        A progress_history that extends the stored one only inserts the new
+        tail; any other difference rewrites the user's progress rows.
+        """
+        conn = self._conn()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            return self._save_rows(conn, user_id, data, expected_version)
+
+    def save_many(self, items):
+        """
+        Save several profiles in a single transaction; see ProfileStore.save_many.
+        """
+        results = []
+        conn = self._conn()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            for user_id, data, expected_version in items:
+                # The version check runs before any row is written, so a
+                # conflict leaves nothing to roll back for that profile.
+                try:
+                    results.append(self._save_rows(conn, user_id, data, expected_version))
+                except ProfileVersionConflict as e:
+                    results.append(e)
+        return results
+
+    def update_fields(self, user_id, fields):
+        key = safe_user_id(user_id)
+        conn = self._conn()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            self._write_fields(conn, key, fields)
+            return self._bump_version(conn, key)
+
+    def append_progress(self, user_id, entry, fields=None, keep_last=None, merge=None):
+        key = safe_user_id(user_id)
+        conn = self._conn()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            fields = dict(fields or {})
+            for field, values in (merge or {}).items():
+                row = conn.execute(
+                    "SELECT value FROM profile_fields WHERE user_id = ? AND field = ?", (key, field)
+                ).fetchone()
+                fields[field] = _merged(json.loads(row[0]) if row else None, values)
+            self._append_entries(conn, key, [entry])
+            if keep_last is not None:
+                conn.execute(
+                    "DELETE FROM progress_entries WHERE user_id = ? AND seq <= ("
+                    " SELECT MAX(seq) FROM progress_entries WHERE user_id = ?) - ?",
+                    (key, key, keep_last),
+                )
+            self._write_fields(conn, key, dict(fields, **{PROGRESS_FIELD: []}))
+            return self._bump_version(conn, key)
+
+    def list_user_ids(self):
+        return [row[0] for row in self._conn().execute(
+            "SELECT DISTINCT user_id FROM profile_fields ORDER BY user_id"
+        )]
+
+    def fingerprint(self, user_id):
+        row = self._conn().execute(
+            "SELECT value FROM profile_fields WHERE user_id = ? AND field = ?", (safe_user_id(user_id), VERSION_FIELD)
+        ).fetchone()
+        return row[0] if row else None
+
+
+class CachedProfileStore(ProfileStore):
+    """
+    Bounded LRU cache of parsed profiles in front of another store.
+
+    Writes go straight to the backing store and drop the cached entry. Every load
+    first asks the backing store for the profile's fingerprint (a stat() for
+    JSON files, the version row for sqlite) and re-reads the profile only if
+    it changed, so writes made by other processes or by code that bypasses
+    this cache are still picked up. Callers get deep copies and may mutate
+    them freely.
+    """
+
+    def __init__(self, store, max_entries=1024):
+        self.store = store
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __getattr__(self, name):
+        return getattr(self.store, name)
+
+    def _put(self, key, fingerprint, profile):
+        with self._lock:
+            self._entries[key] = (fingerprint, profile)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(safe_user_id(user_id), None)
+
+    def load(self, user_id):
+        key = safe_user_id(user_id)
+        fingerprint = self.store.fingerprint(user_id)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and fingerprint is not None and entry[0] == fingerprint:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return copy.deepcopy(entry[1])
+            self.misses += 1
+        profile = self.store.load(user_id)
+        if fingerprint is not None:
+            self._put(key, fingerprint, copy.deepcopy(profile))
+        return profile
+
+    def _write_through(self, user_id, write):
+        try:
+            return write()
+        except BaseException:
+            self.invalidate(user_id)
+            raise
+
+    def save(self, user_id, data, expected_version=None):
+        # The saved data is not cached: the fingerprint read after the write
+        # could already belong to another worker's later write.
+        self.invalidate(user_id)
+        return self._write_through(user_id, lambda: self.store.save(user_id, data, expected_version))
+
+    def save_many(self, items):
+        items = list(items)
+        try:
+            return self.store.save_many(items)
+        finally:
+            for user_id, _, _ in items:
+                self.invalidate(user_id)
+
+    def update_fields(self, user_id, fields):
+        self.invalidate(user_id)
+        return self._write_through(user_id, lambda: self.store.update_fields(user_id, fields))
+
+    def append_progress(self, user_id, entry, fields=None, keep_last=None, merge=None):
+        self.invalidate(user_id)
+        return self._write_through(user_id,
+                                   lambda: self.store.append_progress(user_id, entry, fields, keep_last, merge))
+
+    def list_user_ids(self):
+        return self.store.list_user_ids()
+
+    def fingerprint(self, user_id):
+        return self.store.fingerprint(user_id)
+
+    def stats(self):
+        """
+        Return hit/miss/eviction counters and the current cache size.
+        """
+        with self._lock:
+            hits, misses = self.hits, self.misses
+            size, evictions = len(self._entries), self.evictions
+        total = hits + misses
+        return {
+            "entries": size,
+            "max_entries": self.max_entries,
+            "hits": hits,
+            "misses": misses,
+            "evictions": evictions,
+            "hit_rate": round(hits / total, 4) if total else 0.0,
+        }
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def create_profile_store(folder, backend=None):
+    """
+    Build a profile store for ``folder``.
+
+    Args:
+        folder (str): User data folder.
+        backend (str, optional): 'json' or 'sqlite'; defaults to PROFILE_STORE_BACKEND.
+
+    Returns:
+        ProfileStore: The configured backend, wrapped in a CachedProfileStore
+            unless PROFILE_CACHE_SIZE is 0.
+
+    Raises:
+        ValueError: If the backend name is unknown.
+    """
+    backend = (backend or os.getenv('PROFILE_STORE_BACKEND', 'json')).lower()
+    if backend == 'json':
+        store = JsonFileProfileStore(folder)
+    elif backend == 'sqlite':
+        store = SqliteProfileStore(os.getenv('PROFILE_DB_PATH') or os.path.join(folder, 'profiles.sqlite3'))
+    else:
+        raise ValueError(f"Unknown PROFILE_STORE_BACKEND: {backend}")
+
+    cache_size = int(os.getenv('PROFILE_CACHE_SIZE', '1024'))
+    return CachedProfileStore(store, max_entries=cache_size) if cache_size > 0 else store
+
+
+def get_profile_store(folder):
+    """
+    Return the process-wide profile store for ``folder``, creating it on first use.
+    """
+    key = os.path.abspath(folder)
+    store = _stores.get(key)
+    if store is None:
+        with _stores_lock:
+            store = _stores.get(key)
+            if store is None:
+                store = _stores[key] = create_profile_store(folder)
+    return store
@@ -0,0 +1,263 @@
+"""
+utils/progress_store.py
+
+Append-only, fixed-record progress history per user.
+
+Each user has a binary log of fixed-size records holding five float64
+columns: timestamp (Unix seconds, UTC), weight_kg, waist_cm, hip_cm and
+neck_cm, with NaN for a missing measurement. Appending writes one 40-byte
+record, and because records are fixed-size and kept in timestamp order a
+time-range query binary-searches the file and reads only the matching slice.
+"""
+
+import datetime
+import math
+import os
+import struct
+
+from utils.profile_store import file_lock, safe_user_id
+
+COLUMNS = ('timestamp', 'weight_kg', 'waist_cm', 'hip_cm', 'neck_cm')
+RECORD = struct.Struct('<' + 'd' * len(COLUMNS))
+
+
+def to_epoch(value):
+    """
+    Convert an ISO-8601 string, a profile 'YYYY-MM-DD_HH:MM' date or a number to Unix seconds.
+
+    Raises:
+        ValueError: If the value cannot be parsed.
+    """
+    if isinstance(value, (int, float)):
+        return float(value)
+    text = str(value).strip()
+    try:
+        return float(text)
+    except ValueError:
+        pass
+    text = text.replace('_', 'T')
+    if text.endswith('Z'):
+        text = text[:-1] + '+00:00'
+    parsed = datetime.datetime.fromisoformat(text)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=datetime.timezone.utc)
+    return parsed.timestamp()
+
+
+def to_iso(epoch):
+    """
+    Format Unix seconds as the 'YYYY-MM-DDTHH:MM:SS.ffffffZ' form used in profiles.
+    """
+    return datetime.datetime.utcfromtimestamp(epoch).isoformat() + "Z"
+
+
+def _number(value):
+    try:
+        return float(value) if value is not None else math.nan
+    except (TypeError, ValueError):
+        return math.nan
+
+
+def record_from_entry(entry):
+    """
+    Build a record tuple from a profile progress_history entry.
+
+    Accepts both the /track-progress shape (timestamp, weight_kg, measurements)
+    and older entries that carry a 'date' and keep the weight in measurements.
+
+    Raises:
+        ValueError: If the entry has no parseable timestamp.
+    """
+    measurements = entry.get('measurements') or {}
+    timestamp = entry.get('timestamp') or entry.get('date')
+    if timestamp is None:
+        raise ValueError("Progress entry has no timestamp")
+    weight = entry.get('weight_kg', measurements.get('weight_kg'))
+    return (
+        to_epoch(timestamp),
+        _number(weight),
+        _number(measurements.get('waist_cm')),
+        _number(measurements.get('hip_cm')),
+        _number(measurements.get('neck_cm')),
+    )
+
+
+def records_from_history(history):
+    """
+    Build records from a profile's progress_history, skipping entries that cannot be parsed.
+    """
+    records = []
+    for entry in history or []:
+        try:
+            records.append(record_from_entry(entry))
+        except (ValueError, TypeError, AttributeError):
+            continue
+    return records
+
+
+def _record_to_dict(values):
+    row = {'timestamp': to_iso(values[0])}
+    for name, value in zip(COLUMNS[1:], values[1:]):
+        row[name] = None if math.isnan(value) else value
+    return row
+
+
+def downsample(records, max_points):
+    """
+    Reduce records to at most ``max_points`` by averaging equal-width time buckets.
+
+    Each bucket is reported at the mean timestamp of its records, and missing
+    (NaN) measurements are ignored in the averages.
+
+    Args:
+        records (list): Record tuples in timestamp order.
+        max_points (int): Maximum number of output records.
+
+    Returns:
+        list: Downsampled record tuples.
+    """
+    if max_points <= 0 or len(records) <= max_points:
+        return list(records)
+    start, end = records[0][0], records[-1][0]
+    width = (end - start) / max_points or 1.0
+    buckets = {}
+    for record in records:
+        index = min(int((record[0] - start) / width), max_points - 1)
+        buckets.setdefault(index, []).append(record)
+
+    result = []
+    for index in sorted(buckets):
+        group = buckets[index]
+        averaged = []
+        for column in range(len(COLUMNS)):
+            values = [r[column] for r in group if not math.isnan(r[column])]
+            averaged.append(sum(values) / len(values) if values else math.nan)
+        result.append(tuple(averaged))
+    return result
+
+
+class ProgressStore:
+    """
+    Per-user append-only progress logs in ``folder``.
+    """
+
+    def __init__(self, folder):
+        self.folder = folder
+        os.makedirs(folder, exist_ok=True)
+
+    def path_for(self, user_id):
+        return os.path.join(self.folder, f"{safe_user_id(user_id)}.bin")
+
+    def count(self, user_id):
+        """
+        Return the number of records stored for the user.
+        """
+        try:
+            return os.path.getsize(self.path_for(user_id)) // RECORD.size
+        except FileNotFoundError:
+            return 0
+
+    def append(self, user_id, record):
+        """
+        Append one record tuple (timestamp first) for the user.
+
+        A timestamp older than the last stored one is raised to it, keeping
+        the log sorted for range queries even if clocks of different workers
+        disagree slightly.
+
+        Returns:
+            tuple: The record as stored.
+        """
+        path = self.path_for(user_id)
+        with file_lock(path + '.lock'):
+            with open(path, 'ab+') as f:
+                end = f.seek(0, os.SEEK_END)
+                size = end - end % RECORD.size
+                if size != end:
+                    # Drop a torn record left by a crash mid-write.
+                    f.truncate(size)
+                if size:
+                    f.seek(size - RECORD.size)
+                    last_timestamp = RECORD.unpack(f.read(RECORD.size))[0]
+                    if record[0] < last_timestamp:
+                        record = (last_timestamp,) + tuple(record[1:])
+                f.write(RECORD.pack(*record))
+        return tuple(record)
+
+    def append_entry(self, user_id, entry):
+        """
+        Append a profile-style progress entry (see ``record_from_entry``).
+        """
+        return self.append(user_id, record_from_entry(entry))
+
+    def replace_all(self, user_id, records):
+        """
+        Overwrite the user's log with ``records``, sorted by timestamp.
+        """
+        path = self.path_for(user_id)
+        data = b''.join(RECORD.pack(*record) for record in sorted(records, key=lambda r: r[0]))
+        with file_lock(path + '.lock'):
+            tmp_path = path + '.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+
+    def seed(self, user_id, records):
+        """
+        Write ``records`` as the user's log only if it has no records yet.
+
+        Returns:
+            bool: True if the log was seeded, False if it already had records.
+        """
+        path = self.path_for(user_id)
+        with file_lock(path + '.lock'):
+            if self.count(user_id):
+                return False
+            if records:
+                tmp_path = path + '.tmp'
+                with open(tmp_path, 'wb') as f:
+                    f.write(b''.join(RECORD.pack(*record) for record in sorted(records, key=lambda r: r[0])))
+                os.replace(tmp_path, path)
+            return True
+
+    def _timestamp_at(self, f, index):
+        f.seek(index * RECORD.size)
+        return struct.unpack('<d', f.read(8))[0]
+
+    def _lower_bound(self, f, count, timestamp):
+        low, high = 0, count
+        while low < high:
+            mid = (low + high) // 2
+            if self._timestamp_at(f, mid) < timestamp:
+                low = mid + 1
+            else:
+                high = mid
+        return low
+
+    def query(self, user_id, start=None, end=None, max_points=None):
+        """
+        Return the user's records with ``start <= timestamp <= end``.
+
+        Args:
+            user_id (str): User identifier.
+            start (float, optional): Lower bound in Unix seconds.
+            end (float, optional): Upper bound in Unix seconds.
+            max_points (int, optional): Downsample to at most this many records.
+
+        Returns:
+            list: Dicts with an ISO 'timestamp' and the measurement columns (None when missing).
+        """
+        count = self.count(user_id)
+        if not count:
+            return []
+        with open(self.path_for(user_id), 'rb') as f:
+            first = self._lower_bound(f, count, start) if start is not None else 0
+            last = self._lower_bound(f, count, math.nextafter(end, math.inf)) if end is not None else count
+            if last <= first:
+                return []
+            f.seek(first * RECORD.size)
+            records = list(RECORD.iter_unpack(f.read((last - first) * RECORD.size)))
+
+        if max_points:
+            records = downsample(records, max_points)
+        return [_record_to_dict(record) for record in records]
@@ -0,0 +1,258 @@
+"""
+utils/token_refresh.py
+
+Background refresh of OAuth access tokens ahead of their expiry.
+
+``TokenRefreshScheduler`` keeps a heap of tracked tokens ordered by when they
+are due (expiry minus a lead time). A single scheduler thread hands due
+tokens to a bounded thread pool for refreshing and reschedules them at their
+new expiry; refreshed tokens are buffered and written out together every
+``flush_interval`` seconds or once ``batch_size`` are waiting, instead of one
+write per refresh. What "refresh" and "persist" mean is supplied by the
+caller, so the scheduler knows nothing about Google or profile storage.
+
+Several processes sharing one token store pass the same ``lock_path``: only
+the scheduler holding that file lock refreshes, so N workers do not make N
+refresh calls per token. The others keep tracking tokens and take over
+when the holder's process exits and its lock is released.
+"""
+
+import datetime
+import heapq
+import itertools
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.profile_store import try_file_lock
+
+logger = logging.getLogger(__name__)
+
+
+def expiry_timestamp(expiry):
+    """
+    Convert a naive-UTC ``datetime`` expiry (as google.auth uses) to a Unix timestamp, or None.
+    """
+    if expiry is None:
+        return None
+    return expiry.replace(tzinfo=datetime.timezone.utc).timestamp()
+
+
+class TokenRefreshScheduler:
+    """
+    Refreshes tracked tokens shortly before they expire, with bounded concurrency and batched writes.
+    """
+
+    def __init__(self, refresh, persist, seed=None, lead_time=300.0, max_workers=4,
+                 flush_interval=5.0, batch_size=100, retry_delay=60.0, lock_path=None):
+        """
+        Args:
+            refresh (callable): ``refresh(key, token)`` -> ``(new token, expiry timestamp or None)``,
+                or None if the token can no longer be refreshed and should be dropped. May raise
+                to have the refresh retried after ``retry_delay``. A third element False marks a
+                token that is already stored (e.g. refreshed by another process), so it is only
+                rescheduled and not persisted again.
+            persist (callable): ``persist([(key, token), ...])`` writes refreshed tokens.
+            seed (callable, optional): Returns ``(key, token, expiry timestamp)`` tuples to track
+                on start; runs on the scheduler thread, so a slow scan does not delay start-up.
+            lead_time (float): Seconds before expiry at which a token is refreshed.
+            max_workers (int): Refreshes allowed in flight at once.
+            flush_interval (float): Longest time a refreshed token waits to be persisted.
+            batch_size (int): Buffered tokens that trigger an early flush.
+            retry_delay (float): Seconds before a failed refresh is retried, and between
+                attempts to take ``lock_path``.
+            lock_path (str, optional): File whose lock elects the one scheduler, among processes
+                sharing it, that refreshes; without it this scheduler always refreshes.
+        """
+        self.refresh = refresh
+        self.persist = persist
+        self.seed = seed
+        self.lead_time = lead_time
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.retry_delay = retry_delay
+        self.lock_path = lock_path
+        self._lock_file = None
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='token-refresh')
+        self._cond = threading.Condition()
+        self._heap = []
+        self._entries = {}
+        self._sequence = itertools.count()
+        self._pending = {}
+        self._thread = None
+        self._stopping = False
+        self.refreshed = 0
+        self.failed = 0
+        self.dropped = 0
+        self.adopted = 0
+        self.flushed = 0
+
+    def track(self, key, token, expiry, replace=True):
+        """
+        Schedule ``token`` for refresh ``lead_time`` seconds before ``expiry`` (a Unix timestamp).
+
+        Tracking a key again replaces its earlier schedule unless ``replace``
+        is False. Tokens without an expiry are refreshed right away so that
+        one becomes known.
+        """
+        due = time.time() if expiry is None else expiry - self.lead_time
+        with self._cond:
+            if not replace and key in self._entries:
+                return
+            sequence = next(self._sequence)
+            self._entries[key] = (sequence, token)
+            heapq.heappush(self._heap, (due, sequence, key))
+            self._cond.notify()
+
+    def untrack(self, key):
+        with self._cond:
+            self._entries.pop(key, None)
+
+    def start(self):
+        """
+        Start the scheduler thread (once).
+        """
+        with self._cond:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name='token-refresh-scheduler', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        """
+        Stop scheduling, wait for running refreshes and flush what they produced.
+        """
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self._executor.shutdown(wait=True)
+        self.flush()
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+
+    def _wait_for_lock(self):
+        """
+        Block until this scheduler holds ``lock_path``; returns False if stopped first.
+        """
+        while True:
+            lock_file = try_file_lock(self.lock_path)
+            with self._cond:
+                if self._stopping:
+                    if lock_file is not None:
+                        lock_file.close()
+                    return False
+                if lock_file is not None:
+                    self._lock_file = lock_file
+                    return True
+                self._cond.wait(self.retry_delay)
+
+    def _run(self):
+        if self.lock_path is not None and not self._wait_for_lock():
+            return
+        if self.seed is not None:
+            try:
+                for key, token, expiry in self.seed():
+                    self.track(key, token, expiry, replace=False)
+            except Exception:
+                logger.exception("Could not load tokens to refresh")
+
+        last_flush = time.monotonic()
+        while True:
+            with self._cond:
+                if self._stopping:
+                    return
+                now = time.time()
+                due = []
+                while self._heap and self._heap[0][0] <= now:
+                    _, sequence, key = heapq.heappop(self._heap)
+                    entry = self._entries.get(key)
+                    if entry is not None and entry[0] == sequence:
+                        due.append((key, sequence, entry[1]))
+                flush_wait = max(0.0, last_flush + self.flush_interval - time.monotonic())
+                if not due:
+                    next_due = self._heap[0][0] - now if self._heap else self.flush_interval
+                    self._cond.wait(min(next_due, flush_wait) if self._pending else next_due)
+
+            for key, sequence, token in due:
+                self._executor.submit(self._refresh_one, key, sequence, token)
+            if time.monotonic() - last_flush >= self.flush_interval:
+                self.flush()
+                last_flush = time.monotonic()
+
+    def _refresh_one(self, key, sequence, token):
+        try:
+            result = self.refresh(key, token)
+        except Exception as e:
+            logger.warning("Token refresh for %s failed, retrying in %.0fs: %s", key, self.retry_delay, e)
+            with self._cond:
+                self.failed += 1
+                if self._entries.get(key, (None,))[0] == sequence:
+                    heapq.heappush(self._heap, (time.time() + self.retry_delay, sequence, key))
+                    self._cond.notify()
+            return
+
+        if result is None:
+            with self._cond:
+                self.dropped += 1
+                if self._entries.get(key, (None,))[0] == sequence:
+                    del self._entries[key]
+            return
+
+        new_token, expiry, *rest = result
+        persist = rest[0] if rest else True
+        with self._cond:
+            if persist:
+                self.refreshed += 1
+            else:
+                self.adopted += 1
+            # A token tracked again meanwhile (e.g. a new OAuth grant) wins over this refresh.
+            if self._entries.get(key, (None,))[0] != sequence:
+                return
+            if persist:
+                self._pending[key] = new_token
+            flush_now = len(self._pending) >= self.batch_size
+        self.track(key, new_token, expiry)
+        if flush_now:
+            self.flush()
+
+    def flush(self):
+        """
+        Persist every buffered refreshed token in one ``persist`` call.
+        """
+        with self._cond:
+            if not self._pending:
+                return
+            batch, self._pending = list(self._pending.items()), {}
+        try:
+            self.persist(batch)
+        except Exception:
+            logger.exception("Could not persist %d refreshed tokens", len(batch))
+            with self._cond:
+                for key, token in batch:
+                    self._pending.setdefault(key, token)
+            return
+        with self._cond:
+            self.flushed += len(batch)
+
+    def stats(self):
+        """
+        Return tracked/pending counts, refresh outcomes and seconds until the next due refresh.
+        """
+        with self._cond:
+            live = [due for due, sequence, key in self._heap if self._entries.get(key, (None,))[0] == sequence]
+            return {
+                "tracked": len(self._entries),
+                "pending_writes": len(self._pending),
+                "refreshed": self.refreshed,
+                "failed": self.failed,
+                "dropped": self.dropped,
+                "adopted": self.adopted,
+                "flushed": self.flushed,
+                "leader": self.lock_path is None or self._lock_file is not None,
+                "next_due_in_s": round(min(live) - time.time(), 1) if live else None,
+                "running": self._thread is not None and self._thread.is_alive(),
+            }
@@ -0,0 +1,154 @@
+"""
+utils/uploads.py
+
+In-memory handling of uploaded photos.
+
+Uploads up to UPLOAD_SPILL_THRESHOLD bytes are buffered in memory by the
+request stream factory and handed to the analyzer as a ``memoryview`` of
+that buffer, so the photo is not written to a temp file, re-read and
+base64-encoded on the way to Gemini. Larger uploads spill to an anonymous
+temporary file, which is memory-mapped rather than read back. ``BufferReader``
+lets Pillow decode straight from that view. The image type is taken from the
+file's magic bytes rather than its extension.
+"""
+
+import io
+import mmap
+import os
+import tempfile
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+UPLOAD_SPILL_THRESHOLD = int(os.getenv('UPLOAD_SPILL_THRESHOLD', str(16 * 1024 * 1024)))
+
+# (offset, magic bytes, MIME type)
+_SIGNATURES = (
+    (0, b'\xff\xd8\xff', 'image/jpeg'),
+    (0, b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (0, b'GIF87a', 'image/gif'),
+    (0, b'GIF89a', 'image/gif'),
+    (8, b'WEBP', 'image/webp'),
+    (4, b'ftypheic', 'image/heic'),
+    (4, b'ftypheix', 'image/heic'),
+    (4, b'ftypmif1', 'image/heif'),
+    (4, b'ftypheif', 'image/heif'),
+)
+
+SNIFF_BYTES = 16
+
+
+def sniff_image_mime(header):
+    """
+    Detect the image type from the first bytes of a file.
+
+    Args:
+        header (bytes-like): At least the first SNIFF_BYTES bytes of the file.
+
+    Returns:
+        str or None: The MIME type, or None if the data is not a supported image.
+    """
+    header = bytes(header[:SNIFF_BYTES])
+    for offset, magic, mime_type in _SIGNATURES:
+        if header[offset:offset + len(magic)] == magic:
+            if mime_type == 'image/webp' and not header.startswith(b'RIFF'):
+                continue
+            return mime_type
+    return None
+
+
+def upload_stream_factory(total_content_length, content_type, filename=None, content_length=None):
+    """
+    Stream factory for multipart file fields: memory below the spill threshold, a temp file above it.
+
+    Chunked requests without a Content-Length always go to disk.
+    """
+    if total_content_length is None or total_content_length > UPLOAD_SPILL_THRESHOLD:
+        return tempfile.TemporaryFile('wb+')
+    return io.BytesIO()
+
+
+def _mapped(f):
+    """
+    Return a read-only ``memoryview`` of an open file's mapping; the map closes once the view is released.
+    """
+    f.flush()
+    if os.fstat(f.fileno()).st_size == 0:
+        return memoryview(b'')
+    return memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+
+def image_buffer(source):
+    """
+    Return a ``memoryview`` of an uploaded image without copying it.
+
+    In-memory buffers are viewed directly; files on disk (paths and spilled
+    uploads) are memory-mapped. Release the view
+    (``with image_buffer(...) as image:``) before the underlying upload is
+    closed; a BytesIO cannot be closed while exported.
+
+    Args:
+        source: A file path, a bytes-like object or a binary file object.
+
+    Returns:
+        memoryview: The image bytes.
+    """
+    if isinstance(source, (bytes, bytearray, memoryview, mmap.mmap)):
+        return memoryview(source)
+    if isinstance(source, str):
+        with open(source, 'rb') as f:
+            return _mapped(f)
+    if isinstance(source, io.BytesIO):
+        return source.getbuffer()
+    return _mapped(source)
+
+
+class BufferReader(io.RawIOBase):
+    """
+    Seekable binary file over a bytes-like object, for handing a memoryview to Pillow.
+
+    ``io.BytesIO(view)`` copies the whole buffer up front; this reader only
+    copies the chunks the decoder asks for.
+    """
+
+    def __init__(self, data):
+        super().__init__()
+        self._view = memoryview(data).cast('B')
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def read(self, size=-1):
+        start = min(self._pos, len(self._view))
+        end = len(self._view) if size is None or size < 0 else min(start + size, len(self._view))
+        self._pos = end
+        return bytes(self._view[start:end])
+
+    def readinto(self, buffer):
+        start = min(self._pos, len(self._view))
+        size = min(len(buffer), len(self._view) - start)
+        memoryview(buffer).cast('B')[:size] = self._view[start:start + size]
+        self._pos = start + size
+        return size
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += len(self._view)
+        if offset < 0:
+            raise ValueError(f"negative seek position {offset}")
+        self._pos = offset
+        return offset
+
+    def tell(self):
+        return self._pos
+
+    def close(self):
+        self._view.release()
+        super().close()